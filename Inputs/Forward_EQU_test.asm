@@ -0,0 +1,10 @@
+.text
+main:
+    li    r2, SMALL         # 34020010, SMALL is only defined below
+    la    r3, NEGATIVE      # 2403FFFB
+    addiu r4, r0, SMALL     # 24040010
+loop:
+    j     loop              # 08000003
+
+.equ SMALL = 0x10
+.equ NEGATIVE = -5
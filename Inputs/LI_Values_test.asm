@@ -0,0 +1,9 @@
+.text
+main:
+    li    r2, 0xFFFFFFFF    # 2402FFFF  addiu r2, r0, -1
+    li    r3, 0xFFFF8000    # 24038000  addiu r3, r0, -0x8000
+    li    r4, -1            # 2404FFFF  the same word as 0xFFFFFFFF
+    li    r5, 0xFFFF        # 3405FFFF  ori r5, r0, 0xFFFF
+    li    r6, 0xFFFF7FFF    # 3406FFFF 00063400 34C67FFF  still needs three
+    li    r7, 0x00010000    # 34070001 00073C00  ori/sll
+    jr    ra                # 03E00008
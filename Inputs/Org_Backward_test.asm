@@ -0,0 +1,10 @@
+.text
+main:
+    addiu r1, r0, 0x01      # 24010001 at 0x00
+    j     tail
+.org 0x10                   # jump ahead
+tail:
+    jr    ra                # 03E00008 at 0x40
+.org 0x04                   # back into the gap, 0x08-0x3F are still free
+    addiu r2, r0, 0x02      # 24020002 at 0x10
+    addiu r3, r0, 0x03      # 24030003 at 0x14
@@ -0,0 +1,10 @@
+.data
+.word 0x11223344
+.org 0x20                  # ram gap, 0x04-0x7F stay zero
+.byte 0xAA, 0xBB, 0xCC     # pad left = 00 AA BB CC
+
+.text
+main:
+    addiu r1, r0, 0x01      # 24010001 at 0x000
+.org 0x40                   # rom gap, 0x004-0x0FF stay zero
+    jr    ra                # 03E00008 at 0x100
@@ -1,17 +1,41 @@
+import argparse
+import contextlib
+import cProfile
+import io
 import os
 import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
 
 # MIPS Assembler, turns .asm files into instruction and data .hex files. By default we assume both memory units are 1kb, 1024 bytes = 256 words. 1 word = 4 bytes
-from src.Macro_Handler import expand_macros
-from src.Constant_Handler import process_constants
-from src.Label_Handler import process_labels
-from src.Encoder import encode_instruction
-from src.Utilities import write_output_file, encode_data_directives
-from src.Line_Parser import parse_lines
-#Function that outputs the file, 8 bits (one byte) per line
+# (see --rom-size/--ram-size)
+# The assembling itself happens in memory in src/Assembler.py, this file adds reading, caching and writing the files
+from src.Assembler import assemble, assemble_object, iter_rom_words
+from src.Macro_Handler import iter_expand_macros
+from src.Constant_Handler import ConstantTable, iter_process_constants
+from src.Label_Handler import Label_Table, iter_process_labels
+from src.Pseudo_Handler import iter_expand_pseudo_instructions
+from src.Utilities import write_output_file, write_output_data, iter_data_bytes, collect_asm_files, remove_file
+from src.Line_Parser import iter_parse_lines
+from src.Cache_Handler import cache_key, load_cached, store_cached
+from src.Include_Handler import find_includes
+from src.Memory_Image import Memory_Image, DEFAULT_MEMORY_SIZE
+from src.Output_Formats import output_formats, write_image, read_image
+from src.Disassembler import disassemble, format_listing, round_trip
+from src.Simulator import Simulator, Simulation_Error
+from src.Report import build_report, parse_latencies
+from src.Object_Handler import read_object
+from src.Linker import link
+from src.Profiler import Stage_Profiler
+from src.Server import Server_Options, serve_stdio, serve_socket
+from src.Source_Map import symbol_lines
+#Function that outputs the file, 8 bits (one byte) per line. Used by the streaming mode, the other paths go through write_image
 def write_hex_file(path, data_bytes, label):
 
-    hex_lines = [f"{byte:02X}" for byte in data_bytes]
+    hex_lines = (f"{byte:02X}" for byte in data_bytes)
     write_output_file(path, hex_lines, label)
 # returns the raw lines from the .asm file
 def read_asm_file(file_path):
@@ -22,81 +46,496 @@ def read_asm_file(file_path):
         print(f"❌ File not found: {file_path}")
         sys.exit(1)
 
-def main():
-    #Handles the error that no
-    if len(sys.argv) != 2:
-        print("Usage: python assembler.py path/to/input.asm")
+# yields the raw lines from the .asm file one at a time, used by the streaming mode
+def iter_asm_file(file_path):
+    try:
+        f = open(file_path, "r")
+    except FileNotFoundError:
+        print(f"❌ File not found: {file_path}")
         sys.exit(1)
+    with f:
+        yield from f
+
+# turns (address, word) pairs into the rom bytes in order, zero filling the gaps left by .org.
+# Used by the streaming mode when the words come in address order, which needs no memory image to place them in
+def iter_rom_bytes(rom_words, rom_size=None):
+    next_address = 0
+    for address, word in rom_words:
+        if address < next_address:
+            raise ValueError(f"ROM overlap: {hex(address)} was already written")
+        if rom_size is not None and address + 4 > rom_size:
+            raise ValueError(f"ROM overflow: {hex(address)}-{hex(address + 3)} does not fit in {rom_size} bytes")
+        yield from repeat(0x00, address - next_address)
+
+        # Convert the 32-bit word into 4 bytes - big endian - to process into the .hex file
+        yield (word >> 24) & 0xFF
+        yield (word >> 16) & 0xFF
+        yield (word >> 8) & 0xFF
+        yield word & 0xFF
+        next_address = address + 4
+
+# streaming version of main. Every stage is a generator, so only the macro bodies and the symbol tables stay in memory.
+# The source is read once to build the symbol tables, then again for the rom and again for the ram. A text .org that
+# goes back to a lower address puts the rom in a memory image first, the same as the default path.
+# Included files are parsed on the first pass and reused from the module cache after that
+def assemble_streaming(input_path, rom_path, ram_path, rom_size=DEFAULT_MEMORY_SIZE, ram_size=DEFAULT_MEMORY_SIZE, include_dirs=()):
+    base_dir = os.path.dirname(input_path)
+    # 1. Build the constant and label tables
+    constant_table = ConstantTable()
+    label_table = Label_Table()
+    lines = iter_process_constants(iter_parse_lines(iter_expand_macros(iter_asm_file(input_path), base_dir, include_dirs)), constant_table)
+    # a .org back into free rom is fine, but then the words can't be written out in order
+    in_order = True
+    next_address = 0
+    for line in iter_process_labels(iter_expand_pseudo_instructions(lines, constant_table), label_table):
+        if line.section == ".text" and line.mnemonic is not None:
+            if line.address < next_address:
+                in_order = False
+            next_address = line.address + 4
+
+    # 2. Encode the text section straight into the rom file, the tables are already complete. The pseudo-instructions
+    # are expanded with only the constants defined so far again, so the layout is the one the labels got in step 1
+    lines = iter_parse_lines(iter_expand_macros(iter_asm_file(input_path), base_dir, include_dirs))
+    known_constants = ConstantTable()
+    lines = iter_process_labels(iter_expand_pseudo_instructions(iter_process_constants(lines, known_constants), known_constants))
+    text_lines = (line for line in lines if line.section == ".text")
+    rom_words = iter_rom_words(text_lines, label_table, constant_table, late_constants=True)
+    if in_order:
+        write_hex_file(rom_path, iter_rom_bytes(rom_words, rom_size), "ROM")
+    else:
+        # placed in a sparse image like the default path does, which also reports real overlaps
+        rom = Memory_Image("ROM", rom_size)
+        for address, word in rom_words:
+            rom.write_word(address, word)
+        write_hex_file(rom_path, rom.to_bytes(), "ROM")
+
+    # 3. Encode the data section straight into the ram file. An error there takes the new rom file back out, like the
+    # default path a failed assembly leaves no images behind
+    lines = iter_parse_lines(iter_expand_macros(iter_asm_file(input_path), base_dir, include_dirs))
+    data_lines = (line for line in lines if line.section == ".data")
+    try:
+        write_hex_file(ram_path, iter_ram_bytes(iter_data_bytes(data_lines), ram_size), "RAM")
+    except BaseException:
+        remove_file(rom_path)
+        raise
+
+# passes the streamed ram bytes through, stopping once they overflow the ram
+def iter_ram_bytes(data_bytes, ram_size=None):
+    for address, byte in enumerate(data_bytes):
+        if ram_size is not None and address >= ram_size:
+            raise ValueError(f"RAM overflow: {hex(address)} does not fit in {ram_size} bytes")
+        yield byte
 
-    input_path = sys.argv[1]
+# assembles one .asm file into its rom/ram .hex files inside output_dir
+# with a cache_dir, unchanged sources skip the whole pipeline and the cached images are written out directly.
+# With a profiler every numbered stage is timed and measured, see src/Profiler.py.
+# source_map also writes <name>.srcmap and the symbol file <name>.sym (see src/Source_Map.py), it always assembles
+def assemble_file(input_path, output_dir="Outputs", stream=False, cache_dir=None,
+                  rom_size=DEFAULT_MEMORY_SIZE, ram_size=DEFAULT_MEMORY_SIZE, output_format="hex", profiler=None,
+                  include_dirs=(), single_pass=False, optimize=False, schedule=False, source_map=False):
     base = os.path.splitext(os.path.basename(input_path))[0]
-    #Change this if the path is different
-    rom_path = f"Outputs/{base}_rom.hex"
-    ram_path = f"Outputs/{base}_ram.hex"
+    # the format adds the file extension
+    rom_path = os.path.join(output_dir, f"{base}_rom")
+    ram_path = os.path.join(output_dir, f"{base}_ram")
+
+    if stream:
+        if output_format != "hex":
+            raise ValueError("--stream only writes the hex format")
+        if profiler is not None:
+            raise ValueError("--profile can't be used with --stream")
+        if single_pass:
+            raise ValueError("--single-pass can't be used with --stream")
+        if optimize:
+            raise ValueError("-O can't be used with --stream")
+        if schedule:
+            raise ValueError("--schedule can't be used with --stream")
+        if source_map:
+            raise ValueError("--source-map can't be used with --stream")
+        assemble_streaming(input_path, rom_path + ".hex", ram_path + ".hex", rom_size, ram_size, include_dirs)
+        return
+
+    if profiler is None:
+        profiler = Stage_Profiler(enabled=False)
 
     # 1. Reading the .asm file
-    raw_lines = read_asm_file(input_path)
+    with profiler.stage("read") as stage:
+        raw_lines = read_asm_file(input_path)
+        stage.items = len(raw_lines)
 
-    # 2.Expand macros
-    expanded_lines = expand_macros(raw_lines)
+    # options that change the output go into the cache key along with the source, and so does the choice of
+    # pipeline: --single-pass rejects some sources (a large .equ used by li before its definition) that the
+    # regular pipeline assembles, so their images can't be shared. --stream never gets here
+    options = {"rom_size": rom_size, "ram_size": ram_size, "pipeline": "single_pass" if single_pass else "default"}
+    if optimize:
+        options["optimize"] = sorted(optimize) if optimize is not True else True
+    if schedule:
+        options["schedule"] = True
+    if cache_dir:
+        with profiler.stage("cache_lookup") as stage:
+            # included files are part of the source, an edit to any of them has to miss
+            dependencies = find_includes(raw_lines, os.path.dirname(input_path), include_dirs)
+            key = cache_key("".join(raw_lines), options, dependencies)
+            # the cache only keeps the images, a source map needs the program assembled
+            cached = load_cached(cache_dir, key, rom_size, ram_size) if not source_map else None
+            stage.items = 1 if cached is not None else 0
+        if cached is not None:
+            rom, ram = cached
+            with profiler.stage("writing") as stage:
+                write_image(rom_path, rom, "ROM", output_format)
+                write_image(ram_path, ram, "RAM", output_format)
+                stage.items = len(rom) + len(ram)
+            return
 
-    # 3. Parse the lines into a list of dictionarys
-    parsed_lines = parse_lines(expanded_lines)
+    # 2-8. Assemble in memory, or all in one pass with single_pass
+    result = assemble(raw_lines, rom_size, ram_size, profiler, source_path=input_path,
+                      include_dirs=include_dirs, cache_dir=cache_dir, single_pass=single_pass, optimize=optimize,
+                      schedule=schedule, source_map=source_map)
+    rom, ram = result.rom_image, result.ram_image
+    for diagnostic in result.diagnostics:
+        print(f"{'⚠️' if diagnostic.severity == 'warning' else '✅'} {diagnostic.message}")
 
-    # 4. Process constants by generating the constant table and update the parsed line list
-    parsed_lines, constant_table = process_constants(parsed_lines)
+    if cache_dir:
+        with profiler.stage("cache_store"):
+            store_cached(cache_dir, key, rom, ram)
 
-    # 5. Process labels by generating the label table and update parsed line list
-    label_table, parsed_lines = process_labels(parsed_lines)
+    # 9. Write back the ram and rom files in the chosen format
+    with profiler.stage("writing") as stage:
+        write_image(rom_path, rom, "ROM", output_format)
+        write_image(ram_path, ram, "RAM", output_format)
+        stage.items = len(rom) + len(ram)
+        if source_map:
+            write_output_data(os.path.join(output_dir, f"{base}.srcmap"), result.source_map.to_bytes(), "Source map")
+            write_output_file(os.path.join(output_dir, f"{base}.sym"), symbol_lines(result.symbols, result.sections, result.constants),
+                              "Symbols")
 
-    # 6. Seperate text and data lines
-    text_lines = []
-    data_lines = []
-    for line in parsed_lines:
-        if line.get("section") == ".text" and "mnemonic":
-            text_lines.append(line)
-        elif line.get("section") == ".data":
-            data_lines.append(line)
+# runs inside a batch worker process. Output is captured and every error is caught so one bad file can't stop the batch
+def assemble_batch_file(input_path, options):
+    captured = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(captured):
+            assemble_file(input_path, **options)
+    except SystemExit:
+        # the ❌ message was already printed into the captured output
+        messages = [line for line in captured.getvalue().splitlines() if line.startswith("❌")]
+        return input_path, False, messages[-1] if messages else "assembly aborted"
+    except ValueError as e:
+        return input_path, False, f"❌ {e}"
+    except Exception as e:
+        return input_path, False, f"❌ {type(e).__name__}: {e}"
+    return input_path, True, ""
 
+# assembles many files across a process pool and prints one summary at the end. options are passed on to assemble_file
+def assemble_batch(sources, jobs=None, **options):
+    start = time.perf_counter()
+    input_paths = collect_asm_files(sources)
+    if not input_paths:
+        print("❌ No .asm files found")
+        return False
 
+    # small files finish quickly, so hand them to the workers in chunks
+    chunksize = max(1, len(input_paths) // ((jobs or os.cpu_count() or 1) * 4))
+    failures = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(partial(assemble_batch_file, options=options), input_paths, chunksize=chunksize)
+        for input_path, ok, message in results:
+            if not ok:
+                failures.append((input_path, message))
 
+    elapsed = time.perf_counter() - start
+    for input_path, message in failures:
+        print(f"{input_path}: {message}")
+    print(f"Batch: {len(input_paths) - len(failures)} succeeded, {len(failures)} failed, {len(input_paths)} files in {elapsed:.2f}s")
+    return not failures
 
-    # 7. Encode the text section into a list of rom bytes
-    rom_bytes = []
-    for i, line in enumerate(text_lines):
-        #skipping lines that ar enot valid
-        if "mnemonic" not in line:
-            continue
-        mnemonic = line["mnemonic"]
-        operands = line.get("operands", "")
-        #just incase the address is missing
-        address = line.get("address", i * 4)
+# assembles one file under --profile, then prints the report and writes the JSON/pstats files if asked for.
+# Memory is traced for the whole run so each stage only reports what it allocated on top of the earlier stages
+def profile_file(input_path, options, json_path=None, pstats_path=None):
+    profiler = Stage_Profiler()
+    cprofile = cProfile.Profile() if pstats_path else None
+    tracemalloc.start()
+    try:
+        if cprofile:
+            cprofile.enable()
+        assemble_file(input_path, profiler=profiler, **options)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        if cprofile:
+            cprofile.disable()
+        tracemalloc.stop()
 
+    print(profiler.format_table())
+    if json_path:
+        write_output_data(json_path, profiler.to_json() + "\n", "Profile")
+    if cprofile:
+        cprofile.dump_stats(pstats_path)
+        print(f"✅ pstats written to: {pstats_path}")
 
+# disassembles a rom image into <output_dir>/<name>_dis.asm. With symbols_source the program is assembled first,
+# so its labels mark the branch/jump targets and the absolute loads and stores
+def disassemble_file(image_path, output_dir="Outputs", symbols_source=None, rom_size=None, ram_size=None, include_dirs=()):
+    try:
+        data = read_image(image_path)
+    except OSError as e:
+        raise ValueError(f"Can't read {image_path}: {e}") from None
+    symbols = data_symbols = None
+    if symbols_source:
+        program = assemble(read_asm_file(symbols_source), rom_size, ram_size, source_path=symbols_source, include_dirs=include_dirs)
+        symbols, data_symbols = program.section_symbols(".text"), program.section_symbols(".data")
+
+    result = disassemble(data, symbols, data_symbols)
+    base = os.path.splitext(os.path.basename(image_path))[0]
+    write_output_data(os.path.join(output_dir, f"{base}_dis.asm"), format_listing(result, symbols, data_symbols), "Disassembly")
+    unknown = result.unknown_count()
+    if unknown:
+        print(f"⚠️ {unknown} of {len(result)} words are not instructions")
+
+# assembles a source, decodes its rom again and checks every word encodes back the same. Returns True if it does
+def round_trip_file(input_path, rom_size=None, ram_size=None, include_dirs=()):
+    result = assemble(read_asm_file(input_path), rom_size, ram_size, source_path=input_path, include_dirs=include_dirs)
+    mismatches = round_trip(result.rom, result.section_symbols(".text"), result.section_symbols(".data"))
+    words = len(result.rom) // 4
+    if not mismatches:
+        print(f"✅ {input_path}: {words} words round trip")
+        return True
+    for line, problem in mismatches:
+        print(f"❌ {input_path}: {line.address:08X}: {line.word:08X} {line.mnemonic or '?'} — {problem}")
+    print(f"❌ {input_path}: {len(mismatches)} of {words} words don't round trip")
+    return False
+
+# runs a program in the instruction set simulator and prints the registers it ends with.
+# .asm inputs are assembled first, anything else is read as a rom image (ram_image is its ram, empty without one).
+# With dump_ram the final ram is written to <output_dir>/<name>_ram_final.<ext>
+# With schedule the program runs with branch delay slots, a .asm source is scheduled for them first
+def simulate_file(input_path, max_steps=None, ram_image=None, output_dir="Outputs", output_format="hex", dump_ram=False,
+                  rom_size=DEFAULT_MEMORY_SIZE, ram_size=DEFAULT_MEMORY_SIZE, include_dirs=(), schedule=False):
+    source_map = None
+    if input_path.endswith(".asm"):
+        program = assemble(read_asm_file(input_path), rom_size, ram_size, source_path=input_path, include_dirs=include_dirs,
+                           schedule=schedule, source_map=True)
+        rom, ram = program.rom, program.ram
+        source_map = program.source_map
+    else:
         try:
-            word = encode_instruction(mnemonic, operands, label_table, constant_table, address)
-        except Exception as e:
-            print(f"❌ Error at line {i + 1}: {mnemonic} {operands} — {e}")
+            rom = read_image(input_path)
+            ram = read_image(ram_image) if ram_image else b""
+        except OSError as e:
+            raise ValueError(f"Can't read image: {e}") from None
+
+    simulator = Simulator(rom, ram, ram_size or DEFAULT_MEMORY_SIZE, delay_slots=schedule)
+    start = time.perf_counter()
+    try:
+        status = simulator.run(max_steps)
+    except Simulation_Error as e:
+        print(simulator.dump_registers())
+        # the source line of the instruction when the program was assembled here
+        where = f" ({source_map.format(source_map.lookup(simulator.pc), input_path)})" if source_map is not None else ""
+        raise ValueError(f"{e}: {simulator.current_instruction()}{where}") from None
+    elapsed = time.perf_counter() - start
+
+    print(simulator.dump_registers())
+    ips = simulator.steps / elapsed if elapsed else 0
+    if status == "limit":
+        print(f"⚠️ Stopped after {simulator.steps:,} instructions (--max-steps), pc {simulator.pc:08X}")
+    else:
+        print(f"✅ {input_path}: {status} after {simulator.steps:,} instructions ({ips / 1e6:.2f}M instructions/s)")
+    if dump_ram:
+        base = os.path.splitext(os.path.basename(input_path))[0]
+        final = Memory_Image.from_bytes("RAM", simulator.ram_bytes())
+        write_image(os.path.join(output_dir, f"{base}_ram_final"), final, "Final RAM", output_format)
+
+# assembles a source and prints its static performance report (see src/Report.py), latencies is "class=cycles,..."
+def report_file(input_path, latencies=None, rom_size=DEFAULT_MEMORY_SIZE, ram_size=DEFAULT_MEMORY_SIZE, include_dirs=()):
+    program = assemble(read_asm_file(input_path), rom_size, ram_size, source_path=input_path, include_dirs=include_dirs)
+    report = build_report(program, parse_latencies(latencies) if latencies else None)
+    print(input_path)
+    print(report.format_table())
+
+# assembles one module into the relocatable object <output_dir>/<name>.o for --link
+def compile_file(input_path, output_dir="Outputs", include_dirs=()):
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    object_path = os.path.join(output_dir, f"{base}.o")
+    module = assemble_object(read_asm_file(input_path), object_path, source_path=input_path, include_dirs=include_dirs)
+    write_output_data(object_path, module.to_bytes(), "Object")
+
+# links object files into the rom/ram images of one program, named after the first object
+def link_files(object_paths, output_dir="Outputs", output_format="hex", rom_size=DEFAULT_MEMORY_SIZE, ram_size=DEFAULT_MEMORY_SIZE):
+    modules = [read_object(path) for path in object_paths]
+    result = link(modules, rom_size, ram_size)
+    base = os.path.splitext(os.path.basename(object_paths[0]))[0]
+    write_image(os.path.join(output_dir, f"{base}_rom"), result.rom_image, "ROM", output_format)
+    write_image(os.path.join(output_dir, f"{base}_ram"), result.ram_image, "RAM", output_format)
+    relocations = sum(len(module.relocation_offsets) for module in modules)
+    print(f"✅ Linked {len(modules)} object{'s' if len(modules) != 1 else ''}: {len(result.rom_image):,} bytes of text, {len(result.ram_image):,} bytes of data, "
+          f"{relocations:,} relocations")
+
+# memory sizes are given in bytes, 0 turns the limit off
+def memory_size(text):
+    size = int(text, 0)
+    if size < 0:
+        raise argparse.ArgumentTypeError("size must be positive")
+    return size or None
+
+def main():
+    parser = argparse.ArgumentParser(usage="python assembler.py path/to/input.asm [--stream | --single-pass | -O] [--schedule] [--source-map]\n"
+                                           "       python assembler.py -c SOURCE.asm ...\n"
+                                           "       python assembler.py --link OBJECT.o ...\n"
+                                           "       python assembler.py --batch DIR|GLOB|@MANIFEST ... [--jobs N]\n"
+                                           "       python assembler.py --serve [--socket PATH] [--jobs N]\n"
+                                           "       python assembler.py --disassemble IMAGE ... [--symbols SOURCE.asm]\n"
+                                           "       python assembler.py --round-trip SOURCE.asm ...\n"
+                                           "       python assembler.py --simulate SOURCE.asm|ROM_IMAGE [--ram-image RAM_IMAGE] [--max-steps N] [--dump-ram] [--schedule]\n"
+                                           "       python assembler.py --report SOURCE.asm ... [--latency CLASS=CYCLES,...]")
+    parser.add_argument("inputs", nargs="*")
+    parser.add_argument("--disassemble", action="store_true", help="the inputs are rom images (.hex, .mem, .ihex, .bin), write them back as source to <name>_dis.asm")
+    parser.add_argument("--symbols", default=None, metavar="SOURCE", help="with --disassemble, assemble SOURCE and use its labels in the output")
+    parser.add_argument("--round-trip", action="store_true", help="assemble the inputs, decode the rom again and check that every word encodes back the same")
+    parser.add_argument("--simulate", action="store_true", help="run the program (a .asm source or a rom image) in the instruction set simulator and print the registers")
+    parser.add_argument("--ram-image", default=None, metavar="PATH", help="with --simulate on a rom image, the ram image to start from")
+    parser.add_argument("--max-steps", type=int, default=10_000_000, metavar="N", help="with --simulate, stop after N instructions (default: 10000000)")
+    parser.add_argument("--dump-ram", action="store_true", help="with --simulate, write the final ram to <name>_ram_final in --format")
+    parser.add_argument("--report", action="store_true", help="print code size, loops, a cycle estimate and the load-use hazards of every input")
+    parser.add_argument("--latency", default=None, metavar="CLASS=CYCLES,...", help="with --report, cycles per instruction class, e.g. mult=5,load=2 "
+                        "(classes: alu, shift, mult, hilo, load, store, branch, jump, load_use)")
+    parser.add_argument("--stream", action="store_true", help="run every stage as a generator to keep memory use flat")
+    parser.add_argument("--single-pass", action="store_true", help="encode every instruction as soon as it is read, forward references are patched in once defined")
+    parser.add_argument("-O", dest="optimize", action="store_true", help="remove wasted instructions with the peephole optimizer (see src/Peephole_Optimizer.py)")
+    parser.add_argument("--peephole-rules", default=None, metavar="RULE,...", help="only run these peephole rules (implies -O): "
+                        "self_move, dead_write, store_load, load_store, jump_next")
+    parser.add_argument("--schedule", action="store_true", help="fill the branch delay slots and reorder around load-use stalls for the pipelined core "
+                        "(see src/Scheduler.py), with --simulate run with delay slots")
+    parser.add_argument("--source-map", action="store_true", help="also write <name>.srcmap, where every rom address came from in the source, "
+                        "and the symbol file <name>.sym (see src/Source_Map.py)")
+    parser.add_argument("-c", dest="compile", action="store_true", help="assemble every input into a relocatable object <name>.o for --link")
+    parser.add_argument("--link", action="store_true", help="link the object files into one rom/ram image named after the first one, "
+                        "laid out in the order given (see src/Linker.py)")
+    parser.add_argument("--batch", action="store_true", help="assemble every file matched by the inputs across a process pool")
+    parser.add_argument("--jobs", type=int, default=None, help="number of worker processes for --batch, or threads for --serve (default: CPU count)")
+    parser.add_argument("--serve", action="store_true", help="keep running and assemble JSON requests from stdin, one per line (see src/Server.py)")
+    parser.add_argument("--socket", default=None, metavar="PATH", help="with --serve, take the requests on a Unix socket at PATH instead of stdin")
+    #Change this if the path is different
+    parser.add_argument("--output-dir", default="Outputs")
+    parser.add_argument("--format", dest="output_format", choices=sorted(output_formats), default="hex",
+                        help="hex: one byte per line, readmemh: one word per line, ihex: Intel HEX, bin: raw binary, mif/coe: Quartus/Xilinx memory files")
+    parser.add_argument("--cache-dir", default=None, help="reuse the images of unchanged sources and the parsed included files from this directory (not used with --stream)")
+    parser.add_argument("-I", "--include-dir", dest="include_dirs", action="append", default=[], metavar="DIR",
+                        help="search DIR for .include files after the directory of the including file, can be repeated")
+    parser.add_argument("--rom-size", type=memory_size, default=DEFAULT_MEMORY_SIZE, help="instruction memory size in bytes, 0 for no limit (default: 1024)")
+    parser.add_argument("--ram-size", type=memory_size, default=DEFAULT_MEMORY_SIZE, help="data memory size in bytes, 0 for no limit (default: 1024)")
+    parser.add_argument("--profile", action="store_true", help="print the time, peak memory and item count of every stage and the encode time per instruction type")
+    parser.add_argument("--profile-json", default=None, metavar="PATH", help="write the --profile report as JSON (implies --profile)")
+    parser.add_argument("--profile-pstats", default=None, metavar="PATH", help="also run under cProfile and dump the pstats file (implies --profile)")
+    args = parser.parse_args()
+
+    options = {
+        "output_dir": args.output_dir,
+        "stream": args.stream,
+        "cache_dir": args.cache_dir,
+        "rom_size": args.rom_size,
+        "ram_size": args.ram_size,
+        "output_format": args.output_format,
+        "include_dirs": tuple(args.include_dirs),
+        "single_pass": args.single_pass,
+        "optimize": args.peephole_rules.split(",") if args.peephole_rules else args.optimize,
+        "schedule": args.schedule,
+        "source_map": args.source_map,
+    }
+
+    profiling = args.profile or args.profile_json or args.profile_pstats
+    if profiling and (args.batch or args.stream):
+        parser.error("--profile works on a single file without --batch or --stream")
+    if args.single_pass and args.stream:
+        parser.error("--single-pass and --stream can't be used together")
+    if options["optimize"] and (args.single_pass or args.stream):
+        parser.error("-O can't be used with --single-pass or --stream")
+    if args.schedule and (args.single_pass or args.stream):
+        parser.error("--schedule can't be used with --single-pass or --stream")
+    if args.source_map and (args.single_pass or args.stream):
+        parser.error("--source-map can't be used with --single-pass or --stream")
+
+    if args.serve:
+        if args.inputs or args.batch or args.stream or profiling:
+            parser.error("--serve takes its sources from the requests, without inputs, --batch, --stream or --profile")
+        serve_options = Server_Options(args.rom_size, args.ram_size, args.include_dirs, args.cache_dir)
+        try:
+            if args.socket:
+                serve_socket(args.socket, serve_options, args.jobs)
+            else:
+                serve_stdio(serve_options, args.jobs)
+        except (OSError, ValueError) as e:
+            print(f"❌ {e}", file=sys.stderr)
             sys.exit(1)
+        return
+    if args.socket:
+        parser.error("--socket only works with --serve")
+    if args.symbols and not args.disassemble:
+        parser.error("--symbols only works with --disassemble")
+    if not args.inputs:
+        parser.error("an input file is expected")
 
-        # Convert the 32-bit word into 4 bytes - big endian - to process into the .hex file
-        rom_bytes.extend([
-            (word >> 24) & 0xFF,
-            (word >> 16) & 0xFF,
-            (word >> 8) & 0xFF,
-            word & 0xFF
-        ])
+    if (args.ram_image or args.dump_ram) and not args.simulate:
+        parser.error("--ram-image and --dump-ram only work with --simulate")
+    if args.latency and not args.report:
+        parser.error("--latency only works with --report")
+    if args.schedule and (args.disassemble or args.round_trip or args.report):
+        parser.error("--schedule can't be used with --disassemble, --round-trip or --report")
 
-    # 8. Encode the data into ram bytes to process into the.hex file
-    ram_bytes = encode_data_directives(data_lines)
+    modes = args.disassemble + args.round_trip + args.simulate + args.report + args.compile + args.link
+    if modes:
+        if args.source_map:
+            parser.error("--source-map only works when assembling, without --disassemble, --round-trip, --simulate, --report, -c or --link")
+        if modes > 1:
+            parser.error("only one of --disassemble, --round-trip, --simulate, --report, -c and --link can be used")
+        if args.batch or args.stream or profiling:
+            parser.error("--disassemble, --round-trip, --simulate, --report, -c and --link can't be combined with --batch, --stream or --profile")
+        if (args.compile or args.link) and (args.single_pass or options["optimize"] or args.schedule):
+            parser.error("-c and --link can't be used with --single-pass, -O or --schedule")
+        if args.link:
+            try:
+                link_files(args.inputs, args.output_dir, args.output_format, args.rom_size, args.ram_size)
+            except ValueError as e:
+                print(f"❌ {e}")
+                sys.exit(1)
+            return
+        ok = True
+        for input_path in args.inputs:
+            try:
+                if args.compile:
+                    compile_file(input_path, args.output_dir, options["include_dirs"])
+                elif args.disassemble:
+                    disassemble_file(input_path, args.output_dir, args.symbols, args.rom_size, args.ram_size, options["include_dirs"])
+                elif args.simulate:
+                    simulate_file(input_path, args.max_steps, args.ram_image, args.output_dir, args.output_format,
+                                  args.dump_ram, args.rom_size, args.ram_size, options["include_dirs"], args.schedule)
+                elif args.report:
+                    report_file(input_path, args.latency, args.rom_size, args.ram_size, options["include_dirs"])
+                else:
+                    ok = round_trip_file(input_path, args.rom_size, args.ram_size, options["include_dirs"]) and ok
+            except ValueError as e:
+                print(f"❌ {e}")
+                ok = False
+        if not ok:
+            sys.exit(1)
+        return
 
-    # 9. Write back the ram and rom .hex files
-    write_hex_file(rom_path, rom_bytes, "ROM")
-    write_hex_file(ram_path, ram_bytes, "RAM")
+    if args.batch:
+        if not assemble_batch(args.inputs, args.jobs, **options):
+            sys.exit(1)
+        return
+
+    if len(args.inputs) != 1:
+        parser.error("exactly one input file is expected without --batch")
+    if profiling:
+        profile_file(args.inputs[0], options, args.profile_json, args.profile_pstats)
+        return
+    try:
+        assemble_file(args.inputs[0], **options)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
 
 
 
 if __name__ == '__main__':
     main()
-
-
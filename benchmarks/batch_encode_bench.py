@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+import time
+
+# NumPy batch encoder against the per-instruction encoder, on the text section of a generated program
+# run from the repo root: python benchmarks/batch_encode_bench.py [--lines 1000000] [--repeat 3]
+# the program is parsed and its labels processed once, only stage 7 (encoding into the rom image) is timed.
+# The two roms have to match byte for byte
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.Assembler import iter_rom_words
+from src.Batch_Encoder import encode_text_batch, write_words, np
+from src.Macro_Handler import expand_macros
+from src.Line_Parser import parse_lines
+from src.Constant_Handler import process_constants
+from src.Label_Handler import process_labels
+from src.Memory_Image import Memory_Image
+from workload_gen import generate_program
+
+
+def best_time(step, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = step()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+# the path run_pipeline takes without NumPy, one encode and one write per word
+def encode_scalar(text_lines, label_table, constant_table):
+    rom = Memory_Image("ROM", None)
+    for address, word in iter_rom_words(text_lines, label_table, constant_table, memoize=True):
+        rom.write_word(address, word)
+    return rom
+
+def encode_batch(text_lines, label_table, constant_table):
+    batch = encode_text_batch(text_lines, label_table, constant_table)
+    if batch is None:
+        sys.exit("❌ the batch encoder did not take the program")
+    rom = Memory_Image("ROM", None)
+    write_words(rom, *batch)
+    return rom
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the batch and per-instruction text encoders")
+    parser.add_argument("--lines", type=int, default=1_000_000, help="size of the generated program (default: 1000000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per encoder, the fastest is kept")
+    args = parser.parse_args()
+    if np is None:
+        sys.exit("❌ NumPy is not installed")
+
+    parsed_lines = parse_lines(expand_macros(generate_program(args.lines)))
+    parsed_lines, constant_table = process_constants(parsed_lines)
+    label_table, parsed_lines = process_labels(parsed_lines)
+    text_lines = [line for line in parsed_lines if line.section == ".text"]
+
+    scalar, scalar_time = best_time(lambda: encode_scalar(text_lines, label_table, constant_table), args.repeat)
+    batch, batch_time = best_time(lambda: encode_batch(text_lines, label_table, constant_table), args.repeat)
+    if scalar.to_bytes() != batch.to_bytes():
+        sys.exit("❌ batch and per-instruction roms differ")
+
+    words = len(scalar) // 4
+    print(f"{words:,} instructions")
+    print(f"per instruction {scalar_time * 1e3:9.1f} ms ({words / scalar_time:12,.0f} instr/s)")
+    print(f"batch           {batch_time * 1e3:9.1f} ms ({words / batch_time:12,.0f} instr/s)")
+    print(f"speedup         {scalar_time / batch_time:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
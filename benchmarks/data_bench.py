@@ -0,0 +1,69 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# a lookup table embedded in .data, written out as .byte lists against .incbin of the same bytes, and .fill against
+# the .word list it replaces. run from the repo root: python benchmarks/data_bench.py [--kilobytes 512] [--repeat 3]
+# the ram images have to be the same
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.Assembler import assemble
+
+
+def best_of(repeat, function):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def run(source, source_path):
+    return assemble(source, rom_size=None, ram_size=None, source_path=source_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare .byte/.word lists with .incbin and .fill")
+    parser.add_argument("--kilobytes", type=int, default=512, help="size of the table (default: 512)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, the fastest is kept")
+    args = parser.parse_args()
+
+    size = args.kilobytes * 1024
+    table = random.Random(1).randbytes(size)
+    text = ".text\nmain: la r2, table\n"
+
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "table.asm")
+        with open(os.path.join(directory, "table.bin"), "wb") as f:
+            f.write(table)
+
+        # 16 bytes per line like a generated table would be
+        lines = [".data", "table:"] + [".byte " + ", ".join(str(b) for b in table[i:i + 16]) for i in range(0, size, 16)]
+        modes = [
+            (".byte", "\n".join(lines) + "\n" + text),
+            (".incbin", '.data\ntable: .incbin "table.bin"\n' + text),
+        ]
+        images = []
+        for name, source in modes:
+            elapsed, result = best_of(args.repeat, lambda: run(source, source_path))
+            images.append(result.ram)
+            print(f"{name:<8} {elapsed * 1e3:9.1f} ms ({size / elapsed / 2**20:8.1f} MiB/s)")
+        if images[0] != images[1]:
+            sys.exit("❌ .byte and .incbin images differ")
+
+        words = size // 4
+        lines = [".data", "table:"] + [".word " + ", ".join(["0x12345678"] * 16) for _ in range(words // 16)]
+        images = []
+        for name, source in ((".word", "\n".join(lines) + "\n" + text), (".fill", f".data\ntable: .fill {words // 16 * 16}, 4, 0x12345678\n" + text)):
+            elapsed, result = best_of(args.repeat, lambda: run(source, source_path))
+            images.append(result.ram)
+            print(f"{name:<8} {elapsed * 1e3:9.1f} ms ({size / elapsed / 2**20:8.1f} MiB/s)")
+        if images[0] != images[1]:
+            sys.exit("❌ .word and .fill images differ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+import time
+
+# decode speed of the disassembler on a generated rom image, with and without NumPy
+# run from the repo root: python benchmarks/disasm_bench.py [--megabytes 4] [--lines 100000]
+# a program of --lines lines is assembled once and its rom repeated up to --megabytes, the random registers and
+# immediates of generated code make most words distinct, which is the slow case for the decoder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.Disassembler as disassembler
+from src.Assembler import assemble
+from workload_gen import generate_program
+
+
+def best_time(step, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = step()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the disassembler on a generated rom image")
+    parser.add_argument("--megabytes", type=float, default=4, help="size of the image (default: 4)")
+    parser.add_argument("--lines", type=int, default=100_000, help="size of the generated program (default: 100000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest is kept")
+    args = parser.parse_args()
+
+    rom = assemble(generate_program(args.lines), rom_size=None, ram_size=None).rom
+    size = int(args.megabytes * 1_000_000) // 4 * 4
+    image = (rom * (size // len(rom) + 1))[:size]
+    print(f"{len(image) / 1e6:.2f} MB, {len(image) // 4:,} words")
+
+    numpy = disassembler.np
+    cases = [("numpy", numpy), ("pure python", None)] if numpy is not None else [("pure python", None)]
+    listings = []
+    for name, module in cases:
+        disassembler.np = module
+        result, decode_time = best_time(lambda: disassembler.disassemble(image), args.repeat)
+        listing, format_time = best_time(lambda: disassembler.format_listing(result), 1)
+        listings.append(listing)
+        print(f"{name:<12} decode {decode_time * 1e3:9.1f} ms ({len(image) / decode_time / 1e6:6.1f} MB/s)"
+              f"   listing {format_time * 1e3:9.1f} ms")
+    disassembler.np = numpy
+
+    if len(set(listings)) > 1:
+        sys.exit("❌ NumPy and pure python listings differ")
+
+
+if __name__ == "__main__":
+    main()
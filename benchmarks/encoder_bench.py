@@ -0,0 +1,168 @@
+import os
+import sys
+import timeit
+
+# micro benchmark for the compiled encoder table in src/Encoder.py
+# run from the repo root: python benchmarks/encoder_bench.py [repeat count]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.Encoder import encode_instruction, instruction_map, get_register_number
+from src.Label_Handler import Label_Table
+from src.Line_Parser import parse_operands, tokenize
+
+# sample lines covering every operand shape, labels and constants included
+SAMPLE = [
+    ("addu", "r3, r1, r2"),
+    ("subu", "r4, r1, r2"),
+    ("sll", "r15, r1, 4"),
+    ("jr", "ra"),
+    ("mflo", "r19"),
+    ("addiu", "r1, r0, SIZE"),
+    ("ori", "r4, r0, 0x1234"),
+    ("beq", "r1, r2, loop"),
+    ("bgez", "r1, loop"),
+    ("j", "loop"),
+    ("lw", "r3, array(r0)"),
+    ("sw", "r20, 4(sp)"),
+]
+
+
+# the per-line dispatch used before the table was compiled, kept here as the reference
+def legacy_encode_instruction(mnemonic, operands, label_table=None, constants={}, current_address=0):
+    info = instruction_map.get(mnemonic)
+    if not info:
+        raise ValueError(f"Unknown instruction: {mnemonic}")
+
+    instr_type = info["type"]
+    if instr_type == "R-type":
+        return legacy_encode_r_type(mnemonic, operands, info)
+    elif instr_type == "I-type":
+        return legacy_encode_i_type(mnemonic, operands, info, constants)
+    elif instr_type == "Branch":
+        return legacy_encode_branch(mnemonic, operands, info, label_table, current_address, constants)
+    elif instr_type == "Jump":
+        return legacy_encode_jump(mnemonic, operands, info, label_table, constants)
+    elif instr_type == "Memory":
+        return legacy_encode_memory(mnemonic, operands, info, constants, label_table)
+    raise ValueError(f"Unsupported instruction type: {instr_type}")
+
+
+def legacy_encode_r_type(mnemonic, operands, info):
+    funct = int(info["funct"], 16)
+    rs = rt = rd = shamt = 0
+    if mnemonic in ["sll", "srl", "sra"]:
+        rd_str, rt_str, shamt_str = [x.strip() for x in operands.split(",")]
+        rd = get_register_number(rd_str)
+        rt = get_register_number(rt_str)
+        shamt = int(shamt_str, 0)
+    elif mnemonic == "jr":
+        rs = get_register_number(operands.strip())
+    elif mnemonic in ["mfhi", "mflo"]:
+        rd = get_register_number(operands.strip())
+    else:
+        rd_str, rs_str, rt_str = [x.strip() for x in operands.split(",")]
+        rd = get_register_number(rd_str)
+        rs = get_register_number(rs_str)
+        rt = get_register_number(rt_str)
+    return (rs << 21) | (rt << 16) | (rd << 11) | (shamt << 6) | funct
+
+
+def legacy_encode_i_type(mnemonic, operands, info, constants={}):
+    rt_str, rs_str, imm_str = [x.strip() for x in operands.split(",")]
+    rt = get_register_number(rt_str)
+    rs = get_register_number(rs_str)
+    imm = constants[imm_str] if imm_str in constants else int(imm_str, 0)
+    opcode = int(info["opcode"], 16)
+    return (opcode << 26) | (rs << 21) | (rt << 16) | (imm & 0xFFFF)
+
+
+def legacy_encode_branch(mnemonic, operands, info, label_table, current_address, constants={}):
+    parts = [x.strip() for x in operands.split(",")]
+    if mnemonic in ["beq", "bne"]:
+        rs = get_register_number(parts[0])
+        rt = get_register_number(parts[1])
+        target_str = parts[2]
+    elif mnemonic in ["bgez", "bltz"]:
+        rs = get_register_number(parts[0])
+        rt = 1 if mnemonic == "bgez" else 0
+        target_str = parts[1]
+    else:
+        rs = get_register_number(parts[0])
+        rt = 0
+        target_str = parts[1]
+
+    if target_str in label_table.table:
+        target_address = label_table.get(target_str)
+    elif target_str in constants:
+        target_address = constants[target_str] * 4
+    else:
+        target_address = int(target_str, 0) * 4
+    offset = (target_address - (current_address + 4)) // 4
+    opcode = int(info["opcode"], 16)
+    return (opcode << 26) | (rs << 21) | (rt << 16) | (offset & 0xFFFF)
+
+
+def legacy_encode_jump(mnemonic, operands, info, label_table, constants):
+    opcode = int(info["opcode"], 16)
+    operand = operands.strip()
+    if label_table and operand in label_table.table:
+        target = label_table[operand] >> 2
+    elif operand in constants:
+        target = constants[operand]
+    else:
+        target = int(operand, 0)
+    return (opcode << 26) | (target & 0x03FFFFFF)
+
+
+def legacy_encode_memory(mnemonic, operands, info, constants={}, label_table=None):
+    rt_str, mem_expr = [x.strip() for x in operands.split(",")]
+    offset_str, rs_str = mem_expr.replace(")", "").split("(")
+    rt = get_register_number(rt_str)
+    rs = get_register_number(rs_str.strip())
+    offset_str = offset_str.strip()
+    if label_table and offset_str in label_table.table:
+        offset = label_table.get(offset_str)
+    elif offset_str in constants:
+        offset = constants[offset_str] * 4
+    else:
+        offset = int(offset_str, 0) * 4
+    opcode = int(info["opcode"], 16)
+    return (opcode << 26) | (rs << 21) | (rt << 16) | (offset & 0xFFFF)
+
+
+# the compiled encoders take the operands the parser already typed, the legacy path re-splits the text
+TOKENIZED = [(mnemonic, parse_operands(tokenize(operands))) for mnemonic, operands in SAMPLE]
+
+
+def run(encode, sample, label_table, constants):
+    for address, (mnemonic, operands) in enumerate(sample):
+        encode(mnemonic, operands, label_table, constants, address * 4)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    label_table = Label_Table()
+    label_table.add_label("loop", 0x10)
+    label_table.add_label("array", 0x20)
+    constants = {"SIZE": 4}
+
+    # both paths have to agree before the timings mean anything
+    for address, ((mnemonic, operands), (_, tokens)) in enumerate(zip(SAMPLE, TOKENIZED)):
+        new = encode_instruction(mnemonic, tokens, label_table, constants, address * 4)
+        old = legacy_encode_instruction(mnemonic, operands, label_table, constants, address * 4)
+        if new != old:
+            raise SystemExit(f"Mismatch on {mnemonic} {operands}: {new:08X} != {old:08X}")
+
+    count = repeat * len(SAMPLE)
+    old_time = timeit.timeit(lambda: run(legacy_encode_instruction, SAMPLE, label_table, constants), number=repeat)
+    new_time = timeit.timeit(lambda: run(encode_instruction, TOKENIZED, label_table, constants), number=repeat)
+
+    print(f"{count} instructions per path")
+    print(f"legacy dispatch : {old_time:.3f}s ({count / old_time:,.0f} instr/s)")
+    print(f"compiled table  : {new_time:.3f}s ({count / new_time:,.0f} instr/s)")
+    print(f"speedup         : {old_time / new_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
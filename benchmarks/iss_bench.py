@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import time
+
+# instructions per second of the instruction set simulator
+# run from the repo root: python benchmarks/iss_bench.py [--words 256] [--repeat 3]
+# the kernel fills a ram array with xorshift values, bubble sorts it and sums it through mult/mflo, so the mix has
+# ALU ops, shifts, loads/stores, taken and untaken branches and HI/LO. The sorted array is checked after every run
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.Assembler import assemble
+from src.Simulator import Simulator
+
+KERNEL = """
+.data
+.equ WORDS = {words}
+arr: .space {words}
+.text
+main:
+    addiu r1, r0, 0             # byte offset
+    addiu r3, r0, WORDS
+    sll r3, r3, 2               # array size in bytes
+    addiu r4, r0, 12345         # xorshift state
+fill:
+    sll r5, r4, 13
+    xor r4, r4, r5
+    srl r5, r4, 17
+    xor r4, r4, r5
+    sll r5, r4, 5
+    xor r4, r4, r5
+    sw r4, arr(r1)
+    addiu r1, r1, 4
+    bne r1, r3, fill
+
+    addiu r7, r3, -4            # last pair starts here
+outer:
+    addiu r5, r0, 0             # swapped
+    addiu r6, r0, 0
+inner:
+    addiu r10, r6, 4
+    lw r8, arr(r6)
+    lw r9, arr(r10)
+    sltu r11, r9, r8
+    beq r11, r0, noswap
+    sw r9, arr(r6)
+    sw r8, arr(r10)
+    addiu r5, r0, 1
+noswap:
+    addiu r6, r6, 4
+    bne r6, r7, inner
+    bne r5, r0, outer
+
+    addiu r1, r0, 0
+    addiu r12, r0, 0
+sum:
+    lw r13, arr(r1)
+    multu r13, r13
+    mflo r14
+    addu r12, r12, r14
+    addiu r1, r1, 4
+    bne r1, r3, sum
+    jr ra
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the instruction set simulator in instructions per second")
+    parser.add_argument("--words", type=int, default=256, help="size of the sorted array (default: 256)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs, the fastest is kept")
+    args = parser.parse_args()
+
+    program = assemble(KERNEL.format(words=args.words), rom_size=None, ram_size=None)
+
+    start = time.perf_counter()
+    Simulator(program.rom, program.ram)
+    predecode_time = time.perf_counter() - start
+
+    best = None
+    for _ in range(args.repeat):
+        simulator = Simulator(program.rom, program.ram)
+        start = time.perf_counter()
+        status = simulator.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+        words = simulator.ram[:args.words]
+        if status != "returned" or words != sorted(words):
+            sys.exit(f"❌ kernel failed: {status}")
+
+    print(f"predecode {len(program.rom) // 4} words: {predecode_time * 1e3:.2f} ms")
+    print(f"{simulator.steps:,} instructions in {best * 1e3:.1f} ms: {simulator.steps / best / 1e6:.2f}M instructions/s")
+
+
+if __name__ == "__main__":
+    main()
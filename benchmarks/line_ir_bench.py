@@ -0,0 +1,84 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# memory/time comparison of the slotted Parsed_Line records against the per-line dicts the parser used to build
+# run from the repo root: python benchmarks/line_ir_bench.py [line count]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.Line_Parser import Parsed_Line, parse_lines
+from src.Constant_Handler import process_constants
+from src.Label_Handler import process_labels
+
+
+# simple mix of labels, instructions and data, roughly what generated programs look like
+def make_source(line_count):
+    lines = [".data", ".equ SIZE = 4", "table: .word 1, 2, 3, 4", ".text"]
+    i = 0
+    while len(lines) < line_count:
+        if i % 16 == 0:
+            lines.append(f"L{i}:")
+        lines.append(f"    addu r{i % 32}, r1, r2")
+        lines.append("    lw r3, table(r0)")
+        lines.append(f"    beq r1, r2, L{(i // 16) * 16}")
+        i += 1
+    return lines[:line_count]
+
+
+# bytes still allocated by build() once it returns, i.e. the resident size of the result
+def resident_size(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, after - before, peak - before
+
+
+# the collector is paused like parse_lines does, so only the construction itself is timed
+def timed(build):
+    gc.disable()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    gc.enable()
+    return result, elapsed
+
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    source = make_source(line_count)
+
+    # time the front end passes on the records, and the peak memory of parsing
+    records, parse_time = timed(lambda: parse_lines(source))
+    _, pass_time = timed(lambda: process_labels(process_constants(records)[0]))
+    del records
+    records, _, parse_peak = resident_size(lambda: parse_lines(source))
+
+    # build both representations from the same field values, so the strings are shared and only the
+    # per-line container is compared. The dicts hold exactly the keys the old parser set
+    field_lists = [[(f, getattr(r, f)) for f in Parsed_Line.__slots__ if getattr(r, f) is not None] for r in records]
+    dicts, dict_bytes, _ = resident_size(lambda: [dict(fields) for fields in field_lists])
+    rebuilt, record_bytes, _ = resident_size(lambda: [Parsed_Line(**dict(fields)) for fields in field_lists])
+
+    # construction cost of an instruction line, written the way the parser builds each form
+    instructions = [(r.section, r.label, r.mnemonic, r.operands) for r in records if r.mnemonic is not None]
+    _, dict_build_time = timed(lambda: [{"label": l, "mnemonic": m, "operands": o, "section": s} for s, l, m, o in instructions])
+    _, record_build_time = timed(lambda: [Parsed_Line(s, label=l, mnemonic=m, operands=o) for s, l, m, o in instructions])
+
+    print(f"{line_count:,} source lines, {len(records):,} parsed records")
+    print(f"parse_lines                      : {parse_time:.2f}s")
+    print(f"process_constants + process_labels: {pass_time:.2f}s")
+    print(f"build {len(instructions):,} instruction dicts      : {dict_build_time:.2f}s")
+    print(f"build {len(instructions):,} instruction Parsed_Line: {record_build_time:.2f}s")
+    print(f"parse_lines peak memory          : {parse_peak / 2**20:.1f} MiB")
+    print(f"resident dicts                   : {dict_bytes / 2**20:.1f} MiB")
+    print(f"resident Parsed_Line             : {record_bytes / 2**20:.1f} MiB")
+    print(f"records use {record_bytes / dict_bytes:.0%} of the dict memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+# the incremental rebuild -c/--link is for: a program split into modules, one module changes. Times assembling the
+# whole program against reassembling one module and linking the objects, and the linker with and without NumPy
+# run from the repo root: python benchmarks/link_bench.py [--modules 16] [--lines 10000] [--repeat 3]
+# the linked images have to be the same as the whole program's
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import Linker
+from src.Assembler import assemble, assemble_object
+from src.Line_Parser import instruction_cache
+from src.Object_Handler import Object_Module
+
+
+# a module with lines instructions, a quarter of them jumps, calls, loads, stores and la of the other modules' labels
+def generate_module(index, modules, lines, rng):
+    out = [".data", f"m{index}_data: .word " + ", ".join(str(rng.randrange(1000)) for _ in range(64)), ".text"]
+    out.append(f".globl m{index}_data, " + ", ".join(f"m{index}_f{k}" for k in range(lines // 100)))
+    for k in range(lines // 100):
+        out.append(f"m{index}_f{k}:")
+        for _ in range(100):
+            other = rng.randrange(modules)
+            choice = rng.randrange(8)
+            if choice == 0:
+                out.append(f"    jal m{other}_f{rng.randrange(lines // 100)}")
+            elif choice == 1:
+                out.append(f"    lw r{rng.randrange(2, 8)}, m{other}_data(r0)")
+            else:
+                out.append(f"    addu r{rng.randrange(2, 8)}, r{rng.randrange(2, 8)}, r{rng.randrange(2, 8)}")
+    return "\n".join(out) + "\n"
+
+def best_of(repeat, function):
+    best = None
+    for _ in range(repeat):
+        # the parser's instruction cache would carry over from the previous run
+        instruction_cache.clear()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare whole program assembly with one module + link")
+    parser.add_argument("--modules", type=int, default=16, help="number of modules (default: 16)")
+    parser.add_argument("--lines", type=int, default=10_000, help="instructions per module (default: 10000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, the fastest is kept")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    sources = [generate_module(index, args.modules, args.lines, rng) for index in range(args.modules)]
+    # a whole program ignores .globl, the modules one after the other lay out the same as the linker does
+    whole_time, whole = best_of(args.repeat, lambda: assemble("".join(sources), rom_size=None, ram_size=None))
+    print(f"whole program        {whole_time * 1e3:9.1f} ms")
+
+    objects = [Object_Module.from_bytes(assemble_object(source, f"m{index}.o").to_bytes(), f"m{index}.o")
+               for index, source in enumerate(sources)]
+    relocations = sum(len(module.relocation_offsets) for module in objects)
+    module_time, _ = best_of(args.repeat, lambda: assemble_object(sources[0], "m0.o").to_bytes())
+    print(f"one module (-c)      {module_time * 1e3:9.1f} ms")
+
+    numpy = Linker.np
+    link_times = []
+    for name in ("link (NumPy)", "link (no NumPy)"):
+        if name == "link (no NumPy)":
+            Linker.np = None
+        elif numpy is None:
+            continue
+        link_time, linked = best_of(args.repeat, lambda: Linker.link(objects, None, None))
+        link_times.append(link_time)
+        print(f"{name:<20} {link_time * 1e3:9.1f} ms ({relocations / link_time:12,.0f} relocations/s)")
+        if linked.rom != whole.rom or linked.ram != whole.ram:
+            sys.exit("❌ linked and whole program images differ")
+    Linker.np = numpy
+    print(f"rebuild after editing one module: {(module_time + link_times[0]) * 1e3:.1f} ms instead of {whole_time * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
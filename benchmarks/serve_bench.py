@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# request latency of the --serve mode against running the command line once per file
+# run from the repo root: python benchmarks/serve_bench.py [--lines 1000] [--requests 50] [--socket]
+# the same generated program is assembled --requests times both ways. The one-shot numbers include starting Python,
+# the imports and writing the output files, which is the cost an editor or build tool calling the CLI pays every time
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSEMBLER = os.path.join(ROOT, "MIPS_Assembler.py")
+sys.path.insert(0, ROOT)
+
+from workload_gen import generate_program
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def one_shot(input_path, requests, workdir):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, ASSEMBLER, input_path, "--rom-size", "0", "--ram-size", "0",
+                        "--output-dir", workdir], check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+# sends the requests one at a time and waits for every answer, so each sample is one round trip
+def served(source, requests, socket_path=None):
+    command = [sys.executable, ASSEMBLER, "--serve"]
+    if socket_path:
+        command += ["--socket", socket_path]
+    server = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        if socket_path:
+            server.stderr.readline()    # "Serving on ...", the socket is bound
+            connection = socket.socket(socket.AF_UNIX)
+            connection.connect(socket_path)
+            reader = connection.makefile("r")
+            send = lambda text: connection.sendall(text.encode())
+        else:
+            reader = server.stdout
+            def send(text):
+                server.stdin.write(text)
+                server.stdin.flush()
+
+        samples = []
+        for request_id in range(requests):
+            request = json.dumps({"id": request_id, "source": source, "rom_size": 0, "ram_size": 0}) + "\n"
+            start = time.perf_counter()
+            send(request)
+            response = json.loads(reader.readline())
+            samples.append(time.perf_counter() - start)
+            if not response["ok"]:
+                sys.exit(f"server error: {response['diagnostics']}")
+        if socket_path:
+            connection.close()
+        return samples
+    finally:
+        server.terminate()
+        server.wait()
+
+def print_row(name, samples):
+    print(f"{name:<16}{percentile(samples, 0.5) * 1e3:>12.2f}{percentile(samples, 0.99) * 1e3:>12.2f}"
+          f"{sum(samples) / len(samples) * 1e3:>12.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare --serve request latency with one-shot CLI runs")
+    parser.add_argument("--lines", type=int, default=1000, help="size of the generated program (default: 1000)")
+    parser.add_argument("--requests", type=int, default=50, help="assemblies per mode (default: 50)")
+    parser.add_argument("--socket", action="store_true", help="also time the server over a Unix socket")
+    args = parser.parse_args()
+
+    source = "".join(generate_program(args.lines))
+    with tempfile.TemporaryDirectory() as workdir:
+        input_path = os.path.join(workdir, "bench.asm")
+        with open(input_path, "w") as f:
+            f.write(source)
+
+        results = {"one-shot CLI": one_shot(input_path, args.requests, workdir),
+                   "serve (stdin)": served(source, args.requests)}
+        if args.socket:
+            results["serve (socket)"] = served(source, args.requests, os.path.join(workdir, "bench.sock"))
+
+    print(f"{args.lines:,} lines, {args.requests} requests per mode")
+    print(f"{'mode':<16}{'p50 (ms)':>12}{'p99 (ms)':>12}{'mean (ms)':>12}")
+    for name, samples in results.items():
+        print_row(name, samples)
+    speedup = percentile(results["one-shot CLI"], 0.5) / percentile(results["serve (stdin)"], 0.5)
+    print(f"serve p50 is {speedup:.1f}x faster than one-shot")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+# the single pass assembler against the regular pipeline on a generated program, time and peak memory
+# run from the repo root: python benchmarks/single_pass_bench.py [--lines 200000] [--repeat 3]
+# both have to produce the same rom/ram images and symbol tables
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.Assembler import assemble
+from src.Line_Parser import instruction_cache
+from workload_gen import generate_program
+
+
+def run(source, single_pass):
+    # the parser's instruction cache would carry over from the previous run
+    instruction_cache.clear()
+    return assemble(source, rom_size=None, ram_size=None, single_pass=single_pass)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single pass assembly with the regular pipeline")
+    parser.add_argument("--lines", type=int, default=200_000, help="size of the generated program (default: 200000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, the fastest is kept")
+    args = parser.parse_args()
+
+    source = generate_program(args.lines)
+    results = []
+    for name, single_pass in (("pipeline", False), ("single pass", True)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = run(source, single_pass)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        tracemalloc.start()
+        run(source, single_pass)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results.append((result.rom, result.ram, result.symbols, result.constants))
+        print(f"{name:<12} {best * 1e3:9.1f} ms ({args.lines / best:10,.0f} lines/s)   peak {peak / 2**20:7.1f} MiB")
+
+    if results[0] != results[1]:
+        sys.exit("❌ single pass and pipeline outputs differ")
+
+
+if __name__ == "__main__":
+    main()
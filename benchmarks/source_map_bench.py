@@ -0,0 +1,55 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+# looking up a trace of rom addresses in the source map of a generated program, with and without NumPy
+# run from the repo root: python benchmarks/source_map_bench.py [--lines 200000] [--addresses 2000000]
+# both have to find the same entries, and every entry has to survive a round trip through the file format
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import Source_Map as source_map_module
+from src.Assembler import assemble
+from src.Source_Map import Source_Map
+from workload_gen import generate_program
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time address -> source lookups over a trace")
+    parser.add_argument("--lines", type=int, default=200_000, help="size of the generated program (default: 200000)")
+    parser.add_argument("--addresses", type=int, default=2_000_000, help="trace length (default: 2000000)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = assemble(generate_program(args.lines), rom_size=None, ram_size=None, source_path="bench.asm", source_map=True)
+    build_time = time.perf_counter() - start
+    source_map = result.source_map
+    data = source_map.to_bytes()
+    loaded = Source_Map.from_bytes(data)
+    if loaded.to_bytes() != data:
+        sys.exit("❌ the source map changed going through its file format")
+    print(f"assemble + map {build_time * 1e3:9.1f} ms   {len(source_map):,} entries for {len(result.rom) // 4:,} words, "
+          f"{len(data):,} bytes")
+
+    rng = random.Random(1)
+    trace = [rng.randrange(0, len(result.rom)) & ~3 for _ in range(args.addresses)]
+    numpy = source_map_module.np
+    indexes = []
+    for name in ("lookup (NumPy)", "lookup (bisect)"):
+        if name == "lookup (bisect)":
+            source_map_module.np = None
+        elif numpy is None:
+            continue
+        start = time.perf_counter()
+        found = loaded.lookup_indexes(trace)
+        elapsed = time.perf_counter() - start
+        indexes.append([int(index) for index in found])
+        print(f"{name:<15} {elapsed * 1e3:9.1f} ms ({args.addresses / elapsed:14,.0f} addresses/s)")
+    source_map_module.np = numpy
+    if len(indexes) == 2 and indexes[0] != indexes[1]:
+        sys.exit("❌ NumPy and bisect lookups differ")
+
+
+if __name__ == "__main__":
+    main()
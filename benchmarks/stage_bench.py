@@ -0,0 +1,167 @@
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+# per-stage benchmark of the assembler pipeline on synthetic workloads (see workload_gen.py)
+# run from the repo root: python benchmarks/stage_bench.py [--sizes 1000,100000,1000000] [--save out.json] [--baseline old.json]
+# every stage of assemble_file is timed on its own, the best of --repeat runs is kept. With --baseline the run is
+# compared stage by stage and the script exits with 1 if any stage lost more than --threshold of its throughput
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MIPS_Assembler import read_asm_file
+from src.Assembler import encode_rom
+from src import __version__
+from src.Macro_Handler import expand_macros
+from src.Line_Parser import parse_lines, instruction_cache
+from src.Constant_Handler import process_constants
+from src.Label_Handler import process_labels
+from src.Utilities import encode_data_directives
+from src.Output_Formats import output_formats, write_image
+from workload_gen import generate_program
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+STAGES = ["read", "expand_macros", "parse_lines", "process_constants", "process_labels",
+          "encoding", "encode_data_directives", "writing"]
+
+
+# runs the pipeline once the same way assemble_file does, returns stage -> seconds
+def run_pipeline(input_path, output_dir, output_format):
+    times = {}
+
+    def timed(stage, step):
+        start = time.perf_counter()
+        result = step()
+        times[stage] = time.perf_counter() - start
+        return result
+
+    # the parser's instruction cache would carry over from the previous run
+    instruction_cache.clear()
+
+    raw_lines = timed("read", lambda: read_asm_file(input_path))
+    expanded_lines = timed("expand_macros", lambda: expand_macros(raw_lines))
+    parsed_lines = timed("parse_lines", lambda: parse_lines(expanded_lines))
+    parsed_lines, constant_table = timed("process_constants", lambda: process_constants(parsed_lines))
+    label_table, parsed_lines = timed("process_labels", lambda: process_labels(parsed_lines))
+
+    text_lines = [line for line in parsed_lines if line.section == ".text"]
+    data_lines = [line for line in parsed_lines if line.section == ".data"]
+
+    rom, _ = timed("encoding", lambda: encode_rom(text_lines, label_table, constant_table, None))
+    ram = timed("encode_data_directives", lambda: encode_data_directives(data_lines, None))
+
+    def write():
+        write_image(os.path.join(output_dir, "bench_rom"), rom, "ROM", output_format)
+        write_image(os.path.join(output_dir, "bench_ram"), ram, "RAM", output_format)
+
+    # the writers print a ✅ line per file, which would drown the table
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        timed("writing", write)
+
+    return times
+
+
+# best time per stage over repeat runs, plus throughput in source lines per second
+def bench_size(line_count, repeat, output_format, workdir):
+    input_path = os.path.join(workdir, f"workload_{line_count}.asm")
+    with open(input_path, "w") as f:
+        f.writelines(generate_program(line_count))
+
+    best = {}
+    for _ in range(repeat):
+        gc.collect()
+        for stage, seconds in run_pipeline(input_path, workdir, output_format).items():
+            best[stage] = min(best.get(stage, seconds), seconds)
+
+    total = sum(best.values())
+    stages = {stage: {"seconds": best[stage], "lines_per_sec": line_count / best[stage] if best[stage] else None}
+              for stage in STAGES}
+    stages["total"] = {"seconds": total, "lines_per_sec": line_count / total}
+    return stages
+
+
+def print_table(results):
+    print(f"{'stage':<24}" + "".join(f"{int(size):>22,}" for size in results))
+    for stage in STAGES + ["total"]:
+        row = f"{stage:<24}"
+        for stages in results.values():
+            entry = stages[stage]
+            rate = f"{entry['lines_per_sec'] / 1e3:,.0f}k/s" if entry["lines_per_sec"] else "-"
+            row += f"{entry['seconds'] * 1e3:>11.1f}ms {rate:>9}"
+        print(row)
+
+
+# stages that lost more than threshold of their baseline throughput, as (size, stage, old, new).
+# Stages that took less than min_seconds in the baseline are mostly timer noise and are skipped
+def compare(results, baseline, threshold, min_seconds=0.005):
+    regressions = []
+    for size, stages in results.items():
+        old_stages = baseline.get("results", {}).get(size)
+        if old_stages is None:
+            continue
+        for stage, entry in stages.items():
+            old_entry = old_stages.get(stage, {})
+            if old_entry.get("seconds", 0) < min_seconds:
+                continue
+            old = old_entry.get("lines_per_sec")
+            new = entry["lines_per_sec"]
+            if old and new and new < old * (1 - threshold):
+                regressions.append((size, stage, old, new))
+    return regressions
+
+
+def line_counts(text):
+    return [int(size) for size in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every stage of the assembler on synthetic workloads")
+    parser.add_argument("--sizes", type=line_counts, default=DEFAULT_SIZES, help="comma separated line counts (default: 1000,100000,1000000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size, the fastest run of each stage is kept")
+    parser.add_argument("--format", dest="output_format", choices=sorted(output_formats), default="hex")
+    parser.add_argument("--save", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON file from an earlier --save to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed throughput loss before a stage is flagged (default: 0.10)")
+    parser.add_argument("--min-time", type=float, default=0.005, help="stages faster than this many seconds in the baseline are not compared")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            results[str(size)] = bench_size(size, args.repeat, args.output_format, workdir)
+
+    print_table(results)
+
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "format": args.output_format,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_time)
+        for size, stage, old, new in regressions:
+            print(f"REGRESSION {stage} @ {int(size):,} lines: {old:,.0f} -> {new:,.0f} lines/s ({new / old - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No stage regressed by more than {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
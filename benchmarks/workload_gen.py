@@ -0,0 +1,173 @@
+import argparse
+import random
+import sys
+
+# synthetic workload generator, writes valid programs of any size for the benchmarks
+# run from the repo root: python benchmarks/workload_gen.py LINES [-o out.asm] [--mix r=40,i=25,mem=15,branch=12,jump=8] ...
+
+# relative weight of every instruction kind, changed with --mix
+DEFAULT_MIX = {"r": 40, "i": 25, "mem": 15, "branch": 12, "jump": 8}
+
+R_TYPE = ["addu", "subu", "and", "or", "xor", "slt", "sltu"]
+SHIFTS = ["sll", "srl", "sra"]
+I_TYPE = ["addiu", "andi", "ori", "xori", "slti", "sltiu"]
+BRANCH_RS_RT = ["beq", "bne"]
+BRANCH_RS = ["bgez", "bltz", "bgtz", "blez"]
+
+
+def register(rng):
+    return f"r{rng.randrange(32)}"
+
+
+# one instruction of the given kind, branches and jumps go back to the last text label so they are always in range
+def make_instruction(kind, rng, label, constants, data_labels):
+    if kind == "r":
+        pick = rng.random()
+        if pick < 0.7:
+            return f"{rng.choice(R_TYPE)} {register(rng)}, {register(rng)}, {register(rng)}"
+        if pick < 0.85:
+            return f"{rng.choice(SHIFTS)} {register(rng)}, {register(rng)}, {rng.randrange(32)}"
+        if pick < 0.95:
+            return f"{rng.choice(['mult', 'multu'])} {register(rng)}, {register(rng)}"
+        return f"{rng.choice(['mfhi', 'mflo'])} {register(rng)}"
+    if kind == "i":
+        # a quarter of the immediates are .equ constants
+        if constants and rng.random() < 0.25:
+            imm = rng.choice(constants)
+        else:
+            imm = rng.choice([str(rng.randrange(-512, 512)), hex(rng.randrange(0x10000))])
+        return f"{rng.choice(I_TYPE)} {register(rng)}, {register(rng)}, {imm}"
+    if kind == "mem":
+        mnemonic = rng.choice(["lw", "sw"])
+        if data_labels and rng.random() < 0.5:
+            return f"{mnemonic} {register(rng)}, {rng.choice(data_labels)}(r0)"
+        return f"{mnemonic} {register(rng)}, {rng.randrange(64)}(sp)"
+    if kind == "branch":
+        if rng.random() < 0.6:
+            return f"{rng.choice(BRANCH_RS_RT)} {register(rng)}, {register(rng)}, {label}"
+        return f"{rng.choice(BRANCH_RS)} {register(rng)}, {label}"
+    if kind == "jump":
+        return f"{rng.choice(['j', 'jal'])} {label}"
+    raise ValueError(f"Unknown instruction kind: {kind}")
+
+
+# returns the program as a list of lines ending in newlines, like readlines() would.
+#   line_count : total source lines, the text section fills whatever the header leaves
+#   mix        : kind -> weight, kinds are r, i, mem, branch, jump
+#   label_every: a text label every N instructions, 0 for a single label
+#   macro_ratio: share of the text lines that call one of the macros
+#   macro_count: number of macros defined up front, each with a 3 instruction body using two register arguments
+#   equ_count  : number of .equ constants, used as immediates
+#   data_words : words of .data, written as .word/.byte/.space lines under data labels
+def generate_program(line_count, mix=None, label_every=16, macro_ratio=0.05, macro_count=4,
+                     equ_count=8, data_words=256, seed=0):
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = [kind for kind, weight in mix.items() if weight > 0]
+    weights = [mix[kind] for kind in kinds]
+    if not kinds:
+        raise ValueError("The instruction mix is empty")
+
+    lines = []
+
+    # macros are expanded before parsing, so they are defined outside any section
+    macros = [f"MACRO_{i}" for i in range(macro_count if macro_ratio > 0 else 0)]
+    for name in macros:
+        lines.append(f".macro {name} dst, src")
+        lines.append(f"    addu dst, src, {register(rng)}")
+        lines.append("    " + make_instruction("i", rng, None, [], []))
+        lines.append(f"    {rng.choice(R_TYPE)} {register(rng)}, dst, src")
+        lines.append(".end_macro")
+
+    lines.append(".data")
+    constants = [f"C{i}" for i in range(equ_count)]
+    for name in constants:
+        lines.append(f".equ {name} = {rng.randrange(1, 256)}")
+
+    data_labels = []
+    words = 0
+    while words < data_words:
+        # a data label roughly every 64 words
+        if words >= len(data_labels) * 64:
+            data_labels.append(f"D{len(data_labels)}")
+            lines.append(f"{data_labels[-1]}:")
+        pick = rng.random()
+        if pick < 0.8:
+            count = min(4, data_words - words)
+            lines.append("    .word " + ", ".join(str(rng.randrange(1 << 31)) for _ in range(count)))
+            words += count
+        elif pick < 0.9:
+            lines.append("    .byte " + ", ".join(str(rng.randrange(256)) for _ in range(4)))
+            words += 1
+        else:
+            lines.append("    .space 16")
+            words += 4
+
+    lines.append(".text")
+    label = "L0"
+    lines.append(f"{label}:")
+    instructions = 0
+    while len(lines) < line_count:
+        prefix = "    "
+        if label_every and instructions and instructions % label_every == 0:
+            label = f"L{instructions}"
+            # every other label shares its line with the instruction
+            if (instructions // label_every) % 2:
+                lines.append(f"{label}:")
+            else:
+                prefix = f"{label}: "
+
+        if macros and rng.random() < macro_ratio:
+            text = f"{rng.choice(macros)} {register(rng)}, {register(rng)}"
+            # macro calls have to stand alone on their line
+            if prefix != "    ":
+                lines.append(prefix.rstrip())
+                prefix = "    "
+        else:
+            kind = rng.choices(kinds, weights)[0]
+            text = make_instruction(kind, rng, label, constants, data_labels)
+        lines.append(prefix + text)
+        instructions += 1
+
+    return [line + "\n" for line in lines]
+
+
+# "r=40,i=25" -> {"r": 40, "i": 25}
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown instruction kind '{kind}', expected one of {', '.join(DEFAULT_MIX)}")
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for '{kind}': {weight}")
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic .asm workload")
+    parser.add_argument("lines", type=int, help="total number of source lines")
+    parser.add_argument("-o", "--output", default=None, help="output .asm file (default: stdout)")
+    parser.add_argument("--mix", type=parse_mix, default=None, help="instruction kind weights, e.g. r=40,i=25,mem=15,branch=12,jump=8")
+    parser.add_argument("--label-every", type=int, default=16, help="a text label every N instructions")
+    parser.add_argument("--macro-ratio", type=float, default=0.05, help="share of text lines that are macro calls")
+    parser.add_argument("--macros", type=int, default=4, help="number of macros to define")
+    parser.add_argument("--equ", type=int, default=8, help="number of .equ constants")
+    parser.add_argument("--data-words", type=int, default=256, help="words of .data")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    program = generate_program(args.lines, args.mix, args.label_every, args.macro_ratio, args.macros,
+                               args.equ, args.data_words, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.writelines(program)
+    else:
+        sys.stdout.writelines(program)
+
+
+if __name__ == "__main__":
+    main()
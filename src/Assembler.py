@@ -0,0 +1,407 @@
+import os
+from collections import namedtuple
+
+from src.Macro_Handler import expand_macros, iter_expand_macros
+from src.Constant_Handler import ConstantTable, process_constants, iter_process_constants
+from src.Label_Handler import Label_Table, process_labels, iter_process_labels
+from src.Pseudo_Handler import expand_pseudo_instructions, iter_expand_pseudo_instructions, relax_text, late_constant_load
+from src.Peephole_Optimizer import optimize_text
+from src.Scheduler import schedule_text
+from src.Object_Handler import build_object
+from src.Encoder import encode_instruction, make_encode_cache
+from src.Batch_Encoder import encode_text_batch, write_words
+from src.Utilities import encode_data_directives, encode_data_line, paused_gc
+from src.Line_Parser import parse_lines, iter_parse_lines, format_operands, format_location, source_line
+from src.Memory_Image import Memory_Image, DEFAULT_MEMORY_SIZE
+from src.Profiler import Stage_Profiler
+from src.Source_Map import Source_Map
+
+# In-memory assembler, the library entry point. assemble() takes the source text and hands back the rom/ram bytes and
+# the symbol tables without touching the disk, printing or exiting, so it can run thousands of times in one process.
+# The command line in MIPS_Assembler.py is a wrapper that adds file reading, caching and writing around it
+
+# one problem found in the source. line/column are None when the error isn't tied to a line
+Diagnostic = namedtuple("Diagnostic", "severity message line column")
+
+# every error assemble() raises. It is a ValueError, so code catching the old ValueErrors keeps working
+class Assembly_Error(ValueError):
+    def __init__(self, message, line_no=None, column=None):
+        self.line_no = line_no
+        self.column = column
+        super().__init__(message)
+
+    @property
+    def diagnostic(self):
+        return Diagnostic("error", str(self), self.line_no, self.column)
+
+class Assembly_Result:
+    def __init__(self, rom_image, ram_image, symbols, constants, diagnostics, sections=None, source_map=None):
+        self.rom_image = rom_image       # Memory_Image, keeps the memory size for the output formats
+        self.ram_image = ram_image
+        self.symbols = symbols           # label -> byte address
+        self.constants = constants       # .equ name -> value
+        self.diagnostics = diagnostics   # list of Diagnostic
+        self.sections = sections or {}   # label -> .text/.data
+        self.source_map = source_map     # Source_Map of the rom when asked for, see src/Source_Map.py
+
+    @property
+    def ok(self):
+        return not any(d.severity == "error" for d in self.diagnostics)
+
+    # flat rom/ram contents from address 0, gaps zero filled
+    @property
+    def rom(self):
+        return self.rom_image.to_bytes()
+
+    @property
+    def ram(self):
+        return self.ram_image.to_bytes()
+
+    # the labels of the .text/.data section, label -> byte address
+    def section_symbols(self, section):
+        return {label: address for label, address in self.symbols.items() if self.sections.get(label) == section}
+
+# Assembles source (the whole text, or a list of lines) into an Assembly_Result.
+# Errors raise Assembly_Error, or with raise_errors=False come back in result.diagnostics with empty images.
+# A Stage_Profiler records every stage like --profile does.
+# .include paths are looked up next to source_path (the current directory without one), then in include_dirs.
+# Included files are parsed once per process, with a cache_dir the parsed files are also kept on disk
+# With single_pass the source is read once and every instruction is encoded right away, see run_single_pass.
+# optimize runs the peephole optimizer, True for every rule or a collection of rule names. Its summary comes back as
+# an "info" diagnostic, or a "warning" when the program can't be optimized
+# schedule lays the program out for the core with branch delay slots (see src/Scheduler.py), its summary is an "info"
+# diagnostic. The result only runs right with delay slots, Simulator(..., delay_slots=True)
+# source_map builds result.source_map, where every rom address came from in the source
+def assemble(source, rom_size=DEFAULT_MEMORY_SIZE, ram_size=DEFAULT_MEMORY_SIZE, profiler=None, raise_errors=True,
+             source_path=None, include_dirs=(), cache_dir=None, single_pass=False, optimize=False, schedule=False,
+             source_map=False):
+    if isinstance(source, str):
+        source = source.splitlines(keepends=True)
+    if profiler is None:
+        profiler = Stage_Profiler(enabled=False)
+    base_dir = os.path.dirname(source_path) if source_path else "."
+
+    try:
+        if single_pass:
+            if optimize:
+                raise Assembly_Error("The peephole optimizer needs the whole program, it can't run in a single pass")
+            if schedule:
+                raise Assembly_Error("The scheduler needs the whole program, it can't run in a single pass")
+            if source_map:
+                raise Assembly_Error("The source map is built from the whole program, it can't be made in a single pass")
+            with paused_gc():
+                with profiler.stage("single_pass") as stage:
+                    result, stage.items = run_single_pass(source, rom_size, ram_size, base_dir, include_dirs, cache_dir)
+            return result
+        return run_pipeline(source, rom_size, ram_size, profiler, base_dir, include_dirs, cache_dir, optimize, schedule,
+                            source_path if source_map else None, source_map)
+    except ValueError as e:
+        error = e if isinstance(e, Assembly_Error) else Assembly_Error(str(e), getattr(e, "line_no", None), getattr(e, "column", None))
+        if raise_errors:
+            if error is e:
+                raise
+            raise error from e
+        return Assembly_Result(Memory_Image("ROM", rom_size), Memory_Image("RAM", ram_size), {}, {}, [error.diagnostic])
+
+# stages 2-8 of the assembler, numbered like they always were
+def run_pipeline(raw_lines, rom_size, ram_size, profiler, base_dir=".", include_dirs=(), cache_dir=None, optimize=False,
+                 schedule=False, source_path=None, source_map=False):
+    parsed_lines, label_table, constant_table, diagnostics = layout_program(raw_lines, profiler, base_dir, include_dirs,
+                                                                            cache_dir, optimize, schedule)
+
+    # 6. Seperate text and data lines
+    with profiler.stage("split_sections") as stage:
+        text_lines = []
+        data_lines = []
+        for line in parsed_lines:
+            if line.section == ".text":
+                text_lines.append(line)
+            elif line.section == ".data":
+                data_lines.append(line)
+        stage.items = len(text_lines) + len(data_lines)
+
+    # 7. Encode the text section into the rom image, each word goes to its own address so .org is honored
+    with profiler.stage("encoding") as stage:
+        rom, stage.items = encode_rom(text_lines, label_table, constant_table, rom_size)
+    profile_encoder(text_lines, label_table, constant_table, profiler)
+
+    # 8. Encode the data into the ram image
+    with profiler.stage("encode_data_directives") as stage:
+        ram = encode_data_directives(data_lines, ram_size)
+        stage.items = len(ram)
+
+    # 8b. Where every rom word came from
+    address_map = None
+    if source_map:
+        with profiler.stage("source_map") as stage:
+            address_map = Source_Map.build(text_lines, source_path)
+            stage.items = len(address_map)
+
+    return Assembly_Result(rom, ram, dict(label_table.table), constant_table.export(), diagnostics, dict(label_table.sections),
+                           address_map)
+
+# stages 2-5 of the assembler, returns (parsed lines, label table, constant table, diagnostics) with every line at its
+# final address. relocatable lays out a module for the linker (see assemble_object)
+def layout_program(raw_lines, profiler, base_dir=".", include_dirs=(), cache_dir=None, optimize=False, schedule=False,
+                   relocatable=False):
+    # 2.Expand macros and includes
+    with profiler.stage("expand_macros") as stage:
+        expanded_lines = expand_macros(raw_lines, base_dir, include_dirs, cache_dir)
+        stage.items = len(expanded_lines)
+
+    # 3. Parse the lines into a list of Parsed_Line records
+    with profiler.stage("parse_lines") as stage:
+        parsed_lines = parse_lines(expanded_lines)
+        stage.items = len(parsed_lines)
+
+    # 4. Process constants by generating the constant table and update the parsed line list
+    with profiler.stage("process_constants") as stage:
+        parsed_lines, constant_table = process_constants(parsed_lines)
+        stage.items = len(constant_table.table)
+
+    # 4b. Expand the pseudo-instructions (li, la, move, nop, b, blt...) into real ones
+    with profiler.stage("expand_pseudo") as stage:
+        parsed_lines = expand_pseudo_instructions(parsed_lines, constant_table)
+        stage.items = len(parsed_lines)
+
+    # 5. Process labels by generating the label table and update parsed line list
+    with profiler.stage("process_labels") as stage:
+        label_table, parsed_lines = process_labels(parsed_lines)
+        stage.items = len(label_table.table)
+
+    # 5b. Remove wasted instructions with the peephole rules (-O), before relaxation so the long forms see the final layout
+    diagnostics = []
+    if optimize:
+        with profiler.stage("peephole") as stage:
+            label_table, parsed_lines, peephole_stats = optimize_text(parsed_lines, label_table,
+                                                                      None if optimize is True else optimize)
+            stage.items = peephole_stats.removed_count
+        diagnostics.append(Diagnostic("warning" if peephole_stats.skipped else "info", peephole_stats.summary(), None, None))
+
+    # 5c. Fill the branch delay slots and move load-use stalls apart (--schedule)
+    if schedule:
+        with profiler.stage("schedule") as stage:
+            label_table, parsed_lines, schedule_stats = schedule_text(parsed_lines, label_table)
+            stage.items = schedule_stats.slots
+        diagnostics.append(Diagnostic("info", schedule_stats.summary(), None, None))
+
+    # 5d. Branches that can't reach their label and la of high addresses get their long form
+    with profiler.stage("relax_branches") as stage:
+        label_table, parsed_lines = relax_text(parsed_lines, label_table, delay_slots=schedule, relocatable=relocatable)
+        stage.items = len(parsed_lines)
+    return parsed_lines, label_table, constant_table, diagnostics
+
+# Assembles one module of a program into an Object_Module for the linker (-c, see src/Object_Handler.py and
+# src/Linker.py). name is what the linker calls the module in its errors. Errors raise Assembly_Error
+def assemble_object(source, name="<object>", profiler=None, source_path=None, include_dirs=(), cache_dir=None):
+    if isinstance(source, str):
+        source = source.splitlines(keepends=True)
+    if profiler is None:
+        profiler = Stage_Profiler(enabled=False)
+    base_dir = os.path.dirname(source_path) if source_path else "."
+
+    try:
+        parsed_lines, label_table, constant_table, _ = layout_program(source, profiler, base_dir, include_dirs, cache_dir,
+                                                                      relocatable=True)
+
+        # 6. The symbols and relocations, the text lines with every import at 0
+        with profiler.stage("relocations") as stage:
+            module, text_lines, encode_table = build_object(name, parsed_lines, label_table, constant_table)
+            stage.items = len(module.relocation_offsets)
+
+        # 7-8. Encode both sections from 0, the memory sizes are checked once the program is linked
+        with profiler.stage("encoding") as stage:
+            rom, stage.items = encode_rom(text_lines, encode_table, constant_table, None)
+        profile_encoder(text_lines, encode_table, constant_table, profiler)
+        with profiler.stage("encode_data_directives") as stage:
+            ram = encode_data_directives([line for line in parsed_lines if line.section == ".data"], None)
+            stage.items = len(ram)
+    except ValueError as e:
+        if isinstance(e, Assembly_Error):
+            raise
+        raise Assembly_Error(str(e), getattr(e, "line_no", None), getattr(e, "column", None)) from e
+
+    module.text_segments = [(start, bytes(segment)) for start, segment in rom.iter_segments()]
+    module.text_size = len(rom)
+    module.data_segments = [(start, bytes(segment)) for start, segment in ram.iter_segments()]
+    module.data_size = len(ram)
+    return module
+
+# an instruction read before the symbols it uses were defined. missing holds the names it still waits for
+class Fixup:
+    __slots__ = ("address", "mnemonic", "operands", "line", "missing")
+
+    def __init__(self, address, mnemonic, operands, line, missing):
+        self.address = address
+        self.mnemonic = mnemonic
+        self.operands = operands
+        self.line = line         # the Parsed_Line, for the error messages
+        self.missing = missing
+
+# the label/constant names an instruction refers to
+def operand_symbols(operands):
+    names = []
+    for operand in operands:
+        if operand.kind == "sym" or operand.kind == "addr":
+            names.append(operand.value)
+        elif operand.kind == "mem" and operand.value.kind == "sym":
+            names.append(operand.value.value)
+    return names
+
+# stages 2-8 in a single pass over the source, returns (Assembly_Result, line count). Every stage is a generator, the
+# lines flow through them one at a time and each instruction is encoded as soon as it is read. An instruction using a
+# symbol that isn't defined yet gets a zero word and a fixup, which is encoded and patched in when the last symbol it
+# waits for is defined. Names still waiting at the end are reported together as undefined.
+# The output is the same as run_pipeline's, only the whole program is never held in memory. Nothing is relaxed
+# though, a branch or la that needs its long form is an error here
+def run_single_pass(raw_lines, rom_size, ram_size, base_dir=".", include_dirs=(), cache_dir=None):
+    constant_table = ConstantTable()
+    label_table = Label_Table()
+    labels = label_table.table
+    constants = constant_table.table
+    rom = Memory_Image("ROM", rom_size)
+    ram = Memory_Image("RAM", ram_size)
+    fixups = {}          # symbol -> fixups waiting for it
+    data_address = 0
+    line_count = 0
+
+    # words at consecutive addresses are collected and written to the rom in one piece, .org starts a new run
+    run_start = 0
+    run = bytearray()
+
+    def flush():
+        nonlocal run
+        if run:
+            rom.write(run_start, run)
+            run = bytearray()
+
+    # a li/la of a constant that was still undefined was laid out as one instruction, see late_constant_load
+    def encode(mnemonic, operands, address, line):
+        try:
+            return encode_instruction(*late_constant_load(mnemonic, operands, constants), label_table, constant_table,
+                                      address) & 0xFFFFFFFF
+        except Exception as e:
+            raise Assembly_Error(f"Error at {format_location(line)}: {mnemonic} {format_operands(operands)} — {e}", source_line(line))
+
+    # name was just defined, encodes the fixups that waited for it alone
+    def resolve(name):
+        for fixup in fixups.pop(name, ()):
+            fixup.missing.discard(name)
+            if fixup.missing:
+                continue
+            data = encode(fixup.mnemonic, fixup.operands, fixup.address, fixup.line).to_bytes(4, "big")
+            offset = fixup.address - run_start
+            if 0 <= offset < len(run):
+                run[offset:offset + 4] = data
+            else:
+                rom.patch(fixup.address, data)
+
+    lines = iter_process_constants(iter_parse_lines(iter_expand_macros(raw_lines, base_dir, include_dirs, cache_dir)), constant_table)
+    for line in iter_process_labels(iter_expand_pseudo_instructions(lines, constant_table), label_table):
+        line_count += 1
+        section = line.section
+        if fixups:
+            if line.label is not None:
+                resolve(line.label)
+            if line.directive == ".equ":
+                resolve(line.name)
+
+        if section == ".text":
+            mnemonic = line.mnemonic
+            if mnemonic is None:
+                continue
+            operands = line.operands
+            address = line.address
+            try:
+                word = encode_instruction(mnemonic, operands, label_table, constant_table, address) & 0xFFFFFFFF
+            except Exception:
+                missing = {name for name in operand_symbols(operands) if name not in labels and name not in constants}
+                if not missing:
+                    # a real error, encode again for the message
+                    encode(mnemonic, operands, address, line)
+                fixup = Fixup(address, mnemonic, operands, line, missing)
+                for name in missing:
+                    fixups.setdefault(name, []).append(fixup)
+                word = 0
+
+            if address != run_start + len(run):
+                flush()
+                run_start = address
+            if rom_size is not None and address + 4 > rom_size:
+                rom.check_range(address, 4)
+            run += word.to_bytes(4, "big")
+
+        elif section == ".data":
+            data_address = encode_data_line(ram, line, data_address)
+
+    flush()
+    if fixups:
+        # every fixup still listed waits for a name that was never defined, first use first (the order they were listed in)
+        uses = [(name, waiting[0].line) for name, waiting in fixups.items()]
+        names = ", ".join(f"{name} ({format_location(line)})" for name, line in uses)
+        raise Assembly_Error(f"Undefined symbol{'s' if len(uses) > 1 else ''}: {names}", source_line(uses[0][1]))
+
+    result = Assembly_Result(rom, ram, dict(labels), constant_table.export(), [], dict(label_table.sections))
+    return result, line_count
+
+# encodes the text lines into a new rom image, returns (image, word count). The whole section goes through the
+# NumPy batch encoder when it can, without NumPy or for a section with errors (which the scalar path reports at the
+# right line) every word is encoded and written on its own
+def encode_rom(text_lines, label_table, constant_table, rom_size=DEFAULT_MEMORY_SIZE):
+    batch = encode_text_batch(text_lines, label_table, constant_table)
+    if batch is not None:
+        addresses, words = batch
+        rom = Memory_Image("ROM", rom_size)
+        try:
+            write_words(rom, addresses, words)
+            return rom, len(words)
+        except ValueError:
+            # overlap or overflow, the word by word writes below name the first address that doesn't fit
+            pass
+
+    rom = Memory_Image("ROM", rom_size)
+    count = 0
+    for address, word in iter_rom_words(text_lines, label_table, constant_table, memoize=True):
+        rom.write_word(address, word)
+        count += 1
+    return rom, count
+
+# --profile's encode time per mnemonic. The batch encoder works on whole columns and has no time per instruction,
+# so this encodes the text lines once more with the per-instruction encoder, uncached, and times every call. The rom
+# was already encoded the normal way, so the encoding stage keeps the time of a normal run
+def profile_encoder(text_lines, label_table, constant_table, profiler):
+    if profiler.enabled:
+        for _ in iter_rom_words(text_lines, label_table, constant_table, profiler=profiler):
+            pass
+
+# encodes the text lines one instruction at a time and yields (address, word) pairs.
+# With memoize, identical lines (common in unrolled code) are only encoded once. A profiler times every call.
+# late_constants is for --stream, where a li/la of a constant defined further down was laid out as one instruction
+def iter_rom_words(text_lines, label_table, constant_table, memoize=False, profiler=None, late_constants=False):
+    if memoize:
+        encode = make_encode_cache(label_table, constant_table)
+    elif late_constants:
+        constants = constant_table.table
+        encode = lambda mnemonic, operands, address: encode_instruction(*late_constant_load(mnemonic, operands, constants),
+                                                                        label_table, constant_table, address)
+    else:
+        encode = lambda mnemonic, operands, address: encode_instruction(mnemonic, operands, label_table, constant_table, address)
+    if profiler is not None:
+        encode = profiler.timed_encoder(encode)
+
+    for i, line in enumerate(text_lines):
+        #skipping lines that ar enot valid
+        if line.mnemonic is None:
+            continue
+        mnemonic = line.mnemonic
+        operands = line.operands
+        #just incase the address is missing
+        address = line.address if line.address is not None else i * 4
+
+
+        try:
+            word = encode(mnemonic, operands, address)
+        except Exception as e:
+            raise Assembly_Error(f"Error at {format_location(line)}: {mnemonic} {format_operands(operands)} — {e}", source_line(line))
+
+        yield address, word
@@ -0,0 +1,222 @@
+from itertools import chain
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from src.Encoder import instruction_map, instruction_template, r_type_shapes
+
+# Batch encoder for the text section. Once labels are processed every operand resolves to a plain int, so encoding
+# is only shifts and ORs. Instead of one encode_instruction call per line the lines are grouped by mnemonic, every
+# operand field becomes a NumPy column, the columns are shifted and ORed together and the whole section comes out
+# as big-endian bytes with one astype(">u4").tobytes().
+#
+# The words are the same as encode_instruction's. The batch path only takes sections it can encode completely:
+# any line that would be an error (wrong operand count or kind, unknown symbol, huge immediate) makes it return None
+# and the caller runs the scalar path, which reports the first bad line exactly like before
+
+# Operand fields, Operand is a namedtuple of (kind, value, base)
+kind_of = itemgetter(0)
+value_of = itemgetter(1)
+base_of = itemgetter(2)
+
+# the operands at one position of every line in the group
+def column(operands, position):
+    return list(map(itemgetter(position), operands))
+
+def check_count(operands, count):
+    if set(map(len, operands)) != {count}:
+        raise ValueError("operand count")
+
+def register_column(column):
+    if set(map(kind_of, column)) != {"reg"}:
+        raise ValueError("expected registers")
+    return np.fromiter(map(value_of, column), np.int64, count=len(column))
+
+# immediates, .equ constants and the label addresses of la, like resolve_immediate
+def immediate_column(column, constants, labels={}):
+    kinds = set(map(kind_of, column))
+    if kinds == {"imm"}:
+        values = map(value_of, column)
+    elif kinds <= {"imm", "sym"}:
+        values = [constants[value] if kind == "sym" else value for kind, value, _ in column]
+    elif kinds <= {"imm", "sym", "addr"}:
+        values = [constants[value] if kind == "sym" else labels[value] if kind == "addr" else value
+                  for kind, value, _ in column]
+        # an address over 16 bits is an error the scalar path reports
+        if max(labels[value] for kind, value, _ in column if kind == "addr") > 0xFFFF:
+            raise ValueError("address does not fit in 16 bits")
+    else:
+        raise ValueError("expected immediates")
+    return np.fromiter(values, np.int64, count=len(column))
+
+# byte addresses like resolve_byte_address, symbols maps labels and constants (x4) to byte addresses
+def address_column(column, symbols):
+    kinds = set(map(kind_of, column))
+    if kinds == {"imm"}:
+        return np.fromiter(map(value_of, column), np.int64, count=len(column)) * 4
+    if not kinds <= {"imm", "sym"}:
+        raise ValueError("expected addresses")
+    return np.fromiter((symbols[value] if kind == "sym" else value * 4 for kind, value, _ in column),
+                       np.int64, count=len(column))
+
+# Field builders, one per operand shape. Each gets the operand tuples of one mnemonic's lines and their addresses
+# and returns the operand bits of every word, the template is ORed in by the caller
+
+# lines that are registers only, one row of register numbers per line
+def register_rows(operands, count):
+    check_count(operands, count)
+    return register_column(list(chain.from_iterable(operands))).reshape(-1, count)
+
+# add rd, rs, rt
+def rd_rs_rt_fields(operands, addresses, tables):
+    rows = register_rows(operands, 3)
+    return (rows[:, 1] << 21) | (rows[:, 2] << 16) | (rows[:, 0] << 11)
+
+# sll rd, rt, shamt
+def shift_fields(operands, addresses, tables):
+    check_count(operands, 3)
+    rd = register_column(column(operands, 0))
+    rt = register_column(column(operands, 1))
+    shamt = immediate_column(column(operands, 2), tables.constants, tables.labels)
+    return (rt << 16) | (rd << 11) | ((shamt & 0x1F) << 6)
+
+# jr rs
+def rs_fields(operands, addresses, tables):
+    check_count(operands, 1)
+    return register_column(column(operands, 0)) << 21
+
+# mfhi rd / mflo rd
+def rd_fields(operands, addresses, tables):
+    check_count(operands, 1)
+    return register_column(column(operands, 0)) << 11
+
+# mult rs, rt
+def rs_rt_fields(operands, addresses, tables):
+    rows = register_rows(operands, 2)
+    return (rows[:, 0] << 21) | (rows[:, 1] << 16)
+
+# addiu rt, rs, imm
+def i_type_fields(operands, addresses, tables):
+    check_count(operands, 3)
+    rt = register_column(column(operands, 0))
+    rs = register_column(column(operands, 1))
+    imm = immediate_column(column(operands, 2), tables.constants, tables.labels)
+    return (rs << 21) | (rt << 16) | (imm & 0xFFFF)
+
+# offsets in words from the next instruction, out of range ones are left to the scalar path to report
+def branch_offsets(targets, addresses):
+    offset = (targets - (addresses + 4)) // 4
+    if len(offset) and (offset.min() < -0x8000 or offset.max() > 0x7FFF):
+        raise ValueError("branch out of range")
+    return offset
+
+# beq rs, rt, target
+def branch_rs_rt_fields(operands, addresses, tables):
+    check_count(operands, 3)
+    rs = register_column(column(operands, 0))
+    rt = register_column(column(operands, 1))
+    offset = branch_offsets(address_column(column(operands, 2), tables.byte_addresses), addresses)
+    return (rs << 21) | (rt << 16) | (offset & 0xFFFF)
+
+# bgez rs, target
+def branch_rs_fields(operands, addresses, tables):
+    check_count(operands, 2)
+    rs = register_column(column(operands, 0))
+    offset = branch_offsets(address_column(column(operands, 1), tables.byte_addresses), addresses)
+    return (rs << 21) | (offset & 0xFFFF)
+
+# j target, labels become word addresses, constants and raw numbers already are
+def jump_fields(operands, addresses, tables):
+    check_count(operands, 1)
+    target = immediate_column(column(operands, 0), tables.word_addresses)
+    return target & 0x03FFFFFF
+
+# lw rt, offset(rs)
+def memory_fields(operands, addresses, tables):
+    check_count(operands, 2)
+    rt = register_column(column(operands, 0))
+    mems = column(operands, 1)
+    if set(map(kind_of, mems)) != {"mem"}:
+        raise ValueError("expected offset(rs)")
+    rs = register_column(list(map(base_of, mems)))
+    offset = address_column(list(map(value_of, mems)), tables.byte_addresses)
+    return (rs << 21) | (rt << 16) | (offset & 0xFFFF)
+
+def fields_for(mnemonic, info):
+    instr_type = info["type"]
+    if instr_type == "R-type":
+        return {"rd_rs_rt": rd_rs_rt_fields, "shift": shift_fields, "rs": rs_fields, "rd": rd_fields,
+                "rs_rt": rs_rt_fields}[r_type_shapes.get(mnemonic, "rd_rs_rt")]
+    if instr_type == "I-type":
+        return i_type_fields
+    if instr_type == "Branch":
+        return branch_rs_rt_fields if mnemonic in ("beq", "bne") else branch_rs_fields
+    if instr_type == "Jump":
+        return jump_fields
+    return memory_fields
+
+# mnemonic -> code, and per code (template, field builder)
+mnemonic_codes = {mnemonic: code for code, mnemonic in enumerate(instruction_map)}
+batch_encoders = [(instruction_template(mnemonic, info), fields_for(mnemonic, info)) for mnemonic, info in instruction_map.items()]
+
+# the symbol lookups the field builders need, built once per section
+class Symbol_Tables:
+    def __init__(self, label_table, constants):
+        labels = label_table.table if label_table else {}
+        self.labels = labels
+        self.constants = dict(getattr(constants, "table", constants))
+        # labels win over constants, like resolve_byte_address and the jump encoder
+        self.byte_addresses = {name: value * 4 for name, value in self.constants.items()}
+        self.byte_addresses.update(labels)
+        self.word_addresses = dict(self.constants)
+        self.word_addresses.update((name, address >> 2) for name, address in labels.items())
+
+# Encodes the instruction lines of the text section. Returns (addresses, words) as int64 arrays in line order,
+# or None without NumPy or when a line needs the scalar path
+def encode_text_batch(text_lines, label_table=None, constants={}):
+    if np is None:
+        return None
+    lines = [line for line in text_lines if line.mnemonic is not None]
+    count = len(lines)
+    try:
+        # addresses are None only for lines that never went through process_labels, the scalar path numbers those
+        addresses = np.fromiter([line.address for line in lines], np.int64, count=count)
+        codes = np.fromiter(map(mnemonic_codes.__getitem__, [line.mnemonic for line in lines]), np.intp, count=count)
+    except (KeyError, TypeError):
+        return None
+
+    # lines sorted by mnemonic, so every mnemonic is one slice
+    order = np.argsort(codes, kind="stable")
+    operands = np.fromiter([line.operands for line in lines], dtype=object, count=count)[order].tolist()
+    sorted_addresses = addresses[order]
+    tables = Symbol_Tables(label_table, constants)
+
+    sorted_words = np.empty(count, dtype=np.int64)
+    start = 0
+    try:
+        for code, size in enumerate(np.bincount(codes, minlength=len(batch_encoders)).tolist()):
+            if not size:
+                continue
+            end = start + size
+            template, fields = batch_encoders[code]
+            sorted_words[start:end] = fields(operands[start:end], sorted_addresses[start:end], tables) | template
+            start = end
+    except (ValueError, KeyError, TypeError, OverflowError):
+        return None
+
+    words = np.empty(count, dtype=np.int64)
+    words[order] = sorted_words
+    return addresses, words
+
+# writes the words into a Memory_Image. Consecutive addresses go in as one block, every .org starts a new one
+def write_words(image, addresses, words):
+    if not len(words):
+        return
+    data = memoryview(words.astype(">u4").tobytes())
+    breaks = (np.flatnonzero(np.diff(addresses) != 4) + 1).tolist()
+    bounds = [0] + breaks + [len(words)]
+    for start, end in zip(bounds, bounds[1:]):
+        image.write(int(addresses[start]), data[start * 4:end * 4])
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+
+from src import __version__
+from src.Memory_Image import Memory_Image
+
+# On-disk cache of assembled images. The key is a hash of the source text, the assembler version and the options,
+# so a hit can skip every stage of the pipeline and hand back the rom/ram images directly
+
+# dependencies are the paths of the included files, their contents go into the key as well
+def cache_key(source_text, options=None, dependencies=()):
+    digest = hashlib.sha256()
+    digest.update(f"MIPS_Assembler {__version__}\n".encode())
+    # sorted so the same options always give the same key
+    for name, value in sorted((options or {}).items()):
+        digest.update(f"{name}={value!r}\n".encode())
+    for path in dependencies:
+        digest.update(f"\0{path}\0".encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    digest.update(b"\0")
+    digest.update(source_text.encode())
+    return digest.hexdigest()
+
+# entries are sharded by the first two hex digits so a single directory doesn't get too large
+def cache_path(cache_dir, key, extension="bin"):
+    return os.path.join(cache_dir, key[:2], f"{key}.{extension}")
+
+# entry layout, big-endian: magic, then the rom and the ram image. An image is its end and segment count (2 x u32),
+# then start, length (2 x u32) and the bytes of every written segment. The gaps aren't stored, so a hit rebuilds the
+# same sparse image as the assembler did and formats like Intel HEX come out the same warm or cold
+ENTRY_MAGIC = b"MIPSIMG\x01"
+IMAGE_HEADER = struct.Struct(">2I")
+
+# returns (rom_image, ram_image) or None on a miss
+def load_cached(cache_dir, key, rom_size=None, ram_size=None):
+    try:
+        with open(cache_path(cache_dir, key), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    # entries written before the segments were kept have no magic, they count as a miss
+    if not data.startswith(ENTRY_MAGIC):
+        return None
+    try:
+        position = len(ENTRY_MAGIC)
+        rom, position = unpack_image("ROM", data, position, rom_size)
+        ram, position = unpack_image("RAM", data, position, ram_size)
+    except (struct.error, ValueError):
+        return None
+    if position != len(data):
+        return None
+    return rom, ram
+
+def store_cached(cache_dir, key, rom, ram):
+    write_entry(cache_path(cache_dir, key), b"".join([ENTRY_MAGIC, *pack_image(rom), *pack_image(ram)]))
+
+def pack_image(image):
+    segments = list(image.iter_segments())
+    yield IMAGE_HEADER.pack(image.end, len(segments))
+    for start, segment in segments:
+        yield IMAGE_HEADER.pack(start, len(segment))
+        yield segment
+
+def unpack_image(name, data, position, size):
+    image = Memory_Image(name, size)
+    end, count = IMAGE_HEADER.unpack_from(data, position)
+    position += IMAGE_HEADER.size
+    for _ in range(count):
+        start, length = IMAGE_HEADER.unpack_from(data, position)
+        position += IMAGE_HEADER.size
+        if position + length > len(data):
+            raise ValueError(f"{name} segment at {hex(start)} is cut off")
+        image.write(start, data[position:position + length])
+        position += length
+    # trailing .space/.org padding was only reserved
+    image.reserve(0, end)
+    return image, position
+
+# parsed modules of included files (see src/Include_Handler.py), pickled. The cache directory is trusted like the
+# sources themselves, an entry that can't be loaded counts as a miss
+def load_cached_module(cache_dir, key):
+    try:
+        with open(cache_path(cache_dir, key, "module"), "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+def store_cached_module(cache_dir, key, items):
+    write_entry(cache_path(cache_dir, key, "module"), pickle.dumps(items, pickle.HIGHEST_PROTOCOL))
+
+def write_entry(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # write to a temp file and rename it into place so batch workers never read a half written entry
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
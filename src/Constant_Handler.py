@@ -31,17 +31,20 @@ class ConstantTable:
 # function that creates the constant table from the lines
 def process_constants(lines):
     const_table = ConstantTable()
+    lines = list(iter_process_constants(lines, const_table))
+    return lines, const_table
 
+# generator version, fills const_table while passing every line through unchanged
+def iter_process_constants(lines, const_table):
     for line in lines:
-         if line.get("directive", "").lower() == ".equ":
-            label = line.get("name") or line.get("label")
-            value_str = line.get("value")
+         if line.directive is not None and line.directive.lower() == ".equ":
+            label = line.name or line.label
+            value = line.value
 
-            if not label or value_str is None:
+            if not label or value is None:
                 raise ValueError(f"Invalid .EQU directive: {line}")
 
-            # Convert value string to int (supports hex, binary, decimal)
-            value = int(value_str, 0)
+            # the parser already converted the value to an int
             const_table.add(label, value)
 
-    return lines, const_table
+         yield line
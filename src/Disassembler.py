@@ -0,0 +1,301 @@
+import struct
+from collections import namedtuple
+
+from src.Encoder import instruction_map, r_type_shapes, encode_instruction, branch_mnemonics
+from src.Label_Handler import Label_Table
+from src.Line_Parser import Operand, format_operands
+
+# NumPy is optional, without it the fields are split in plain Python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Turns rom images back into source. The decode table is built from the same instruction_map the encoder uses:
+# every mnemonic gets a slot keyed by its opcode and a selector, the funct field for R-type words, the rt field for
+# opcode 1 (bgez/bltz) and 0 for everything else. Bits an instruction doesn't use have to be zero, other words are
+# reported as unknown. Every distinct word is decoded once, and with NumPy the fields and table slots of the whole
+# image come from array operations, so multi-megabyte dumps stay fast.
+# Branch and jump targets become labels when the symbols of the program are known, raw word addresses otherwise
+
+Disassembled_Line = namedtuple("Disassembled_Line", "address word mnemonic operands")   # mnemonic None if unknown
+
+RS_BITS = 0x1F << 21
+RT_BITS = 0x1F << 16
+RD_BITS = 0x1F << 11
+SHAMT_BITS = 0x1F << 6
+
+# fields each R-type shape leaves unused
+r_type_unused = {
+    "rd_rs_rt": SHAMT_BITS,
+    "shift": RS_BITS,
+    "rs": RT_BITS | RD_BITS | SHAMT_BITS,
+    "rd": RS_BITS | RT_BITS | SHAMT_BITS,
+    "rs_rt": RD_BITS | SHAMT_BITS,
+}
+
+def decode_key(opcode, selector):
+    return (opcode << 6) | selector
+
+# the inverse of instruction_map: entries[i] = (mnemonic, shape, unused bits), table[decode_key] = i or -1
+def build_decode_table():
+    entries = []
+    table = [-1] * 4096
+    for mnemonic, info in instruction_map.items():
+        opcode = int(info["opcode"], 16)
+        instr_type = info["type"]
+        unused = 0
+        selector = 0
+        if instr_type == "R-type":
+            shape = r_type_shapes.get(mnemonic, "rd_rs_rt")
+            selector = int(info["funct"], 16)
+            unused = r_type_unused[shape]
+        elif instr_type == "Branch":
+            shape = "branch2" if mnemonic in ("beq", "bne") else "branch1"
+            if opcode == 1:
+                selector = 1 if mnemonic == "bgez" else 0
+            else:
+                unused = 0 if shape == "branch2" else RT_BITS
+        else:
+            shape = instr_type
+
+        key = decode_key(opcode, selector)
+        if table[key] != -1:
+            raise ValueError(f"{mnemonic} and {entries[table[key]][0]} have the same encoding")
+        table[key] = len(entries)
+        entries.append((mnemonic, shape, unused))
+    return entries, table
+
+decode_entries, decode_table = build_decode_table()
+unused_bits = [unused for _, _, unused in decode_entries]
+
+# opcode, rs, rt, rd, shamt, funct, imm (16 bit, unsigned) and target (26 bit) of a word.
+# Works on plain ints and on NumPy arrays alike
+def split_fields(words):
+    return (words >> 26, (words >> 21) & 0x1F, (words >> 16) & 0x1F, (words >> 11) & 0x1F,
+            (words >> 6) & 0x1F, words & 0x3F, words & 0xFFFF, words & 0x03FFFFFF)
+
+# register operands are shared, most of the operands of an image are registers
+register_operands = tuple(Operand("reg", number) for number in range(32))
+
+# immediates repeat almost as much, every distinct value gets one operand per image
+class Immediate_Cache(dict):
+    def __missing__(self, value):
+        operand = self[value] = Operand("imm", value)
+        return operand
+
+def signed16(value):
+    return value - 0x10000 if value & 0x8000 else value
+
+# decode table slot of a word from its fields, -1 if it isn't an instruction
+def lookup(word, opcode, rt, funct):
+    index = decode_table[decode_key(opcode, funct if opcode == 0 else rt if opcode == 1 else 0)]
+    if index < 0 or word & unused_bits[index]:
+        return -1
+    return index
+
+# (mnemonic, operands) of one decode table slot filled with the fields of a word, (None, ()) if the fields don't fit.
+# Branches keep their raw word offset as the last operand, disassemble() turns it into the target
+def decode_entry(index, rs, rt, rd, shamt, imm, target, imms):
+    if index < 0:
+        return None, ()
+    mnemonic, shape, _ = decode_entries[index]
+    reg = register_operands
+    if shape == "rd_rs_rt":
+        operands = (reg[rd], reg[rs], reg[rt])
+    elif shape == "shift":
+        operands = (reg[rd], reg[rt], imms[shamt])
+    elif shape == "rs":
+        operands = (reg[rs],)
+    elif shape == "rd":
+        operands = (reg[rd],)
+    elif shape == "rs_rt":
+        operands = (reg[rs], reg[rt])
+    elif shape == "I-type":
+        # the logical immediates are zero extended, the arithmetic ones sign extended
+        value = imm if mnemonic in ("andi", "ori", "xori") else signed16(imm)
+        operands = (reg[rt], reg[rs], imms[value])
+    elif shape == "branch2":
+        operands = (reg[rs], reg[rt], imms[signed16(imm)])
+    elif shape == "branch1":
+        operands = (reg[rs], imms[signed16(imm)])
+    elif shape == "Jump":
+        operands = (imms[target],)
+    else:
+        # memory offsets are written in words, a byte offset that isn't one can't be expressed
+        offset = signed16(imm)
+        if offset % 4:
+            return None, ()
+        operands = (reg[rt], Operand("mem", imms[offset // 4], reg[rs]))
+    return mnemonic, operands
+
+# the decoded words of an image, one column per field so large images don't need an object per word
+class Disassembly:
+    __slots__ = ("base_address", "words", "mnemonics", "operands")
+
+    def __init__(self, base_address, words, mnemonics, operands):
+        self.base_address = base_address
+        self.words = words            # int per word
+        self.mnemonics = mnemonics    # mnemonic per word, None if it isn't an instruction
+        self.operands = operands      # Operand tuple per word
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        address = self.base_address
+        for word, mnemonic, operands in zip(self.words, self.mnemonics, self.operands):
+            yield Disassembled_Line(address, word, mnemonic, operands)
+            address += 4
+
+    def unknown_count(self):
+        return self.mnemonics.count(None)
+
+# decodes a rom image into a Disassembly, a trailing partial word is zero padded.
+# symbols are the text labels (name -> byte address), branch and jump targets with a label use it.
+# data_symbols are the .data labels, used for absolute loads and stores (offset(r0))
+def disassemble(data, symbols=None, data_symbols=None, base_address=0):
+    return decode_image(data, reverse_symbols(symbols), reverse_symbols(data_symbols), base_address)
+
+# Every distinct word is decoded once, unrolled code and zero padding repeat the same words a lot.
+# Only branches depend on where the word is, their targets are filled in per position afterwards
+def decode_image(data, code_labels, data_labels, base_address=0):
+    data = bytes(data)
+    data += bytes(-len(data) % 4)
+    if np is not None:
+        words, inverse, fields = split_image_numpy(data)
+    else:
+        words = list(struct.unpack(f">{len(data) // 4}I", data))
+        unique = list(dict.fromkeys(words))
+        position = {word: i for i, word in enumerate(unique)}
+        inverse = [position[word] for word in words]
+        fields = []
+        for word in unique:
+            opcode, rs, rt, rd, shamt, funct, imm, target = split_fields(word)
+            fields.append((lookup(word, opcode, rt, funct), rs, rt, rd, shamt, imm, target))
+
+    imms = Immediate_Cache()
+    label_operands = {}
+
+    # byte address -> label operand, or the word address the encoder expects for raw numbers
+    def code_operand(address):
+        operand = label_operands.get(address)
+        if operand is None:
+            name = code_labels.get(address)
+            operand = label_operands[address] = Operand("sym", name) if name is not None else imms[address >> 2]
+        return operand
+
+    mnemonics = []
+    operands = []
+    for entry in fields:
+        mnemonic, ops = decode_entry(*entry, imms)
+        if mnemonic in jump_mnemonics:
+            if code_labels:
+                ops = (code_operand(ops[0].value << 2),)
+        elif mnemonic in memory_mnemonics:
+            mem = ops[1]
+            if mem.base.value == 0 and mem.value.value * 4 in data_labels:
+                ops = (ops[0], Operand("mem", Operand("sym", data_labels[mem.value.value * 4]), mem.base))
+        mnemonics.append(mnemonic)
+        operands.append(ops)
+
+    # spread the distinct words back over the image and find the branches, with NumPy as array indexing
+    if np is not None:
+        is_branch = np.asarray([mnemonic in branch_mnemonics for mnemonic in mnemonics], dtype=bool)
+        branches = np.flatnonzero(is_branch[inverse]).tolist()
+        mnemonics = np.asarray(mnemonics, dtype=object)[inverse].tolist()
+        operands = np.fromiter(operands, dtype=object, count=len(operands))[inverse].tolist()
+    else:
+        is_branch = [mnemonic in branch_mnemonics for mnemonic in mnemonics]
+        branches = [i for i, u in enumerate(inverse) if is_branch[u]]
+        mnemonics = list(map(mnemonics.__getitem__, inverse))
+        operands = list(map(operands.__getitem__, inverse))
+
+    result = Disassembly(base_address, words, mnemonics, operands)
+    all_operands = result.operands
+    for i in branches:
+        ops = all_operands[i]
+        all_operands[i] = ops[:-1] + (code_operand(base_address + 4 * i + 4 + ops[-1].value * 4),)
+    return result
+
+# the table lookup of the whole image as array operations. Returns the words, the position of every word among the
+# distinct words (an array) and (slot, rs, rt, rd, shamt, imm, target) per distinct word
+def split_image_numpy(data):
+    words = np.frombuffer(data, dtype=">u4").astype(np.int64)
+    unique, inverse = np.unique(words, return_inverse=True)
+    opcode, rs, rt, rd, shamt, funct, imm, target = split_fields(unique)
+
+    selector = np.where(opcode == 0, funct, np.where(opcode == 1, rt, 0))
+    index = np.asarray(decode_table)[decode_key(opcode, selector)]
+    unused = np.asarray(unused_bits + [0])[index]   # index -1 picks the padding
+    index = np.where((index >= 0) & (unique & unused == 0), index, -1)
+
+    fields = zip(index.tolist(), rs.tolist(), rt.tolist(), rd.tolist(), shamt.tolist(), imm.tolist(), target.tolist())
+    return words.tolist(), inverse.ravel(), fields
+
+jump_mnemonics = frozenset(m for m, info in instruction_map.items() if info["type"] == "Jump")
+memory_mnemonics = frozenset(m for m, info in instruction_map.items() if info["type"] == "Memory")
+
+# address -> name, the first label defined at an address wins
+def reverse_symbols(symbols):
+    reverse = {}
+    for name, address in (symbols or {}).items():
+        reverse.setdefault(address, name)
+    return reverse
+
+# the disassembly as source that assembles back to the same image. Labels get their own line, the address and word
+# of each instruction go in a comment. .data labels used by loads and stores become .equ word addresses, which the
+# encoder resolves the same way. Unknown words are commented out and followed by an .org so later addresses match
+def format_listing(result, symbols=None, data_symbols=None):
+    labels = {}
+    for name, address in (symbols or {}).items():
+        labels.setdefault(address, []).append(name)
+
+    out = [".text"]
+    out.extend(f".equ {name} = {address >> 2}" for name, address in (data_symbols or {}).items())
+    if result.base_address:
+        out.append(f".org {result.base_address >> 2}")
+
+    # everything but the branches reads the same wherever the word is, so those lines are formatted once per word
+    # and only get their address filled in
+    templates = {}
+    address = result.base_address
+    for word, mnemonic, operands in zip(result.words, result.mnemonics, result.operands):
+        if address in labels:
+            out.extend(f"{name}:" for name in labels[address])
+        if mnemonic is None:
+            out.append(f"    # .word 0x{word:08X}{'':18}# {address:08X}: {word:08X} unknown")
+            out.append(f".org {(address >> 2) + 1}")
+        elif mnemonic in branch_mnemonics:
+            out.append(format_line(mnemonic, operands, word) % address)
+        else:
+            template = templates.get(word)
+            if template is None:
+                template = templates[word] = format_line(mnemonic, operands, word)
+            out.append(template % address)
+        address += 4
+    return "\n".join(out) + "\n"
+
+# one listing line with a %08X left for the address
+def format_line(mnemonic, operands, word):
+    text = f"{mnemonic} {format_operands(operands)}".rstrip().replace("%", "%%")
+    return f"    {text:<32}# %08X: {word:08X}"
+
+# decodes the image and encodes every instruction again, returns (line, problem) for every word that doesn't come
+# back the same. A good image and a correct decoder give an empty list
+def round_trip(data, symbols=None, data_symbols=None):
+    label_table = Label_Table()
+    label_table.table = {**(data_symbols or {}), **(symbols or {})}
+    mismatches = []
+    for line in disassemble(data, symbols, data_symbols):
+        if line.mnemonic is None:
+            mismatches.append((line, "unknown instruction"))
+            continue
+        try:
+            word = encode_instruction(line.mnemonic, line.operands, label_table, {}, line.address)
+        except ValueError as e:
+            mismatches.append((line, str(e)))
+            continue
+        if word != line.word:
+            mismatches.append((line, f"encodes back to {word:08X}"))
+    return mismatches
@@ -38,6 +38,7 @@ instruction_map = {
 #register map
 register_map = {
     **{f"r{i}": 0x00 + i for i in range(32)},
+    "at": 0x01,  # register 1, the scratch register of the pseudo-instructions
     "sp": 0x1E,  # register 30
     "ra": 0x1F   # register 31
 }
@@ -47,198 +48,251 @@ def get_register_number(reg_name):
         return register_map[reg_name]
     raise ValueError(f"Unknown register name: {reg_name}")
 
+# R-type instructions that do not use the standard "rd, rs, rt" operand shape
+r_type_shapes = {
+    "sll": "shift", "srl": "shift", "sra": "shift",
+    "jr": "rs",
+    "mfhi": "rd", "mflo": "rd",
+    "mult": "rs_rt", "multu": "rs_rt",
+}
+
+# Operands come pre-tokenized from the parser (see Line_Parser.Operand): registers are already numbers and
+# immediates already ints, the encoders only check the operand kinds and resolve symbols
+
 # function used to decode a single line that contains an instruction
 def encode_instruction(mnemonic, operands, label_table=None, constants={}, current_address=0):
-    info = instruction_map.get(mnemonic)
-    if not info:
+    encoder = compiled_map.get(mnemonic)
+    if encoder is None:
         raise ValueError(f"Unknown instruction: {mnemonic}")
+    return encoder(operands, label_table, constants, current_address)
 
+# builds the specialized encoder for one mnemonic. The opcode/funct hex strings are parsed here once,
+# so encoding a line only has to fill in the operand fields of the pre-shifted template
+def compile_instruction(mnemonic, info):
+    template = instruction_template(mnemonic, info)
     instr_type = info["type"]
 
     if instr_type == "R-type":
-        return encode_r_type(mnemonic, operands, info)
+        shape = r_type_shapes.get(mnemonic, "rd_rs_rt")
+        return r_type_encoders[shape](mnemonic, template)
     elif instr_type == "I-type":
-        return encode_i_type(mnemonic, operands, info, constants)
+        return compile_i_type(mnemonic, template)
     elif instr_type == "Branch":
-        return encode_branch(mnemonic, operands, info, label_table, current_address, constants)
+        return compile_branch(mnemonic, template)
     elif instr_type == "Jump":
-        return encode_jump(mnemonic, operands, info, label_table, constants)
+        return compile_jump(mnemonic, template)
     elif instr_type == "Memory":
-        return encode_memory(mnemonic, operands, info, constants, label_table)
+        return compile_memory(mnemonic, template)
     else:
         raise ValueError(f"Unsupported instruction type: {instr_type}")
-# encodes r type instructions
-def encode_r_type(mnemonic, operands, info):
-    opcode = 0
-    funct = int(info["funct"], 16)
- # instruction that does not have the typical fields of a r instructions
-    if mnemonic in ["sll", "srl", "sra"]:
-        # sll rd, rt, shamt
-        try:
-            rd_str, rt_str, shamt_str = [x.strip() for x in operands.split(",")]
-            rd = get_register_number(rd_str)
-            rt = get_register_number(rt_str)
-            shamt = int(shamt_str, 0)
-            rs = 0
-        except Exception as e:
-            raise ValueError(f"Error parsing shift instruction '{mnemonic}': {e}")
-# instruction that does not have the typical fields of a r instruction
-    elif mnemonic == "jr":
-        # jr rs
-        try:
-            rs_str = operands.strip()
-            rs = get_register_number(rs_str)
-            rt = 0
-            rd = 0
-            shamt = 0
-        except Exception as e:
-            raise ValueError(f"Error parsing jr: {e}")
-
-    elif mnemonic in ["mfhi", "mflo"]:
-        # mfhi rd / mflo rd
-        try:
-            rd_str = operands.strip()
-            rd = get_register_number(rd_str)
-            rs = 0
-            rt = 0
-            shamt = 0
-        except Exception as e:
-            raise ValueError(f"Error parsing {mnemonic}: {e}")
-
-    else:
-        # Standard format: add rd, rs, rt
-        try:
-            rd_str, rs_str, rt_str = [x.strip() for x in operands.split(",")]
-            rd = get_register_number(rd_str)
-            rs = get_register_number(rs_str)
-            rt = get_register_number(rt_str)
-            shamt = 0
-        except Exception as e:
-            raise ValueError(f"Error parsing standard R-type '{mnemonic}': {e}")
-
-    encoded = (
-        (opcode << 26) |
-        (rs << 21) |
-        (rt << 16) |
-        (rd << 11) |
-        (shamt << 6) |
-        funct
-    )
-
-    return encoded
-#encodes i type instructions, incorporates the constants table
-def encode_i_type(mnemonic, operands, info, constants={}):
-    rt_str, rs_str, imm_str = [x.strip() for x in operands.split(",")]
-    rt = get_register_number(rt_str)
-    rs = get_register_number(rs_str)
-
-    # Checking if the imm is in the constants table
-    if imm_str in constants:
-        imm = constants[imm_str]
-    else:
-        imm = int(imm_str, 0)
 
-    imm = imm & 0xFFFF
-    # int supports hex,decimal and binary inputs/
+# the fixed bits of a mnemonic's word: opcode and funct, and the rt field that tells bgez from bltz
+def instruction_template(mnemonic, info):
     opcode = int(info["opcode"], 16)
+    funct = int(info["funct"], 16) if info["funct"] else 0
+    template = (opcode << 26) | funct
+    # bgez/bltz share an opcode, the rt field picks between them
+    if mnemonic == "bgez":
+        template |= 1 << 16
+    return template
 
-    return (
-        (opcode << 26) |
-        (rs << 21) |
-        (rt << 16) |
-        imm
-    )
-# function that eoncodes branch instructions, the target is word aligned
-def encode_branch(mnemonic, operands, info, label_table, current_address, constants={}):
-    parts = [x.strip() for x in operands.split(",")]
-
-
-    if mnemonic in ["beq", "bne"]:
-        rs = get_register_number(parts[0])
-        rt = get_register_number(parts[1])
-        target_str = parts[2]
-    elif mnemonic in ["bgez", "bltz"]:
-        rs = get_register_number(parts[0])
-        rt = 1 if mnemonic == "bgez" else 0
-        target_str = parts[1]
-    elif mnemonic in ["bgtz", "blez"]:
-        rs = get_register_number(parts[0])
-        rt = 0
-        target_str = parts[1]
-    else:
-        raise ValueError(f"Unsupported branch mnemonic: {mnemonic}")
-
-    # Determine the full byte address of the target
-    if target_str in label_table.table:
-        target_address = label_table.get(target_str)  # already a byte address
-    elif target_str in constants:
-        # Assume constants are word-aligned
-        target_address = constants[target_str] * 4
-    else:
-        # Raw numeric offset → treat as word-aligned address
-        target_address = int(target_str, 0) * 4
+# error helpers, only called once an operand turned out to be wrong
+def operand_count_error(mnemonic, operands, count):
+    return ValueError(f"{mnemonic} expects {count} operand{'s' if count != 1 else ''}, got {len(operands)}")
 
-    # Compute the offset relative to PC, turn the byte address into a word address aswell
-    offset = (target_address - (current_address + 4)) // 4
+def register_error(operands):
+    for operand in operands:
+        if operand.kind == "sym":
+            return ValueError(f"Unknown register name: {operand.value}")
+        if operand.kind != "reg":
+            return ValueError(f"Expected a register, found {operand.kind} operand")
+    return ValueError("Expected a register")
 
+# value of an immediate operand, symbols are looked up in the constants table.
+# addr operands (the short form of la) are the byte address of a label and have to fit the 16 bit field
+def resolve_immediate(operand, constants, label_table=None):
+    if operand.kind == "imm":
+        return operand.value
+    if operand.kind == "sym":
+        if operand.value in constants:
+            return constants[operand.value]
+        raise ValueError(f"Unknown constant: {operand.value}")
+    if operand.kind == "addr":
+        if not label_table or operand.value not in label_table.table:
+            raise ValueError(f"Unknown label: {operand.value}")
+        address = label_table.table[operand.value]
+        if address > 0xFFFF:
+            raise ValueError(f"Address {hex(address)} of {operand.value} does not fit in 16 bits")
+        return address
+    raise ValueError(f"Expected an immediate, found {operand.kind} operand")
 
+# byte address of a branch target or memory offset. Labels are already byte addresses,
+# constants and raw numbers are word addresses
+def resolve_byte_address(operand, label_table, constants):
+    if operand.kind == "sym":
+        name = operand.value
+        if label_table and name in label_table.table:
+            return label_table.table[name]
+        if name in constants:
+            return constants[name] * 4
+        raise ValueError(f"Unknown symbol: {name}")
+    if operand.kind == "imm":
+        return operand.value * 4
+    raise ValueError(f"Expected a label or address, found {operand.kind} operand")
 
-    opcode = int(info["opcode"], 16)
+# Standard format: add rd, rs, rt
+def compile_rd_rs_rt(mnemonic, template):
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != 3:
+            raise operand_count_error(mnemonic, operands, 3)
+        rd, rs, rt = operands
+        if rd.kind != "reg" or rs.kind != "reg" or rt.kind != "reg":
+            raise register_error(operands)
+        return template | (rs.value << 21) | (rt.value << 16) | (rd.value << 11)
+    return encode
 
-    return (
-        (opcode << 26) |
-        (rs << 21) |
-        (rt << 16) |
-        (offset & 0xFFFF)
-    )
+# sll rd, rt, shamt
+def compile_shift(mnemonic, template):
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != 3:
+            raise operand_count_error(mnemonic, operands, 3)
+        rd, rt, shamt = operands
+        if rd.kind != "reg" or rt.kind != "reg":
+            raise register_error(operands[:2])
+        shamt = resolve_immediate(shamt, constants, label_table)
+        return template | (rt.value << 16) | (rd.value << 11) | ((shamt & 0x1F) << 6)
+    return encode
 
-#jump encoder, jump target is word aligned
-def encode_jump(mnemonic, operands, info, label_table,constants):
-    opcode = int(info["opcode"], 16)
-    operand = operands.strip()
-
-    operand = operands.strip()
-    # shift addresses in label table due to the fact they are byte aligned
-    if label_table and operand in label_table.table:
-        target_address = label_table[operand]
-        target = target_address >> 2
-    elif operand in constants:
-        # assume that the constant is already word aligned
-        target = constants[operand]
-    else:
-        target = int(operand, 0)
+# jr rs
+def compile_rs(mnemonic, template):
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != 1:
+            raise operand_count_error(mnemonic, operands, 1)
+        if operands[0].kind != "reg":
+            raise register_error(operands)
+        return template | (operands[0].value << 21)
+    return encode
+
+# mfhi rd / mflo rd
+def compile_rd(mnemonic, template):
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != 1:
+            raise operand_count_error(mnemonic, operands, 1)
+        if operands[0].kind != "reg":
+            raise register_error(operands)
+        return template | (operands[0].value << 11)
+    return encode
+
+# mult rs, rt / multu rs, rt, the result goes to HI/LO so there is no rd
+def compile_rs_rt(mnemonic, template):
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != 2:
+            raise operand_count_error(mnemonic, operands, 2)
+        rs, rt = operands
+        if rs.kind != "reg" or rt.kind != "reg":
+            raise register_error(operands)
+        return template | (rs.value << 21) | (rt.value << 16)
+    return encode
+
+r_type_encoders = {
+    "rd_rs_rt": compile_rd_rs_rt,
+    "shift": compile_shift,
+    "rs": compile_rs,
+    "rd": compile_rd,
+    "rs_rt": compile_rs_rt,
+}
+
+#encodes i type instructions, incorporates the constants table
+def compile_i_type(mnemonic, template):
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != 3:
+            raise operand_count_error(mnemonic, operands, 3)
+        rt, rs, imm = operands
+        if rt.kind != "reg" or rs.kind != "reg":
+            raise register_error(operands[:2])
+
+        # Checking if the imm is in the constants table
+        imm = imm.value if imm.kind == "imm" else resolve_immediate(imm, constants, label_table)
+
+        return template | (rs.value << 21) | (rt.value << 16) | (imm & 0xFFFF)
+    return encode
+
+# function that encodes branch instructions, the target is word aligned
+def compile_branch(mnemonic, template):
+    # beq/bne compare two registers, the other branches compare rs against zero
+    count = 3 if mnemonic in ("beq", "bne") else 2
+
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != count:
+            raise operand_count_error(mnemonic, operands, count)
+        registers = operands[:-1]
+        for operand in registers:
+            if operand.kind != "reg":
+                raise register_error(registers)
+        rs = registers[0].value
+        rt = registers[1].value if count == 3 else 0
+
+        # Determine the full byte address of the target
+        target_address = resolve_byte_address(operands[-1], label_table, constants)
 
-    target &= 0x03FFFFFF
+        # Compute the offset relative to PC, turn the byte address into a word address aswell
+        offset = (target_address - (current_address + 4)) // 4
+        # the field is 16 bits signed, a farther target used to wrap around silently
+        if not -0x8000 <= offset <= 0x7FFF:
+            raise ValueError(f"Branch target {hex(target_address)} is out of range ({offset} words)")
 
+        return template | (rs << 21) | (rt << 16) | (offset & 0xFFFF)
+    return encode
 
-    return (opcode << 26) | target
+#jump encoder, jump target is word aligned
+def compile_jump(mnemonic, template):
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != 1:
+            raise operand_count_error(mnemonic, operands, 1)
+        operand = operands[0]
+        # shift addresses in label table due to the fact they are byte aligned
+        if operand.kind == "sym" and label_table and operand.value in label_table.table:
+            target = label_table.table[operand.value] >> 2
+        else:
+            # assume that constants and raw numbers are already word aligned
+            target = resolve_immediate(operand, constants)
+
+        return template | (target & 0x03FFFFFF)
+    return encode
 
 # this function encodes mem instructions, although labels are byte addresses, the raw offset fields need to be inputed as word addresses
-def encode_memory(mnemonic, operands, info, constants={}, label_table=None):
-    try:
-        rt_str, mem_expr = [x.strip() for x in operands.split(",")]
-        offset_str, rs_str = mem_expr.replace(")", "").split("(")
-        rt = get_register_number(rt_str)
-        rs = get_register_number(rs_str.strip())
-        offset_str = offset_str.strip()
+def compile_memory(mnemonic, template):
+    def encode(operands, label_table, constants, current_address):
+        if len(operands) != 2 or operands[1].kind != "mem":
+            raise ValueError(f"{mnemonic} expects operands: rt, offset(rs)")
+        rt, mem = operands
+        if rt.kind != "reg" or mem.base.kind != "reg":
+            raise register_error((rt, mem.base))
 
         # Compute byte offset
-        if label_table and offset_str in label_table.table:
-            offset = label_table.get(offset_str)  # already a byte address
-        elif offset_str in constants:
-            offset = constants[offset_str] * 4    # word-aligned constant
-        else:
-            offset = int(offset_str, 0) * 4       # word-aligned
+        offset = resolve_byte_address(mem.value, label_table, constants)
 
-        offset &= 0xFFFF  # wrap to 16-bit
-    except Exception as e:
-        raise ValueError(f"Failed to parse memory operands: '{operands}'") from e
+        return template | (mem.base.value << 21) | (rt.value << 16) | (offset & 0xFFFF)
+    return encode
 
-    opcode = int(info["opcode"], 16)
+# compiled once at import: mnemonic -> specialized encoder
+compiled_map = {mnemonic: compile_instruction(mnemonic, info) for mnemonic, info in instruction_map.items()}
+
+# memoized encode_instruction for one assembly run. The label and constant tables are fixed once labels are processed,
+# so the symbols in (mnemonic, operands) always resolve to the same values and the pair is a complete key.
+# Branches are PC relative, their word depends on the address as well, so they are encoded directly
+def make_encode_cache(label_table=None, constants={}):
+    cache = {}
+
+    def encode(mnemonic, operands, current_address=0):
+        if mnemonic in branch_mnemonics:
+            return encode_instruction(mnemonic, operands, label_table, constants, current_address)
+        key = (mnemonic, operands)
+        word = cache.get(key)
+        if word is None:
+            word = cache[key] = encode_instruction(mnemonic, operands, label_table, constants, current_address)
+        return word
+
+    return encode
 
-    return (
-        (opcode << 26) |
-        (rs << 21) |
-        (rt << 16) |
-        offset
-    )
+branch_mnemonics = frozenset(m for m, info in instruction_map.items() if info["type"] == "Branch")
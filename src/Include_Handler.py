@@ -0,0 +1,116 @@
+import mmap
+import os
+import re
+from collections import namedtuple
+
+from src.Cache_Handler import cache_key, load_cached_module, store_cached_module
+from src.Line_Parser import Parsed_Line, Parse_Error, tokenize, parse_statement
+
+# .include "file.asm" support. An included file is read and parsed once per process into a Module, the list of items
+# the macro handler replays wherever the file is included: section lines as text, statements as Parsed_Line templates,
+# macro definitions and nested includes. Modules are kept in module_cache and re-read only when the file changes,
+# with a cache_dir they are also stored on disk so separate runs share them.
+# Every file is included at most once per assembly (an implicit include guard), a file including itself is an error.
+# .incbin "file" is looked up the same way, see load_binary
+
+INCLUDE_PATTERN = re.compile(r'\.include\s+"([^"]+)"\s*(?:#.*)?')
+# an .incbin line, with or without a label in front
+INCBIN_PATTERN = re.compile(r'(?:[A-Za-z_.$][\w.$]*\s*:\s*)?\.incbin\b')
+
+# a nested .include inside an included file, resolved when the module is replayed
+Include_Directive = namedtuple("Include_Directive", "name line_no")
+
+class Module:
+    __slots__ = ("path", "stamp", "items")
+
+    def __init__(self, path, stamp, items):
+        self.path = path
+        self.stamp = stamp    # (mtime, size) the items were parsed from
+        self.items = items
+
+# real path -> Module, shared by every assembly in the process
+module_cache = {}
+
+# the file name of an .include line
+def parse_include(stripped, line_no):
+    match = INCLUDE_PATTERN.fullmatch(stripped)
+    if match is None:
+        raise Parse_Error(line_no, 1, 'Invalid .include (expected: .include "file.asm")')
+    return match.group(1)
+
+# looks next to the including file first, then in the include directories. Returns the real path or None
+def resolve_include(name, from_dir, include_dirs=()):
+    for directory in (from_dir, *include_dirs):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return os.path.realpath(path)
+    return None
+
+# Maps the file of a parsed .incbin line, returns a new record whose values are a memoryview of the bytes between
+# offset and offset + length. Nothing is read until the view is copied into the ram image, and that copy is the only one.
+# The map stays open while a record uses it
+def load_binary(line, from_dir, include_dirs, position, parent=None, origin=None):
+    path = resolve_include(line.name, from_dir, include_dirs)
+    if path is None:
+        raise Parse_Error(*position, f".incbin file not found: {line.name}", parent)
+    offset, length = line.values
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if length is None else offset + length
+        if offset > size or end > size:
+            raise Parse_Error(*position, f".incbin {line.name} is {size} bytes, offset {offset}" +
+                              ("" if length is None else f" + length {length}") + " is past its end", parent)
+        # an empty file can't be mapped
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))[offset:end] if end > offset else memoryview(b"")
+    return Parsed_Line(None, line.label, directive=".incbin", name=path, values=data, line_no=line.line_no, origin=origin)
+
+# the Module of a file, parsed by build(lines, path) on the first use and whenever the file changed since
+def get_module(path, build, cache_dir=None):
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    module = module_cache.get(path)
+    if module is not None and module.stamp == stamp:
+        return module
+
+    with open(path, "r") as f:
+        text = f.read()
+
+    items = None
+    if cache_dir:
+        key = cache_key(text, {"entry": "module"})
+        items = load_cached_module(cache_dir, key)
+    if items is None:
+        items = build(text.splitlines(keepends=True), path)
+        if cache_dir:
+            store_cached_module(cache_dir, key, items)
+
+    module = module_cache[path] = Module(path, stamp, items)
+    return module
+
+# every file the source includes, directly or through other includes, found by scanning the text, and every .incbin file.
+# Used for the image cache key, so an edit to an included file is never served a stale image
+def find_includes(lines, base_dir, include_dirs=()):
+    found = []
+    pending = [(lines, base_dir)]
+    while pending:
+        lines, from_dir = pending.pop()
+        for line in lines:
+            stripped = line.strip()
+            if ".incbin" in stripped and INCBIN_PATTERN.match(stripped):
+                try:
+                    path = resolve_include(parse_statement(tokenize(line), None, 0).name, from_dir, include_dirs)
+                except Parse_Error:
+                    continue
+                if path is not None and path not in found:
+                    found.append(path)
+                continue
+            if not stripped.startswith(".include"):
+                continue
+            match = INCLUDE_PATTERN.fullmatch(stripped)
+            path = resolve_include(match.group(1), from_dir, include_dirs) if match else None
+            if path is None or path in found:
+                continue
+            found.append(path)
+            with open(path, "r") as f:
+                pending.append((f.readlines(), os.path.dirname(path)))
+    return found
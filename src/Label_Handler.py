@@ -3,6 +3,7 @@
 class Label_Table:
     def __init__(self):
         self.table = {}
+        self.sections = {}   # label -> .text/.data, text and data addresses both start at 0
 
     def __contains__(self, key):
         return key in self.table
@@ -11,10 +12,12 @@ class Label_Table:
         return self.table[key]
 
 
-    def add_label(self, label, address):
+    def add_label(self, label, address, section=None):
         if label in self.table:
             raise ValueError(f"Duplicate label detected: {label}")
         self.table[label] = address
+        if section is not None:
+            self.sections[label] = section
 
     def get_address(self, label):
         if label not in self.table:
@@ -39,20 +42,25 @@ class Label_Table:
 ## label processor that seperates data mem from instruction mem. We also add the correct address to the original lines list
 def process_labels(lines, start_text_addr=0x00000000, start_data_addr=0x00000000):
     label_table = Label_Table()
+    lines = list(iter_process_labels(lines, label_table, start_text_addr, start_data_addr))
+    return label_table, lines
+
+# generator version, yields each line once its address is assigned. Labels are only recorded when a table is given
+def iter_process_labels(lines, label_table=None, start_text_addr=0x00000000, start_data_addr=0x00000000):
     current_text_addr = start_text_addr
     current_data_addr = start_data_addr
 
     for line in lines:
-        section = line.get("section")
-        label   = line.get("label")
+        section = line.section
+        label   = line.label
 
         # handle .org directives. Note: .org address assignments are word aligned
-        if line.get("directive") == ".org":
-            value_str = line.get("value")
-            if value_str is None:
+        if line.directive == ".org":
+            value = line.value
+            if value is None:
                 raise ValueError(f".org directive missing value: {line}")
 
-            new_addr = int(value_str, 0) * 4  # convert word → byte address
+            new_addr = value * 4  # convert word → byte address
 
             if section == ".text":
                 current_text_addr = new_addr
@@ -60,39 +68,50 @@ def process_labels(lines, start_text_addr=0x00000000, start_data_addr=0x00000000
                 current_data_addr = new_addr
             else:
                 raise ValueError(f".org directive outside of .text/.data: {line}")
+            yield line
             continue  # skip assigning address to .org line
 
         # Handling text section
         if section == ".text":
             # Always assign current address
-            line["address"] = current_text_addr
+            line.address = current_text_addr
 
-            if label:
-                label_table.add_label(label, current_text_addr)
+            if label and label_table is not None:
+                label_table.add_label(label, current_text_addr, section)
 
             # Increment only if it's an instruction
-            if "mnemonic" in line:
+            if line.mnemonic is not None:
                 current_text_addr += 4
         # Handling data section
         elif section == ".data":
-            if label:
-                label_table.add_label(label, current_data_addr)
+            if label and label_table is not None:
+                label_table.add_label(label, current_data_addr, section)
 
-            if line.get("directive") == ".word":
-                values = line.get("values", [])
-                line["address"] = current_data_addr
+            if line.directive == ".word":
+                values = line.values
+                line.address = current_data_addr
                 current_data_addr += 4 * len(values)
 
-            elif line.get("directive") == ".byte":
-                values = line.get("values", [])
-                line["address"] = current_data_addr
+            elif line.directive == ".byte":
+                values = line.values
+                line.address = current_data_addr
                 padded_count = ((len(values) + 3) // 4) * 4  # we must round like this as demonstrated by the directive handler
                 current_data_addr += padded_count
 
-            elif line.get("directive") == ".space":
-                line["address"] = current_data_addr
-                word_count = int(line["value"], 0)
+            elif line.directive == ".space":
+                line.address = current_data_addr
+                word_count = line.value
                 current_data_addr += word_count * 4
 
-    return label_table, lines
+            # strings and .incbin hold their bytes, .fill (count, size, value). All of them end on a word boundary
+            elif line.directive in (".ascii", ".asciiz", ".incbin"):
+                line.address = current_data_addr
+                current_data_addr += (len(line.values) + 3) & ~3
+
+            elif line.directive == ".fill":
+                line.address = current_data_addr
+                count, size, _ = line.values
+                current_data_addr += (count * size + 3) & ~3
+
+        yield line
 
@@ -1,119 +1,378 @@
-# line parser, parses line by line to return a dictionary
+import os
+import re
+from collections import namedtuple
+
+from src.Encoder import register_map
+from src.Utilities import paused_gc
+
+# one parsed source line. Every pass shares these records, __slots__ keeps them much smaller than a dict per line.
+# Fields that don't apply to a line stay None.
+# line_no and origin say where the line was written, see format_location:
+#   origin None        line line_no of the source itself
+#   origin a path      line line_no of that included file
+#   origin Expansion   line line_no of the body of a macro, expanded by a call at Expansion.path/line_no
+# The passes after the parser copy both onto the lines they make out of a line (pseudo-instructions, long branches)
+class Parsed_Line:
+    __slots__ = ("section", "label", "mnemonic", "operands", "directive", "name", "value", "values", "address",
+                 "line_no", "origin")
+
+    def __init__(self, section, label=None, mnemonic=None, operands=None, directive=None,
+                 name=None, value=None, values=None, address=None, line_no=None, origin=None):
+        self.section = section
+        self.label = label
+        self.mnemonic = mnemonic
+        self.operands = operands
+        self.directive = directive
+        self.name = name
+        self.value = value
+        self.values = values
+        self.address = address
+        self.line_no = line_no
+        self.origin = origin
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__ if getattr(self, field) is not None)
+        return f"Parsed_Line({fields})"
+
+# the macro call a line was expanded from, shared by every line of the expansion. path is None for the source itself.
+# Nested calls are named after the innermost macro and placed at the outermost call
+Expansion = namedtuple("Expansion", "macro path line_no")
+
+# where a line came from, for messages: "line 12", "lib.asm line 3" or "line 12, macro PUSH line 2"
+def format_location(line):
+    origin = line.origin
+    if line.line_no is None:
+        return "an unknown line"
+    if isinstance(origin, Expansion):
+        where = f"line {origin.line_no}" if origin.path is None else f"{os.path.basename(origin.path)} line {origin.line_no}"
+        return f"{where}, macro {origin.macro} line {line.line_no}"
+    if origin is None:
+        return f"line {line.line_no}"
+    return f"{os.path.basename(origin)} line {line.line_no}"
+
+# the line of the source itself a line came from (a macro call for expansions), None for included files
+def source_line(line):
+    origin = line.origin
+    if origin is None:
+        return line.line_no
+    if isinstance(origin, Expansion) and origin.path is None:
+        return origin.line_no
+    return None
+
+# line parser, parses line by line to return a list of Parsed_Line records
 def parse_lines(lines):
+    # unlike dicts of strings the records are tracked by the cycle collector
+    with paused_gc():
+        return list(iter_parse_lines(lines))
+
+# One master regex splits a line into tokens. Names cover registers, symbols, mnemonics and directives,
+# numbers are checked with int(text, 0) so hex, binary, octal and decimal all work.
+# Strings come before comments, a # inside the quotes is part of the string
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\\n]|\\.)*")
+  | (?P<comment>\#.*)
+  | (?P<number>[-+]?\d\w*)
+  | (?P<name>[A-Za-z_.$][\w.$]*)
+  | (?P<punct>[,():=])
+  | (?P<bad>.)
+""", re.VERBOSE)
+
+NAME_PATTERN = re.compile(r"[A-Za-z_.$][\w.$]*")
+
+# escapes of .ascii/.asciiz strings, \xHH or one character
+ESCAPE_PATTERN = re.compile(r"\\(x[0-9A-Fa-f]{2}|.)")
+escapes = {"n": b"\n", "t": b"\t", "r": b"\r", "0": b"\0", "\\": b"\\", '"': b'"', "'": b"'"}
+
+# directives that lay out bytes and only make sense in .data
+data_only_directives = frozenset((".space", ".ascii", ".asciiz", ".fill", ".incbin"))
+
+# Instructions repeat a lot in generated code, so the typed result of an instruction is cached by its text
+# ("addu r3, r1, r2" -> mnemonic, operands). A repeated line only costs a dict lookup and shares the operand tuple
+# with every other copy, new lines go through the tokenizer once
+INSTRUCTION_CACHE_SIZE = 1 << 16
+instruction_cache = {}
+
+# typed instruction operand, produced once by the parser and consumed by the encoders
+#   reg: value = register number      imm: value = int      sym: value = label/constant name
+#   mem: value = offset operand (imm or sym), base = register operand, written offset(base)
+Operand = namedtuple("Operand", "kind value base", defaults=(None,))
+
+# path is set for errors in included files
+class Parse_Error(ValueError):
+    def __init__(self, line_no, column, message, path=None, location=None):
+        self.line_no = line_no
+        self.column = column
+        self.reason = message
+        self.path = path
+        if location is not None:
+            super().__init__(f"Error at {location}: {message}")
+            return
+        where = f"{path}: " if path else ""
+        super().__init__(f"{where}Line {line_no}, column {column}: {message}")
+
+    # the error of a pre-parsed record (an included statement or a macro expansion), at the place the record came
+    # from. line_no is the line of the source itself like for Assembly_Error, None inside an included file
+    @classmethod
+    def at_record(cls, line, message):
+        path = line.origin if isinstance(line.origin, str) else None
+        return cls(source_line(line), None, message, path, format_location(line))
+
+# returns (kind, text, column) for every token of the line, whitespace and comments dropped. Columns start at 1
+def tokenize(text, line_no=0):
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == "space" or kind == "comment":
+            continue
+        if kind == "bad":
+            raise Parse_Error(line_no, match.start() + 1, f"Unexpected character '{match.group()}'")
+        tokens.append((kind, match.group(), match.start() + 1))
+    return tokens
+
+def parse_number(token, line_no):
+    kind, text, column = token
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise Parse_Error(line_no, column, f"Invalid number '{text}'")
+
+# the bytes of a string token, utf-8 with the escapes decoded
+def parse_string(token, line_no):
+    kind, text, column = token
+    data = bytearray()
+    position = 1
+    for match in ESCAPE_PATTERN.finditer(text, 1, len(text) - 1):
+        data += text[position:match.start()].encode()
+        escape = match.group(1)
+        if len(escape) == 3:
+            data.append(int(escape[1:], 16))
+        elif escape in escapes:
+            data += escapes[escape]
+        else:
+            raise Parse_Error(line_no, column + match.start(), f"Unknown escape '\\{escape}'")
+        position = match.end()
+    data += text[position:-1].encode()
+    return bytes(data)
+
+# a name is a register if the register map knows it, anything else is a symbol resolved by the encoder
+def name_operand(text):
+    register = register_map.get(text)
+    if register is not None:
+        return Operand("reg", register)
+    return Operand("sym", text)
+
+# turns the tokens of one comma separated operand into an Operand
+def parse_operand(group, line_no, column):
+    if not group:
+        raise Parse_Error(line_no, column, "Missing operand")
+    kinds = tuple(token[0] if token[0] != "punct" else token[1] for token in group)
+
+    if kinds == ("number",):
+        return Operand("imm", parse_number(group[0], line_no))
+    if kinds == ("name",):
+        return name_operand(group[0][1])
+    # offset(base), the offset may be left out
+    if kinds[-3:] == ("(", "name", ")") and len(kinds) <= 4:
+        if len(kinds) == 3:
+            offset = Operand("imm", 0)
+        elif kinds[0] == "number":
+            offset = Operand("imm", parse_number(group[0], line_no))
+        elif kinds[0] == "name":
+            offset = Operand("sym", group[0][1])
+        else:
+            raise Parse_Error(line_no, group[0][2], f"Invalid memory offset '{group[0][1]}'")
+        return Operand("mem", offset, name_operand(group[-2][1]))
+    raise Parse_Error(line_no, group[0][2], "Invalid operand '" + " ".join(token[1] for token in group) + "'")
+
+# splits the operand tokens on commas and types each operand
+def parse_operands(tokens, line_no=0, column=0):
+    operands = []
+    group = []
+    for token in tokens:
+        if token[1] == ",":
+            operands.append(parse_operand(group, line_no, token[2]))
+            group = []
+        else:
+            group.append(token)
+    if group or operands:
+        operands.append(parse_operand(group, line_no, tokens[-1][2] if tokens else column))
+    return tuple(operands)
+
+# operands back in source form, used for error messages
+def format_operands(operands):
+    return ", ".join(format_operand(operand) for operand in operands)
+
+def format_operand(operand):
+    if operand.kind == "reg":
+        return f"r{operand.value}"
+    if operand.kind == "mem":
+        return f"{format_operand(operand.value)}({format_operand(operand.base)})"
+    return str(operand.value)
+
+# generator version of parse_lines, yields one Parsed_Line per line.
+# Lines can also be Parsed_Line records already (macro expansions), those only get their section filled in.
+# An int among the lines is the line number of the next text line, expand_macros puts one where it left lines out
+def iter_parse_lines(lines):
 
-    parsed = []
     current_section = None
     line_no = 0
 
     for raw_line in lines:
         line_no += 1
-        line = raw_line.strip()
-
-        line = line.split("#")[0].strip()
 
-        # first we skip blanks and comments
-        if not line or line.startswith("#"):
+        if not isinstance(raw_line, str):
+            if raw_line.__class__ is int:
+                line_no = raw_line - 1
+                continue
+            if current_section is None:
+                raise Parse_Error.at_record(raw_line, "Directive or instruction appears before section (.text/.data)")
+            if raw_line.directive in data_only_directives and current_section != ".data":
+                raise Parse_Error.at_record(raw_line, f"{raw_line.directive} must appear in .data section")
+            raw_line.section = current_section
+            yield raw_line
             continue
 
-        parts = line.split()
+        # fast path for blank lines, labels and instructions that were already tokenized once
+        code = raw_line.partition("#")[0].strip()
+        if not code:
+            continue
         label = None
+        if ":" in code:
+            label, _, code = code.partition(":")
+            label = label.strip()
+            code = code.strip()
+        if current_section is not None and (label is None or NAME_PATTERN.fullmatch(label)):
+            if not code:
+                yield Parsed_Line(current_section, label=label, line_no=line_no)
+                continue
+            cached = instruction_cache.get(code)
+            if cached is not None:
+                yield Parsed_Line(current_section, label=label, mnemonic=cached[0], operands=cached[1], line_no=line_no)
+                continue
 
+        tokens = tokenize(raw_line, line_no)
 
-        if line == ".data":
-            current_section = ".data"
+        # first we skip blanks and comments
+        if not tokens:
             continue
-        elif line == ".text":
-            current_section = ".text"
+
+        if len(tokens) == 1 and tokens[0][1] in (".data", ".text"):
+            current_section = tokens[0][1]
             continue
 
         # Show error is we are not in a section
         if current_section is None:
-            raise ValueError(f"Line {line_no}: Directive or instruction appears before section (.text/.data)")
-
-        # Handle label
-        if line.endswith(":"):
-            label = line[:-1]
-            parsed.append({
-                "label": label,
-                "section": current_section
-            })
-            continue
+            raise Parse_Error(line_no, tokens[0][2], "Directive or instruction appears before section (.text/.data)")
 
-        # ─── Label + rest on same line ───
-        if ":" in line:
-            label_part, rest = line.split(":", 1)
-            label = label_part.strip()
-            rest = rest.strip()
-            if not rest:
-                parsed.append({
-                    "label": label,
-                    "section": current_section
-                })
-                continue
-            parts = rest.split()
-
-        # Handling assembler directive
-        if parts[0].startswith("."):
-            directive = parts[0]
-
-            if directive == ".equ":
-                if len(parts) != 4 or parts[2] != "=":
-                    raise ValueError(f"Line {line_no}: Invalid .equ format (expected: .equ NAME = VALUE)")
-                parsed.append({
-                    "directive": ".equ",
-                    "name": parts[1],
-                    "value": parts[3],
-                    "section": current_section
-                })
-
-            elif directive in [".org", ".space"]:
-                if len(parts) != 2:
-                    raise ValueError(f"Line {line_no}: {directive} directive expects one argument")
-                try:
-                    val = int(parts[1], 0)
-                    if directive == ".space" and val < 0:
-                        raise ValueError
-                except ValueError:
-                    raise ValueError(f"Line {line_no}: Invalid argument for {directive}")
-                if directive == ".space" and current_section != ".data":
-                    raise ValueError(f"Line {line_no}: .space must appear in .data section")
-
-                parsed.append({
-                    "directive": directive,
-                    "value": parts[1],
-                    "section": current_section
-                })
-
-            elif directive in [".word", ".byte"]:
-                values = []
-                for v in parts[1:]:
-                    v = v.strip().rstrip(',')  # ← fixes the comma issue
-                    try:
-                        values.append(int(v, 0))
-                    except ValueError:
-                        raise ValueError(f"Line {line_no}: Invalid {directive} value '{v}'")
-                parsed.append({
-                    "label": label,
-                    "directive": directive,
-                    "values": values,
-                    "section": current_section
-                })
-
-
-            else:
-                raise ValueError(f"Line {line_no}: Unknown directive {directive}")
-
-        # assume it is an instruction
-        else:
-            mnemonic = parts[0]
-            operands = " ".join(parts[1:])  # allows for commas, spacing
-            parsed.append({
-                "label": label,
-                "mnemonic": mnemonic,
-                "operands": operands,
-                "section": current_section
-            })
+        yield parse_statement(tokens, current_section, line_no, code)
 
-    return parsed
+# record of a directive that lays out bytes in .data
+def data_line(section, label, directive, line_no, column, name=None, values=None):
+    if section not in (".data", None):
+        raise Parse_Error(line_no, column, f"{directive} must appear in .data section")
+    return Parsed_Line(section, label=label, directive=directive, name=name, values=values, line_no=line_no)
 
+# parses the tokens of one label, directive or instruction line into a Parsed_Line.
+# Macro bodies are parsed once at their definition with section None, their records get a section when expanded.
+# code is the instruction text after the label, instructions are cached under it for the fast path
+def parse_statement(tokens, section, line_no, code=None):
+    label = None
+    head = 0
+
+    # Handle label, alone or with the rest on the same line
+    if len(tokens) >= 2 and tokens[1][1] == ":":
+        if tokens[0][0] != "name":
+            raise Parse_Error(line_no, tokens[0][2], f"Invalid label '{tokens[0][1]}'")
+        label = tokens[0][1]
+        head = 2
+        if len(tokens) == 2:
+            return Parsed_Line(section, label=label, line_no=line_no)
+
+    kind, word, column = tokens[head]
+    args = tokens[head + 1:]
+    if kind != "name":
+        raise Parse_Error(line_no, column, f"Expected an instruction or directive, found '{word}'")
+
+    # Handling assembler directive
+    if word.startswith("."):
+        directive = word
+
+        if directive == ".equ":
+            if len(args) != 3 or args[0][0] != "name" or args[1][1] != "=" or args[2][0] != "number":
+                raise Parse_Error(line_no, column, "Invalid .equ format (expected: .equ NAME = VALUE)")
+            return Parsed_Line(section, directive=".equ", name=args[0][1], value=parse_number(args[2], line_no),
+                               line_no=line_no)
+
+        elif directive in [".org", ".space"]:
+            if len(args) != 1 or args[0][0] != "number":
+                raise Parse_Error(line_no, column, f"{directive} directive expects one numeric argument")
+            val = parse_number(args[0], line_no)
+            if directive == ".space" and val < 0:
+                raise Parse_Error(line_no, args[0][2], f"Invalid argument for {directive}")
+            if directive == ".space" and section not in (".data", None):
+                raise Parse_Error(line_no, column, ".space must appear in .data section")
+
+            return Parsed_Line(section, label=label, directive=directive, value=val, line_no=line_no)
+
+        elif directive in [".word", ".byte"]:
+            # values may be separated by commas, spaces or both
+            values = []
+            for token in args:
+                if token[1] == ",":
+                    continue
+                if token[0] != "number":
+                    raise Parse_Error(line_no, token[2], f"Invalid {directive} value '{token[1]}'")
+                values.append(parse_number(token, line_no))
+            return Parsed_Line(section, label=label, directive=directive, values=values, line_no=line_no)
+
+        elif directive in [".ascii", ".asciiz"]:
+            # strings separated by commas, .asciiz ends every one with a zero byte
+            strings = [token for token in args if token[1] != ","]
+            if not strings or any(token[0] != "string" for token in strings):
+                raise Parse_Error(line_no, column, f'{directive} expects strings (expected: {directive} "text")')
+            end = b"\0" if directive == ".asciiz" else b""
+            data = b"".join(parse_string(token, line_no) + end for token in strings)
+            return data_line(section, label, directive, line_no, column, values=data)
+
+        elif directive == ".fill":
+            numbers = [token for token in args if token[1] != ","]
+            if len(numbers) != 3 or any(token[0] != "number" for token in numbers):
+                raise Parse_Error(line_no, column, "Invalid .fill format (expected: .fill count, size, value)")
+            count, size, value = (parse_number(token, line_no) for token in numbers)
+            if count < 0:
+                raise Parse_Error(line_no, numbers[0][2], "Invalid .fill count")
+            if size not in (1, 2, 4):
+                raise Parse_Error(line_no, numbers[1][2], ".fill size must be 1, 2 or 4 bytes")
+            return data_line(section, label, directive, line_no, column, values=(count, size, value))
+
+        elif directive == ".incbin":
+            # the file is mapped by the include stage, which knows where to look (see load_binary in
+            # src/Include_Handler.py). Until then values holds (offset, length), length None means to the end
+            if not args or args[0][0] != "string" or len(args) not in (1, 3, 5) or \
+                    any(token[1] != "," for token in args[1::2]) or any(token[0] != "number" for token in args[2::2]):
+                raise Parse_Error(line_no, column, 'Invalid .incbin format (expected: .incbin "file"[, offset[, length]])')
+            name = parse_string(args[0], line_no).decode("utf-8", "surrogateescape")
+            offset, length = ([parse_number(token, line_no) for token in args[2::2]] + [0, None])[:2]
+            if offset < 0 or (length is not None and length < 0):
+                raise Parse_Error(line_no, args[2][2], "Invalid .incbin offset or length")
+            return data_line(section, label, directive, line_no, column, name=name, values=(offset, length))
+
+        elif directive == ".globl":
+            # labels other object files can use (see -c), a whole program ignores it
+            names = [token for token in args if token[1] != ","]
+            if not names or any(token[0] != "name" for token in names):
+                raise Parse_Error(line_no, column, ".globl expects label names")
+            return Parsed_Line(section, label=label, directive=directive, values=[token[1] for token in names], line_no=line_no)
+
+        else:
+            raise Parse_Error(line_no, column, f"Unknown directive {directive}")
 
+    # assume it is an instruction
+    else:
+        operands = parse_operands(args, line_no, column)
+        if code is not None:
+            if len(instruction_cache) >= INSTRUCTION_CACHE_SIZE:
+                instruction_cache.clear()
+            instruction_cache[code] = (word, operands)
+        return Parsed_Line(section, label=label, mnemonic=word, operands=operands, line_no=line_no)
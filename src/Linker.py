@@ -0,0 +1,132 @@
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from src.Assembler import Assembly_Result
+from src.Memory_Image import Memory_Image, DEFAULT_MEMORY_SIZE
+from src.Object_Handler import JUMP, BRANCH, ADDRESS, IMPORT
+
+# Linker for the object files of -c (see src/Object_Handler.py), turns them into the rom/ram images of one program:
+#   - the modules are laid out in the order given, the text of each one right after the text of the one before,
+#     and the same for the data. The first module's text starts at 0, so that is where the program starts
+#   - every .globl label gets its final address. A label exported by two modules is an error, and so is an import
+#     no module exports (all of them reported in one message)
+#   - the relocations are applied per text segment in bulk. With NumPy the segment is viewed as an array of words
+#     and every field is rewritten by a handful of array operations, without NumPy they are rewritten one at a time
+# The result is an Assembly_Result like assemble() gives back, its symbols are the .globl labels
+
+def align(size):
+    return (size + 3) & ~3
+
+def link(modules, rom_size=DEFAULT_MEMORY_SIZE, ram_size=DEFAULT_MEMORY_SIZE):
+    text_bases, data_bases = [], []
+    text_end = data_end = 0
+    for module in modules:
+        text_bases.append(text_end)
+        data_bases.append(data_end)
+        text_end += align(module.text_size)
+        data_end += align(module.data_size)
+
+    symbols = {}    # .globl label -> final byte address
+    sections = {}
+    owners = {}
+    for module, text_base, data_base in zip(modules, text_bases, data_bases):
+        for symbol in module.exports:
+            if symbol.name in owners:
+                raise ValueError(f"Duplicate global symbol {symbol.name}: exported by {owners[symbol.name]} and {module.name}")
+            owners[symbol.name] = module.name
+            symbols[symbol.name] = (text_base if symbol.section == ".text" else data_base) + symbol.value
+            sections[symbol.name] = symbol.section
+
+    # final address of every symbol of every module, by index like the relocations refer to them
+    targets = []
+    missing = {}
+    for module, text_base, data_base in zip(modules, text_bases, data_bases):
+        addresses = []
+        for symbol in module.symbols:
+            if symbol.binding == IMPORT:
+                if symbol.name not in symbols:
+                    missing.setdefault(symbol.name, module.name)
+                addresses.append(symbols.get(symbol.name, 0))
+            else:
+                addresses.append((text_base if symbol.section == ".text" else data_base) + symbol.value)
+        targets.append(addresses)
+    if missing:
+        names = ", ".join(f"{name} ({module_name})" for name, module_name in missing.items())
+        raise ValueError(f"Undefined symbol{'s' if len(missing) > 1 else ''}: {names}")
+
+    rom = Memory_Image("ROM", rom_size)
+    ram = Memory_Image("RAM", ram_size)
+    for module, text_base, data_base, addresses in zip(modules, text_bases, data_bases, targets):
+        offsets = module.relocation_offsets
+        relocate = relocate_batch if np is not None else relocate_scalar
+        for start, data in module.text_segments:
+            segment = bytearray(data)
+            first = bisect_left(offsets, start)
+            last = bisect_left(offsets, start + len(segment))
+            if last > first:
+                relocate(segment, start, text_base, module, addresses, first, last)
+            rom.write(text_base + start, segment)
+        rom.reserve(text_base, module.text_size)
+        for start, data in module.data_segments:
+            ram.write(data_base + start, data)
+        ram.reserve(data_base, module.data_size)
+
+    return Assembly_Result(rom, ram, symbols, {}, [], sections)
+
+# the new field of a relocated word and the bits of the word that stay, target and address are final byte addresses
+def relocated_field(kind, target, address):
+    if kind == JUMP:
+        return (target >> 2) & 0x03FFFFFF, 0xFC000000
+    if kind == BRANCH:
+        return ((target - (address + 4)) >> 2) & 0xFFFF, 0xFFFF0000
+    return target & 0xFFFF, 0xFFFF0000
+
+def relocation_error(module, index, target, address):
+    kind = module.relocation_kinds[index]
+    name = module.symbols[module.relocation_symbols[index]].name
+    if kind == BRANCH:
+        offset = (target - (address + 4)) >> 2
+        if not -0x8000 <= offset <= 0x7FFF:
+            return ValueError(f"{module.name}: branch at {address:#x} to {name} ({target:#x}) is out of range ({offset} words)")
+    elif kind == ADDRESS and target > 0xFFFF:
+        return ValueError(f"{module.name}: address {target:#x} of {name} does not fit in 16 bits (la at {address:#x})")
+    return None
+
+# relocations first..last-1 of module, all inside segment (which starts at offset start of the module's text)
+def relocate_scalar(segment, start, base, module, addresses, first, last):
+    offsets, symbol_indexes, kinds = module.relocation_offsets, module.relocation_symbols, module.relocation_kinds
+    for index in range(first, last):
+        offset = offsets[index]
+        target = addresses[symbol_indexes[index]]
+        error = relocation_error(module, index, target, base + offset)
+        if error is not None:
+            raise error
+        field, keep = relocated_field(kinds[index], target, base + offset)
+        position = offset - start
+        word = int.from_bytes(segment[position:position + 4], "big")
+        segment[position:position + 4] = ((word & keep) | field).to_bytes(4, "big")
+
+def relocate_batch(segment, start, base, module, addresses, first, last):
+    offsets = np.frombuffer(module.relocation_offsets[first:last], np.uint32).astype(np.int64)
+    kinds = np.frombuffer(module.relocation_kinds[first:last], np.uint8)
+    targets = np.asarray(addresses, np.int64)[np.frombuffer(module.relocation_symbols[first:last], np.uint32)]
+    positions = base + offsets
+
+    branch_offsets = (targets - (positions + 4)) >> 2
+    bad = (((kinds == BRANCH) & ((branch_offsets < -0x8000) | (branch_offsets > 0x7FFF)))
+           | ((kinds == ADDRESS) & (targets > 0xFFFF)))
+    if bad.any():
+        index = first + int(np.flatnonzero(bad)[0])
+        raise relocation_error(module, index, addresses[module.relocation_symbols[index]], base + module.relocation_offsets[index])
+
+    jumps = kinds == JUMP
+    fields = np.where(jumps, (targets >> 2) & 0x03FFFFFF, np.where(kinds == BRANCH, branch_offsets & 0xFFFF, targets & 0xFFFF))
+    keep = np.where(jumps, 0xFC000000, 0xFFFF0000)
+    # a view of the segment, the words are rewritten in place
+    words = np.frombuffer(segment, ">u4")
+    index = (offsets - start) >> 2
+    words[index] = (words[index] & keep) | fields
@@ -1,51 +1,329 @@
 # assembler/macro_handler.py
+import os
+from itertools import count
+
+from src.Encoder import register_map
+from src.Line_Parser import Parsed_Line, Operand, Parse_Error, Expansion, tokenize, parse_statement, instruction_cache
+from src.Include_Handler import Include_Directive, INCBIN_PATTERN, parse_include, resolve_include, get_module, load_binary
+
+# Macros are written as
+#     .macro NAME arg1, arg2
+#         addu arg1, arg1, arg2
+#     loop: bne arg1, r0, loop
+#     .end_macro
+# and called like an instruction, NAME r3, r4. The body is tokenized and parsed once when it is defined, every call
+# then emits fresh Parsed_Line records straight from those templates, with the arguments substituted as typed
+# operands. Labels defined inside the body get a unique name per expansion (loop -> loop$1), so a macro with a loop
+# can be used more than once. Bodies can call other macros, recursion is reported as an error.
+# .include "file.asm" is handled here as well, see src/Include_Handler.py, and so is mapping the files of .incbin
+
+# expansions of macros without local labels or nested calls always give the same records for the same arguments,
+# so they are kept per macro and only rebuilt when new arguments show up
+EXPANSION_CACHE_SIZE = 4096
+
+class Macro:
+    __slots__ = ("name", "params", "body", "local_labels", "substitute", "expansions", "calls", "line_no")
+
+    def __init__(self, name, params, line_no):
+        self.name = name
+        self.params = params
+        self.body = []              # Parsed_Line templates, section None
+        self.local_labels = ()
+        self.substitute = []        # per template, True if its operands use a parameter or local label
+        self.expansions = None      # args -> expanded fields, None if the macro can't be cached
+        self.calls = frozenset()    # every mnemonic in the body, the ones that are macros are nested calls
+        self.line_no = line_no
+
+    # called at .end_macro, once the whole body and all of its labels are known
+    def finish(self):
+        self.local_labels = tuple(t.label for t in self.body if t.label is not None)
+        names = set(self.params) | set(self.local_labels)
+        self.substitute = [any(uses_name(operand, names) for operand in t.operands or ()) for t in self.body]
+        self.calls = frozenset(t.mnemonic for t in self.body if t.mnemonic is not None)
+        if not self.local_labels:
+            self.expansions = {}
+
+# collects .macro ... .end_macro blocks line by line, shared by the main source and included files
+class Macro_Reader:
+    def __init__(self):
+        self.current = None
+
+    # returns None for lines outside a definition, True for lines it consumed, and the finished Macro at .end_macro
+    def feed(self, first, line, line_no):
+        # Begin macro
+        if first == ".macro":
+            if self.current is not None:
+                raise Parse_Error(line_no, 1, f"Macro definition inside macro {self.current.name}")
+            self.current = define_macro(tokenize(line, line_no), line_no)
+            return True
+
+        # End macro
+        if first == ".end_macro":
+            if self.current is None:
+                raise ValueError("Unexpected .end_macro")
+            macro = self.current
+            macro.finish()
+            self.current = None
+            return macro
+
+        if self.current is None:
+            return None
+
+        # Inside macro: parse the body line once, now
+        if first == ".include":
+            raise Parse_Error(line_no, 1, ".include is not allowed inside a macro")
+        tokens = tokenize(line, line_no)
+        if tokens:
+            template = parse_statement(tokens, None, line_no)
+            if template.directive == ".incbin":
+                raise Parse_Error(line_no, 1, ".incbin is not allowed inside a macro")
+            self.current.body.append(template)
+        return True
+
+    def close(self):
+        if self.current is not None:
+            raise Parse_Error(self.current.line_no, 1, f"Macro {self.current.name} is missing .end_macro")
+
+# the macros of one assembly, name -> Macro.
+# A macro that calls another macro expands differently depending on what is defined, so it is only cached while none
+# of its body lines name a macro. Macros from included files are shared between assemblies, once a macro has been
+# used with a nested call it stays uncached
+class Macro_Table(dict):
+    def __init__(self):
+        super().__init__()
+        self.callers = {}   # name -> macros whose body uses that name
+
+    def add(self, macro):
+        if macro.expansions is not None and not macro.calls.isdisjoint(self):
+            macro.expansions = None
+        # bodies defined earlier that call this macro now contain a nested call and can't be cached
+        for caller in self.callers.get(macro.name, ()):
+            caller.expansions = None
+        for name in macro.calls:
+            self.callers.setdefault(name, []).append(macro)
+        self[macro.name] = macro
+
 #First part of our assembler
-def expand_macros(lines):
+def expand_macros(lines, base_dir=".", include_dirs=(), cache_dir=None):
+    return list(iter_expand_macros(lines, base_dir, include_dirs, cache_dir))
+
+# generator version, lines are pulled one at a time so only the macro definitions stay in memory.
+# Regular lines are passed on as text, expanded macros and included statements as Parsed_Line records that already
+# know where they came from. Where lines were left out (comments, macro definitions, calls, includes) the line number
+# of the next text line is passed on as an int, so the parser numbers the text lines right.
+# Includes are looked up next to the including file (base_dir for the source itself), then in include_dirs
+def iter_expand_macros(lines, base_dir=".", include_dirs=(), cache_dir=None):
 
-    macros = {}  # macro_name -> list of body lines
-    expanded = []  # final output
-    inside_macro = False
-    current_macro_name = ""
-    current_macro_body = []
+    macros = Macro_Table()
+    reader = Macro_Reader()
+    expansion_ids = count(1)
+    included = set()      # include guard, every file is included once
+    include_stack = []    # files being included right now, for cycle detection
+    next_line = 1         # the number the parser gives the next text line
 
-    for line in lines:
+    # replays an included file. position is where the .include is, in the file at parent (None for the source itself)
+    def include(name, from_dir, position, parent=None):
+        path = resolve_include(name, from_dir, include_dirs)
+        if path is None:
+            raise Parse_Error(*position, f"Included file not found: {name}", parent)
+        if path in include_stack:
+            chain = include_stack[include_stack.index(path):] + [path]
+            raise Parse_Error(*position, "Include cycle: " + " -> ".join(os.path.basename(p) for p in chain), parent)
+        if path in included:
+            return
+        included.add(path)
+        include_stack.append(path)
+
+        module = get_module(path, preparse_module, cache_dir)
+        for item in module.items:
+            if isinstance(item, str):
+                yield item
+            elif isinstance(item, Macro):
+                macros.add(item)
+            elif isinstance(item, Include_Directive):
+                yield from include(item.name, os.path.dirname(path), (item.line_no, 1), path)
+            elif item.directive == ".incbin":
+                # next to the included file, errors are reported at its .include
+                yield load_binary(item, os.path.dirname(path), include_dirs, position, parent, path)
+            elif item.mnemonic in macros:
+                yield from expand_macro(macros, item.label, item.mnemonic, item.operands, (), expansion_ids, position,
+                                        (path, item.line_no))
+            else:
+                # the templates are shared, every include gets its own records
+                yield Parsed_Line(None, item.label, item.mnemonic, item.operands, item.directive, item.name, item.value,
+                                  item.values, None, item.line_no, path)
+
+        include_stack.pop()
+
+    for line_no, line in enumerate(lines, 1):
         stripped = line.strip()
 
         # Skip blank lines and comments
         if not stripped or stripped.startswith("#"):
             continue
 
-        # Begin macro
-        if stripped.startswith(".macro"):
-            parts = stripped.split()
-            if len(parts) < 2:
-                raise ValueError(f"Invalid macro definition: {line}")
-            inside_macro = True
-            current_macro_name = parts[1]
-            current_macro_body = []
+        first = stripped.split(None, 1)[0]
+
+        # .macro, .end_macro and the lines in between
+        defined = reader.feed(first, line, line_no)
+        if defined:
+            if defined is not True:
+                macros.add(defined)
             continue
 
-        # End macro
-        elif stripped.startswith(".end_macro"):
-            if not inside_macro:
-                raise ValueError("Unexpected .end_macro")
-            macros[current_macro_name] = current_macro_body.copy()
-            inside_macro = False
-            current_macro_name = ""
+        if first == ".include":
+            yield from include(parse_include(stripped, line_no), base_dir, (line_no, 1))
+            # the section lines of the included files went through as text
+            next_line = 0
             continue
 
-        # Inside macro: save body lines
-        elif inside_macro:
-            current_macro_body.append(stripped)
+        if ".incbin" in stripped and INCBIN_PATTERN.match(stripped):
+            yield load_binary(parse_statement(tokenize(line, line_no), None, line_no), base_dir, include_dirs, (line_no, 1))
             continue
 
-        # Outside macro: check for macro call
-        elif stripped in macros:
-            expanded.extend(macros[stripped])
+        # Outside macro: check for macro call, with or without a label in front
+        elif macros:
+            label, code = split_label(stripped)
+            if code.split(None, 1)[0] in macros if code else False:
+                # call lines repeat like instructions do, so they share the parser's instruction cache
+                cached = instruction_cache.get(code)
+                if cached is None:
+                    call = parse_statement(tokenize(line, line_no), None, line_no, code)
+                    cached = (call.mnemonic, call.operands)
+                column = len(line) - len(line.lstrip()) + 1
+                yield from expand_macro(macros, label, *cached, (), expansion_ids, (line_no, column))
+                continue
+
+        # Regular instruction, passed on unstripped so the parser reports the right columns
+        if line_no != next_line:
+            yield line_no
+        yield line
+        next_line = line_no + 1
+
+    reader.close()
+
+# parses an included file into the items of its Module: section lines as text, statements as templates,
+# macro definitions and nested includes. Macro calls stay templates, they are expanded when the module is replayed
+def preparse_module(lines, path):
+    items = []
+    reader = Macro_Reader()
+    try:
+        for line_no, line in enumerate(lines, 1):
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            first = stripped.split(None, 1)[0]
+
+            defined = reader.feed(first, line, line_no)
+            if defined:
+                if defined is not True:
+                    items.append(defined)
+            elif first == ".include":
+                items.append(Include_Directive(parse_include(stripped, line_no), line_no))
+            else:
+                tokens = tokenize(line, line_no)
+                if len(tokens) == 1 and tokens[0][1] in (".data", ".text"):
+                    items.append(tokens[0][1] + "\n")
+                else:
+                    items.append(parse_statement(tokens, None, line_no))
+        reader.close()
+    except Parse_Error as e:
+        # name the included file, the line numbers are its own
+        raise Parse_Error(e.line_no, e.column, e.reason, path) from None
+    return items
+
+# .macro NAME arg1, arg2 (the commas are optional)
+def define_macro(tokens, line_no):
+    if len(tokens) < 2 or tokens[1][0] != "name":
+        raise Parse_Error(line_no, tokens[0][2], "Invalid macro definition (expected: .macro NAME arg1, arg2, ...)")
+    name = tokens[1][1]
+    params = []
+    for kind, text, column in tokens[2:]:
+        if text == ",":
             continue
+        if kind != "name" or text.startswith("."):
+            raise Parse_Error(line_no, column, f"Invalid macro parameter '{text}'")
+        if text in register_map:
+            raise Parse_Error(line_no, column, f"Macro parameter '{text}' is a register name")
+        if text in params:
+            raise Parse_Error(line_no, column, f"Duplicate macro parameter '{text}'")
+        params.append(text)
+    return Macro(name, tuple(params), line_no)
+
+# (label, code) of a stripped line, the comment removed
+def split_label(stripped):
+    code = stripped.partition("#")[0]
+    if ":" not in code:
+        return None, code.strip()
+    label, _, code = code.partition(":")
+    return label.strip(), code.strip()
+
+# returns the records of one macro call as a list.
+# position is the (line, column) of the outermost call, errors are reported there. call_site is its (path, line) for
+# the records, path None for the source itself, which is the default
+def expand_macro(macros, label, name, arguments, stack, expansion_ids, position, call_site=None):
+    macro = macros[name]
+    if name in stack:
+        raise Parse_Error(*position, "Recursive macro call: " + " -> ".join(stack + (name,)))
+    if len(arguments) != len(macro.params):
+        raise Parse_Error(*position, f"Macro {name} expects {len(macro.params)} arguments, got {len(arguments)}")
+
+    caller, call_line = call_site or (None, position[0])
+    expansion = Expansion(name, caller, call_line)
+    # a label in front of the call marks the first expanded line
+    records = [] if label is None else [Parsed_Line(None, label=label, line_no=call_line, origin=caller)]
 
-        # Regular instruction
+    # read once, another assembly sharing this macro may switch its cache off meanwhile
+    expansions = macro.expansions
+    if expansions is not None:
+        fields = expansions.get(arguments)
+        if fields is None:
+            if len(expansions) >= EXPANSION_CACHE_SIZE:
+                expansions.clear()
+            bindings = dict(zip(macro.params, arguments))
+            fields = expansions[arguments] = [template_fields(t, bindings, flag)
+                                              for t, flag in zip(macro.body, macro.substitute)]
+        records.extend([Parsed_Line(None, *f, expansion) for f in fields])
+        return records
+
+    bindings = dict(zip(macro.params, arguments))
+    if macro.local_labels:
+        expansion_id = next(expansion_ids)
+        for local in macro.local_labels:
+            bindings[local] = Operand("sym", f"{local}${expansion_id}")
+
+    stack = stack + (name,)
+    for template, flag in zip(macro.body, macro.substitute):
+        fields = template_fields(template, bindings, flag)
+        if fields[1] in macros:
+            records.extend(expand_macro(macros, fields[0], fields[1], fields[2], stack, expansion_ids, position,
+                                        (caller, call_line)))
         else:
-            expanded.append(stripped)
+            records.append(Parsed_Line(None, *fields, expansion))
+    return records
+
+# the fields of one template with its label renamed and the arguments put into its operands, up to its line_no
+def template_fields(template, bindings, flag):
+    label = template.label
+    if label is not None and label in bindings:
+        label = bindings[label].value
+    operands = template.operands
+    if flag:
+        operands = tuple(substitute(operand, bindings) for operand in operands)
+    return (label, template.mnemonic, operands, template.directive, template.name, template.value, template.values, None,
+            template.line_no)
+
+# parameters and local labels are parsed as symbols, including the offset and base of offset(base)
+def substitute(operand, bindings):
+    if operand.kind == "sym":
+        return bindings.get(operand.value, operand)
+    if operand.kind == "mem":
+        return Operand("mem", substitute(operand.value, bindings), substitute(operand.base, bindings))
+    return operand
 
-    return expanded
+def uses_name(operand, names):
+    if operand.kind == "sym":
+        return operand.value in names
+    if operand.kind == "mem":
+        return uses_name(operand.value, names) or uses_name(operand.base, names)
+    return False
@@ -0,0 +1,94 @@
+from bisect import bisect_right
+
+# both memory units default to 1kb, 1024 bytes = 256 words
+DEFAULT_MEMORY_SIZE = 1024
+
+# Sparse memory image used for the ROM and RAM. Written bytes are kept in contiguous bytearray segments,
+# gaps left by .org/.space are never allocated and only become zeros when the image is flattened.
+# Writes are checked against the memory size and against each other so overlapping code/data is reported
+class Memory_Image:
+    def __init__(self, name, size=None):
+        self.name = name
+        self.size = size     # bytes, None means unlimited
+        self.starts = []     # start address of every segment, sorted
+        self.segments = []   # bytearray per segment, same order as starts
+        self.end = 0         # one past the highest written or reserved address
+
+    # image holding flat bytes, e.g. ones loaded back from the cache
+    @classmethod
+    def from_bytes(cls, name, data, size=None):
+        image = cls(name, size)
+        image.write(0, data)
+        return image
+
+    def __len__(self):
+        return self.end
+
+    def check_range(self, address, length):
+        if address < 0:
+            raise ValueError(f"{self.name} address {hex(address)} is negative")
+        if self.size is not None and address + length > self.size:
+            raise ValueError(f"{self.name} overflow: {hex(address)}-{hex(address + length - 1)} does not fit in {self.size} bytes")
+
+    # copies data into the image at address
+    def write(self, address, data):
+        length = len(data)
+        if length == 0:
+            return
+        self.check_range(address, length)
+
+        # index of the last segment starting at or before address
+        index = bisect_right(self.starts, address) - 1
+        if index >= 0:
+            start = self.starts[index]
+            segment = self.segments[index]
+            if address < start + len(segment):
+                raise ValueError(f"{self.name} overlap: {hex(address)} was already written")
+        if index + 1 < len(self.starts) and address + length > self.starts[index + 1]:
+            raise ValueError(f"{self.name} overlap: {hex(self.starts[index + 1])} was already written")
+
+        # sequential writes (the common case) extend the previous segment
+        if index >= 0 and start + len(segment) == address:
+            segment += data
+        else:
+            index += 1
+            self.starts.insert(index, address)
+            self.segments.insert(index, bytearray(data))
+
+        # join with the next segment if the gap is now closed
+        if index + 1 < len(self.starts) and self.starts[index] + len(self.segments[index]) == self.starts[index + 1]:
+            self.segments[index] += self.segments.pop(index + 1)
+            del self.starts[index + 1]
+
+        self.end = max(self.end, address + length)
+
+    # 32 bit big-endian word
+    def write_word(self, address, word):
+        self.write(address, (word & 0xFFFFFFFF).to_bytes(4, "big"))
+
+    # overwrites bytes that were already written, used to fill in words whose operands weren't known yet
+    def patch(self, address, data):
+        index = bisect_right(self.starts, address) - 1
+        if index < 0 or address + len(data) > self.starts[index] + len(self.segments[index]):
+            raise ValueError(f"{self.name} patch at {hex(address)} is outside the written memory")
+        offset = address - self.starts[index]
+        self.segments[index][offset:offset + len(data)] = data
+
+    # claims zero filled space (.space, trailing .org padding) without allocating it
+    def reserve(self, address, length):
+        if length <= 0:
+            return
+        self.check_range(address, length)
+        self.end = max(self.end, address + length)
+
+    # (start address, bytes) for every written segment, in address order
+    def iter_segments(self):
+        for start, segment in zip(self.starts, self.segments):
+            yield start, memoryview(segment)
+
+    # flattens the image into bytes from address 0 to the end, gaps become zeros
+    def to_bytes(self):
+        image = bytearray(self.end)
+        for start, segment in zip(self.starts, self.segments):
+            image[start:start + len(segment)] = segment
+        return bytes(image)
@@ -0,0 +1,223 @@
+import struct
+from array import array
+
+from src.Encoder import instruction_map
+from src.Label_Handler import Label_Table
+from src.Line_Parser import Parsed_Line, Operand
+from src.Utilities import pack_column, unpack_column
+
+# Relocatable object files (-c) for the linker in src/Linker.py. A module is assembled like a whole program with its
+# text and data both starting at 0, except that:
+#   - a label it uses but doesn't define is an import, resolved by the linker against the .globl labels of the others
+#   - every instruction whose word depends on where a label ends up gets a relocation record, the linker rewrites
+#     that field once the modules are laid out:
+#       jump      j/jal to a label, the 26 bit word address
+#       branch    beq/bne/bgez... to an imported label, the 16 bit offset (branches inside the module keep theirs)
+#       memory    lw/sw with a label offset, the 16 bit byte address
+#       address   la of a label (the short form, ori), the 16 bit byte address
+#   - la is never relaxed, its label's address is only known once linked and the linker checks it fits 16 bits
+# .equ constants stay local to the module and are resolved while assembling, only labels can be .globl.
+#
+# File layout, big-endian:
+#   magic "MIPSOBJ" + version byte
+#   header     text size, data size, text segments, data segments, symbols, relocations, string bytes (7 x u32)
+#   segments   start u32, length u32, bytes. The text segments then the data segments, the gaps .org/.space left
+#              are not stored
+#   symbols    name offset u32, value u32, binding u8, section u8
+#   strings    the symbol names, utf-8, each ended by a zero byte
+#   relocations   offsets (u32 each), then symbol indexes (u32 each), then kinds (u8 each). Column by column so
+#                 the linker can read every column as one array
+
+MAGIC = b"MIPSOBJ\x01"
+HEADER = struct.Struct(">7I")
+SEGMENT = struct.Struct(">2I")
+SYMBOL = struct.Struct(">2I2B")
+
+# relocation kinds
+JUMP, BRANCH, MEMORY, ADDRESS = range(4)
+relocation_names = ("jump", "branch", "memory", "address")
+
+# symbol bindings, an import has no section or value
+LOCAL, GLOBAL, IMPORT = range(3)
+sections = (".text", ".data")
+NO_SECTION = 0xFF
+
+class Object_Symbol:
+    __slots__ = ("name", "binding", "section", "value")
+
+    def __init__(self, name, binding, section=None, value=0):
+        self.name = name
+        self.binding = binding
+        self.section = section   # .text/.data, None for an import
+        self.value = value       # byte offset from the start of the section
+
+class Object_Module:
+    def __init__(self, name, text_segments, text_size, data_segments, data_size, symbols, relocation_offsets=(),
+                 relocation_symbols=(), relocation_kinds=()):
+        self.name = name                     # shows up in the linker errors, the path of the .o file
+        self.text_segments = text_segments   # [(start, bytes)] in address order
+        self.text_size = text_size           # bytes, includes the gaps left by .org
+        self.data_segments = data_segments
+        self.data_size = data_size           # bytes, includes .space
+        self.symbols = symbols               # Object_Symbol list, relocations refer to them by index
+        # one entry per relocation, sorted by offset: the byte offset of the word in the text, the symbol index, the kind
+        self.relocation_offsets = array("I", relocation_offsets)
+        self.relocation_symbols = array("I", relocation_symbols)
+        self.relocation_kinds = array("B", relocation_kinds)
+
+    @property
+    def exports(self):
+        return [symbol for symbol in self.symbols if symbol.binding == GLOBAL]
+
+    @property
+    def imports(self):
+        return [symbol for symbol in self.symbols if symbol.binding == IMPORT]
+
+    def to_bytes(self):
+        names = bytearray()
+        symbol_records = []
+        for symbol in self.symbols:
+            symbol_records.append(SYMBOL.pack(len(names), symbol.value, symbol.binding,
+                                              NO_SECTION if symbol.section is None else sections.index(symbol.section)))
+            names += symbol.name.encode() + b"\0"
+
+        parts = [MAGIC, HEADER.pack(self.text_size, self.data_size, len(self.text_segments), len(self.data_segments),
+                                    len(self.symbols), len(self.relocation_offsets), len(names))]
+        for start, data in self.text_segments + self.data_segments:
+            parts.append(SEGMENT.pack(start, len(data)))
+            parts.append(data)
+        parts.extend(symbol_records)
+        parts.append(names)
+        parts.append(pack_column(self.relocation_offsets))
+        parts.append(pack_column(self.relocation_symbols))
+        parts.append(self.relocation_kinds.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, name="<object>"):
+        data = memoryview(data)
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{name} is not an object file of this assembler (see -c)")
+        try:
+            position = len(MAGIC)
+            text_size, data_size, text_count, data_count, symbol_count, relocation_count, string_size = HEADER.unpack_from(data, position)
+            position += HEADER.size
+
+            segments = []
+            for _ in range(text_count + data_count):
+                start, length = SEGMENT.unpack_from(data, position)
+                position += SEGMENT.size
+                segments.append((start, bytes(data[position:position + length])))
+                position += length
+
+            records = list(SYMBOL.iter_unpack(data[position:position + SYMBOL.size * symbol_count]))
+            position += SYMBOL.size * symbol_count
+            strings = bytes(data[position:position + string_size])
+            position += string_size
+            symbols = []
+            for offset, value, binding, section in records:
+                symbol_name = strings[offset:strings.index(b"\0", offset)].decode()
+                symbols.append(Object_Symbol(symbol_name, binding, None if section == NO_SECTION else sections[section], value))
+
+            columns = []
+            for _ in range(2):
+                columns.append(unpack_column(data[position:position + 4 * relocation_count]))
+                position += 4 * relocation_count
+            kinds = array("B", data[position:position + relocation_count])
+            position += relocation_count
+        except (struct.error, ValueError, IndexError, UnicodeDecodeError):
+            raise ValueError(f"{name} is a truncated or damaged object file") from None
+        if position != len(data) or len(kinds) != relocation_count:
+            raise ValueError(f"{name} is a truncated or damaged object file")
+        return cls(name, segments[:text_count], text_size, segments[text_count:], data_size, symbols,
+                   columns[0], columns[1], kinds)
+
+# the instruction field a label operand of a text line ends up in, as (relocation kind, label name), or None
+def label_reference(line, labels, constants):
+    instr_type = instruction_map.get(line.mnemonic, {}).get("type")
+    operands = line.operands
+    if not operands:
+        return None
+    if instr_type == "Jump" or instr_type == "Branch":
+        operand = operands[-1]
+        kind = JUMP if instr_type == "Jump" else BRANCH
+    elif instr_type == "Memory":
+        if len(operands) != 2 or operands[1].kind != "mem":
+            return None
+        operand = operands[1].value
+        kind = MEMORY
+    else:
+        operand = operands[-1]
+        if operand.kind == "addr":
+            return ADDRESS, operand.value
+        return None
+    # labels win over constants, like in the encoder
+    if operand.kind != "sym" or (operand.value not in labels and operand.value in constants):
+        return None
+    return kind, operand.value
+
+# The object module of laid out lines (after process_labels and relax_text with relocatable=True), returns
+# (Object_Module, text lines to encode, encode label table). The encode table maps every import to 0 and the branches
+# to imports branch to the next instruction, the relocations fill in the real fields
+def build_object(name, lines, label_table, constants):
+    labels = label_table.table
+    constants = getattr(constants, "table", constants)
+
+    exported = {}
+    for line in lines:
+        if line.directive == ".globl":
+            for symbol_name in line.values:
+                exported.setdefault(symbol_name, line)
+    for symbol_name in exported:
+        if symbol_name not in labels:
+            what = "a constant, only labels" if symbol_name in constants else "not a label of this module, only its labels"
+            raise ValueError(f".globl {symbol_name}: {what} can be exported")
+
+    symbols = [Object_Symbol(label, GLOBAL if label in exported else LOCAL, label_table.sections.get(label, ".text"), address)
+               for label, address in labels.items()]
+    indexes = {symbol.name: index for index, symbol in enumerate(symbols)}
+
+    offsets, symbol_indexes, kinds = [], [], []
+    text_lines = []
+    for line in lines:
+        if line.section != ".text":
+            continue
+        reference = label_reference(line, labels, constants) if line.mnemonic is not None else None
+        if reference is not None:
+            kind, label = reference
+            imported = label not in labels
+            if imported and label not in indexes:
+                indexes[label] = len(symbols)
+                symbols.append(Object_Symbol(label, IMPORT))
+            # a branch inside the module is relative and doesn't move
+            if kind != BRANCH or imported:
+                offsets.append(line.address)
+                symbol_indexes.append(indexes[label])
+                kinds.append(kind)
+            if kind == BRANCH and imported:
+                operands = line.operands[:-1] + (Operand("imm", (line.address + 4) >> 2),)
+                line = Parsed_Line(line.section, label=line.label, mnemonic=line.mnemonic, operands=operands, address=line.address,
+                                   line_no=line.line_no, origin=line.origin)
+        text_lines.append(line)
+
+    encode_table = Label_Table()
+    encode_table.table.update(labels)
+    encode_table.sections.update(label_table.sections)
+    for symbol in symbols:
+        if symbol.binding == IMPORT:
+            encode_table.table[symbol.name] = 0
+
+    # .org can put the lines out of address order
+    order = sorted(range(len(offsets)), key=offsets.__getitem__)
+    module = Object_Module(name, [], 0, [], 0, symbols, [offsets[i] for i in order], [symbol_indexes[i] for i in order],
+                           [kinds[i] for i in order])
+    return module, text_lines, encode_table
+
+# reads an object file written by -c
+def read_object(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        raise ValueError(f"Can't read {path}: {e}") from None
+    return Object_Module.from_bytes(data, path)
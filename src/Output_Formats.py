@@ -0,0 +1,175 @@
+import binascii
+import os
+
+from src.Utilities import write_output_data, pack_column
+
+# Output writers for the rom/ram images. Every writer turns a whole Memory_Image into the file contents in bulk
+# with bytes.hex()/binascii, instead of formatting one byte at a time
+
+# one byte per line, the original format
+def format_byte_hex(image):
+    data = image.to_bytes()
+    return data.hex("\n").upper() + "\n" if data else ""
+
+# one 32 bit word per line for Verilog $readmemh
+def format_readmemh(image):
+    words = padded_words(image)
+    return words.hex("\n", -4).upper() + "\n" if words else ""
+
+# raw big-endian binary
+def format_binary(image):
+    return image.to_bytes()
+
+# Intel HEX, only the written segments are emitted so large gaps stay out of the file
+def format_intel_hex(image, record_size=16):
+    records = []
+    upper = 0
+    for start, segment in image.iter_segments():
+        offset = 0
+        while offset < len(segment):
+            address = start + offset
+            # records never cross a 64k boundary
+            length = min(record_size, len(segment) - offset, 0x10000 - (address & 0xFFFF))
+            # extended linear address record whenever the upper 16 bits change
+            if address >> 16 != upper:
+                upper = address >> 16
+                records.append(intel_hex_record(0, 0x04, upper.to_bytes(2, "big")))
+            records.append(intel_hex_record(address & 0xFFFF, 0x00, segment[offset:offset + length]))
+            offset += length
+    records.append(":00000001FF")
+    return "\n".join(records) + "\n"
+
+def intel_hex_record(address, record_type, data):
+    record = bytes([len(data), address >> 8, address & 0xFF, record_type]) + bytes(data)
+    checksum = (-sum(record)) & 0xFF
+    return ":" + binascii.hexlify(record + bytes([checksum])).decode().upper()
+
+# Quartus memory initialization file, 32 bit words
+def format_mif(image):
+    data = padded_words(image) if len(image) else b""
+    count = len(data) // 4
+    depth = max(count, (image.size or 0) // 4, 1)
+    header = f"WIDTH=32;\nDEPTH={depth};\n\nADDRESS_RADIX=HEX;\nDATA_RADIX=HEX;\n\nCONTENT BEGIN\n"
+    body = mif_lines(data)
+    # the rest of the memory is zero
+    if count < depth:
+        if depth - count == 1:
+            body += f"    {count:X} : 00000000;\n"
+        else:
+            body += f"    [{count:X}..{depth - 1:X}] : 00000000;\n"
+    return header + body + "END;\n"
+
+# "    address : word;" for every word of data, built in bulk like the other formats. The lines go in groups whose
+# addresses have the same number of digits (0-F, 10-FF, 100-FFF...). Every line of a group has the same layout, so
+# the group starts as its template line repeated, e.g. "    00 : 00000000;\n" for 2 digits, and the digits are
+# copied in one character column at a time: lines[position::line_size] is that position in every line of the group
+def mif_lines(data):
+    word_digits = data.hex().upper().encode()     # 8 per word
+    count = len(data) // 4
+    body = bytearray()
+    start = 0
+    width = 1
+    while start < count:
+        end = min(count, 16 ** width)
+        # 8 per address, zero padded. A line takes the last width of them
+        address_digits = pack_column(range(start, end)).hex().upper().encode()
+        template = b"    " + b"0" * width + b" : 00000000;\n"
+        line_size = len(template)
+        word_position = line_size - 10     # the 8 word digits and ";\n" end the line
+        lines = bytearray(template * (end - start))
+        for k in range(width):
+            lines[4 + k::line_size] = address_digits[8 - width + k::8]
+        for k in range(8):
+            lines[word_position + k::line_size] = word_digits[8 * start + k:8 * end:8]
+        body += lines
+        start = end
+        width += 1
+    return body.decode()
+
+# Xilinx coefficient file, 32 bit words
+def format_coe(image):
+    words = padded_words(image).hex("\n", -4).upper().split("\n") if len(image) else ["00000000"]
+    return "memory_initialization_radix=16;\nmemory_initialization_vector=\n" + ",\n".join(words) + ";\n"
+
+# the flattened image padded to a whole number of words
+def padded_words(image):
+    data = image.to_bytes()
+    return data + bytes(-len(data) % 4)
+
+# format name -> (file extension, writer)
+output_formats = {
+    "hex": ("hex", format_byte_hex),
+    "readmemh": ("mem", format_readmemh),
+    "ihex": ("ihex", format_intel_hex),
+    "bin": ("bin", format_binary),
+    "mif": ("mif", format_mif),
+    "coe": ("coe", format_coe),
+}
+
+# writes the image as <base_path>.<extension> in the given format
+def write_image(base_path, image, label, output_format="hex"):
+    extension, writer = output_formats[output_format]
+    path = f"{base_path}.{extension}"
+    write_output_data(path, writer(image), label)
+    return path
+
+# Readers for images written by the formats above or dumped from hardware, used by --disassemble.
+# Each one returns the flat bytes from address 0
+
+# hex and readmemh, one byte or one word of hex per line (big-endian). // comments are skipped, @address lines aren't supported
+def read_hex_text(text):
+    # .hex is also a common extension for Intel HEX
+    if text.lstrip().startswith(":"):
+        return read_intel_hex(text)
+    if "//" in text:
+        text = "\n".join(line.partition("//")[0] for line in text.splitlines())
+    if "@" in text:
+        raise ValueError("@address lines are not supported, the image has to start at address 0")
+    try:
+        return bytes.fromhex("".join(text.split()))
+    except ValueError:
+        raise ValueError("Image is not valid hex") from None
+
+# Intel HEX data records, placed at their address with extended linear address records honored
+def read_intel_hex(text):
+    image = bytearray()
+    upper = 0
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = bytes.fromhex(line[1:]) if line.startswith(":") else None
+        except ValueError:
+            record = None
+        if record is None or len(record) < 5 or len(record) != record[0] + 5 or sum(record) & 0xFF:
+            raise ValueError(f"Invalid Intel HEX record on line {line_no}")
+        record_type = record[3]
+        data = record[4:-1]
+        if record_type == 0x00:
+            address = upper + (record[1] << 8 | record[2])
+            if len(image) < address + len(data):
+                image += bytes(address + len(data) - len(image))
+            image[address:address + len(data)] = data
+        elif record_type == 0x04:
+            upper = int.from_bytes(data, "big") << 16
+        elif record_type == 0x01:
+            break
+    return bytes(image)
+
+# file extension -> (reader, text or binary)
+input_formats = {
+    "hex": (read_hex_text, "r"),
+    "mem": (read_hex_text, "r"),
+    "ihex": (read_intel_hex, "r"),
+    "bin": (lambda data: data, "rb"),
+}
+
+# the bytes of an image file, the format comes from the extension
+def read_image(path):
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    if extension not in input_formats:
+        raise ValueError(f"Can't read .{extension} images, expected one of: " + ", ".join("." + e for e in input_formats))
+    reader, mode = input_formats[extension]
+    with open(path, mode) as f:
+        return reader(f.read())
@@ -0,0 +1,224 @@
+from src.Label_Handler import process_labels
+from src.Line_Parser import Parsed_Line, Operand
+from src.Report import instruction_classes, read_registers
+
+# Peephole optimizer (-O), runs on the laid out lines after process_labels and before branch relaxation and encoding.
+# Macro expansion leaves obvious waste behind, every rule removes or shortens it without changing what the program does:
+#   self_move     addu rX, rX, r0 / or rX, r0, rX / addiu rX, rX, 0 / sll rX, rX, 0 ...   removed (nop itself is kept)
+#   dead_write    an ALU result overwritten by the next instruction without being read     the first one removed
+#   store_load    sw rT, m / lw rU, m                                                      lw becomes addu rU, rT, r0
+#   load_store    lw rT, m / sw rT, m                                                      sw removed
+#   jump_next     j/b/beq... to the instruction right after it                             removed
+# Rules are indexed by the mnemonic of the line (or the mnemonics of the adjacent pair) they match, so every line only
+# tries the rules that can match it. Removing a line can line up a new pair, see peephole_pass for how one walk over
+# the lines still catches it. Label addresses are recomputed once at the end
+#
+# Removing instructions moves every later address, which is fine for labels but not for jumps and branches to raw
+# addresses or .equ constants, so a program with one of those isn't optimized. The ram is assumed to be plain memory,
+# store_load and load_store are wrong for memory mapped registers
+
+alu_mnemonics = frozenset(m for m, instr_class in instruction_classes.items() if instr_class in ("alu", "shift"))
+writing_mnemonics = frozenset(m for m, instr_class in instruction_classes.items() if instr_class in ("alu", "shift", "hilo", "load"))
+jump_mnemonics = frozenset(m for m, instr_class in instruction_classes.items() if instr_class == "branch") | {"j"}
+target_mnemonics = jump_mnemonics | {"jal"}
+
+# ALU instructions that copy a register into itself when the last operand is zero
+self_move_mnemonics = frozenset(["addu", "subu", "or", "xor", "addiu", "ori", "xori", "sll", "srl", "sra"])
+ZERO = Operand("reg", 0)
+
+# rule name -> the mnemonics it matches, for the pair rules (first mnemonics, second mnemonics)
+rule_mnemonics = {
+    "self_move": self_move_mnemonics,
+    "dead_write": (alu_mnemonics, writing_mnemonics),
+    "store_load": (frozenset(["sw"]), frozenset(["lw"])),
+    "load_store": (frozenset(["lw"]), frozenset(["sw"])),
+    "jump_next": (jump_mnemonics, frozenset(instruction_classes)),
+}
+peephole_rules = tuple(rule_mnemonics)
+
+# the register an instruction writes, 0 if none (jal's ra doesn't count, it's never the next one's overwrite)
+def written_register(line):
+    instr_class = instruction_classes.get(line.mnemonic)
+    if instr_class in ("alu", "shift", "hilo", "load") and line.operands and line.operands[0].kind == "reg":
+        return line.operands[0].value
+    return 0
+
+def is_zero(operand):
+    return operand == ZERO or (operand.kind == "imm" and operand.value == 0)
+
+# the removed and replaced instructions per rule, for the -O summary
+class Peephole_Stats:
+    def __init__(self):
+        self.removed = dict.fromkeys(peephole_rules, 0)
+        self.replaced = dict.fromkeys(peephole_rules, 0)
+        self.skipped = None     # why nothing was optimized
+
+    @property
+    def removed_count(self):
+        return sum(self.removed.values())
+
+    @property
+    def removed_bytes(self):
+        return 4 * self.removed_count
+
+    def summary(self):
+        if self.skipped:
+            return f"-O skipped: {self.skipped}"
+        counts = ", ".join(f"{rule} {self.removed[rule] + self.replaced[rule]}" for rule in peephole_rules
+                           if self.removed[rule] or self.replaced[rule])
+        return (f"-O removed {self.removed_count:,} instructions ({self.removed_bytes:,} bytes)"
+                + (f": {counts}" if counts else ""))
+
+# Rules. Single line rules get the line and return True if it can go. Pair rules get two adjacent instructions and the
+# labels at the second one's address, and return "first"/"second" for the one to remove, a (mnemonic, operands)
+# replacement for the second, or None
+
+def self_move(line):
+    if len(line.operands) != 3:
+        return False
+    rd, rs, rt = line.operands
+    if rd.kind != "reg" or rd == ZERO:
+        return False
+    # addu/or/xor also take the zero register first
+    return (rs == rd and is_zero(rt)) or (line.mnemonic in ("addu", "or", "xor") and rs == ZERO and rt == rd)
+
+def jump_next(first, second, labels):
+    target = first.operands[-1] if first.operands else None
+    return "first" if target is not None and target.kind == "sym" and target.value in labels else None
+
+def dead_write(first, second, labels):
+    if not second.operands or second.operands[0] != first.operands[0] or not written_register(first):
+        return None
+    # a malformed line is left for the encoder to report
+    try:
+        read = read_registers(second.mnemonic, second.operands)
+    except (IndexError, AttributeError):
+        return None
+    return "first" if written_register(first) not in read else None
+
+def store_load(first, second, labels):
+    # the lw could also be reached from somewhere else through a label on it
+    if labels or len(first.operands) != 2 or first.operands[1:] != second.operands[1:]:
+        return None
+    stored, loaded = first.operands[0], second.operands[0]
+    if stored == loaded:
+        return "second"
+    return ("addu", (loaded, stored, ZERO))
+
+def load_store(first, second, labels):
+    if labels or len(first.operands) != 2 or second.operands != first.operands:
+        return None
+    loaded, memory = first.operands
+    if memory.kind != "mem" or loaded == memory.base:
+        return None
+    return "second"
+
+single_rules = {"self_move": self_move}
+pair_rules = {"dead_write": dead_write, "store_load": store_load, "load_store": load_store, "jump_next": jump_next}
+
+# mnemonic, or (first mnemonic, second mnemonic) for the pair rules -> [(name, rule)] of the enabled rules
+def build_rule_index(rules, table):
+    index = {}
+    for name in rules:
+        if name not in table:
+            continue
+        if name in pair_rules:
+            firsts, seconds = rule_mnemonics[name]
+            keys = [(first, second) for first in firsts for second in seconds]
+        else:
+            keys = rule_mnemonics[name]
+        for key in keys:
+            index.setdefault(key, []).append((name, table[name]))
+    return index
+
+# a jump or branch in the text whose target isn't a label, its address can't follow the removed lines
+def raw_target(lines, label_table):
+    for line in lines:
+        if line.section == ".text" and line.mnemonic in target_mnemonics and line.operands:
+            target = line.operands[-1]
+            if target.kind != "sym" or label_table.sections.get(target.value) != ".text":
+                return line
+    return None
+
+# Optimizes laid out lines, returns (label_table, lines, stats). rules is a collection of rule names, None for all
+def optimize_text(lines, label_table, rules=None):
+    rules = peephole_rules if rules is None else tuple(rules)
+    for name in rules:
+        if name not in rule_mnemonics:
+            raise ValueError(f"Unknown peephole rule '{name}', expected one of: {', '.join(peephole_rules)}")
+    stats = Peephole_Stats()
+    raw = raw_target(lines, label_table)
+    if raw is not None:
+        stats.skipped = f"{raw.mnemonic} to the raw address {raw.operands[-1].value} at {raw.address:#x}"
+        return label_table, lines, stats
+
+    lines = peephole_pass(lines, build_rule_index(rules, single_rules), build_rule_index(rules, pair_rules), stats)
+    if stats.removed_count or sum(stats.replaced.values()):
+        label_table, lines = process_labels(lines)
+    return label_table, lines, stats
+
+# One walk over the lines. output works as a stack: when the first instruction of a pair goes, the second one is
+# checked again against the instruction before it, so a single pass finds everything a pass per change would
+def peephole_pass(lines, single_index, pair_index, stats):
+    output = []
+    kept = []           # (position in output, labels at its address) of the kept text instructions since the last .org
+    labels = ()         # labels between the last kept instruction and the current line
+    for line in lines:
+        mnemonic = line.mnemonic
+        if line.section != ".text":
+            output.append(line)
+            continue
+        if line.label is not None:
+            labels += (line.label,)
+        if mnemonic is None:
+            if line.directive == ".org":
+                kept = []
+                labels = ()
+            output.append(line)
+            continue
+
+        removed = False
+        for name, rule in single_index.get(mnemonic, ()):
+            if rule(line):
+                stats.removed[name] += 1
+                removed = True
+                break
+        if removed:
+            output.append(label_only(line))
+            continue
+
+        while kept and line is not None:
+            position, first_labels = kept[-1]
+            first = output[position]
+            for name, rule in pair_index.get((first.mnemonic, line.mnemonic), ()):
+                action = rule(first, line, labels)
+                if action is not None:
+                    break
+            else:
+                break
+            if action == "first":
+                # its labels now belong to the current line, which meets the instruction before it next
+                stats.removed[name] += 1
+                output[position] = label_only(first)
+                kept.pop()
+                labels = first_labels + labels
+            elif action == "second":
+                stats.removed[name] += 1
+                line = label_only(line)
+            else:
+                stats.replaced[name] += 1
+                line = Parsed_Line(line.section, label=line.label, mnemonic=action[0], operands=action[1],
+                                   address=line.address, line_no=line.line_no, origin=line.origin)
+                break
+
+        output.append(line)
+        if line is not None and line.mnemonic is not None:
+            kept.append((len(output) - 1, labels))
+            labels = ()
+    return [line for line in output if line is not None]
+
+# what is left of a removed line, its label (on the next instruction once laid out again) or None
+def label_only(line):
+    if line.label is None:
+        return None
+    return Parsed_Line(line.section, label=line.label, line_no=line.line_no, origin=line.origin)
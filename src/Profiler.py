@@ -0,0 +1,122 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from src.Encoder import instruction_map
+
+# Instrumentation behind --profile. Every numbered stage of assemble_file runs inside profiler.stage(name), which
+# records its wall time, the peak memory it allocated on top of what was already live (tracemalloc) and an item count
+# the stage fills in. After the encoding stage the per-instruction encoder times every instruction once more,
+# grouped by instruction type and mnemonic.
+# A disabled profiler hands out throwaway records, so the pipeline code is the same whether profiling or not
+
+class Stage_Record:
+    __slots__ = ("name", "seconds", "peak_bytes", "items")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.peak_bytes = None
+        self.items = None
+
+class Stage_Profiler:
+    def __init__(self, enabled=True, trace_memory=True):
+        self.enabled = enabled
+        self.trace_memory = trace_memory and enabled
+        self.stages = []
+        self.encode_times = {}   # mnemonic -> [calls, seconds]
+
+    @contextmanager
+    def stage(self, name):
+        record = Stage_Record(name)
+        if not self.enabled:
+            yield record
+            return
+
+        # only start tracing if nobody else did, and leave it the way we found it
+        started = self.trace_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            if self.trace_memory:
+                record.peak_bytes = max(0, tracemalloc.get_traced_memory()[1] - before)
+            if started:
+                tracemalloc.stop()
+            self.stages.append(record)
+
+    # wraps encode(mnemonic, operands, address) so every call is timed per mnemonic
+    def timed_encoder(self, encode):
+        if not self.enabled:
+            return encode
+        encode_times = self.encode_times
+        perf_counter = time.perf_counter
+
+        def timed_encode(mnemonic, operands, address):
+            start = perf_counter()
+            word = encode(mnemonic, operands, address)
+            elapsed = perf_counter() - start
+            entry = encode_times.get(mnemonic)
+            if entry is None:
+                entry = encode_times[mnemonic] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            return word
+
+        return timed_encode
+
+    # instruction type -> {"calls", "seconds", "mnemonics": {mnemonic -> {"calls", "seconds"}}}
+    def encode_breakdown(self):
+        types = {}
+        for mnemonic, (calls, seconds) in sorted(self.encode_times.items()):
+            info = instruction_map.get(mnemonic)
+            instr_type = info["type"] if info else "Unknown"
+            entry = types.setdefault(instr_type, {"calls": 0, "seconds": 0.0, "mnemonics": {}})
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+            entry["mnemonics"][mnemonic] = {"calls": calls, "seconds": seconds}
+        return types
+
+    def to_dict(self):
+        return {
+            "stages": [{"name": s.name, "seconds": s.seconds, "peak_bytes": s.peak_bytes, "items": s.items}
+                       for s in self.stages],
+            "total_seconds": sum(s.seconds for s in self.stages),
+            "encode_by_type": self.encode_breakdown(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def format_table(self):
+        rows = [f"{'stage':<24}{'time (ms)':>12}{'peak (KiB)':>13}{'items':>12}"]
+        for s in self.stages:
+            peak = f"{s.peak_bytes / 1024:,.1f}" if s.peak_bytes is not None else "-"
+            items = f"{s.items:,}" if s.items is not None else "-"
+            rows.append(f"{s.name:<24}{s.seconds * 1e3:>12.2f}{peak:>13}{items:>12}")
+        rows.append(f"{'total':<24}{sum(s.seconds for s in self.stages) * 1e3:>12.2f}")
+
+        breakdown = self.encode_breakdown()
+        if breakdown:
+            rows.append("")
+            # timed on the per-instruction encoder without its cache, see profile_encoder in src/Assembler.py
+            rows.append("encode by type, per-instruction encoder (uncached)")
+            rows.append(f"{'type':<24}{'time (ms)':>12}{'calls':>13}{'ns/call':>12}")
+            for instr_type, entry in sorted(breakdown.items(), key=lambda item: -item[1]["seconds"]):
+                rows.append(self.format_encode_row(instr_type, entry))
+                for mnemonic, m_entry in sorted(entry["mnemonics"].items(), key=lambda item: -item[1]["seconds"]):
+                    rows.append(self.format_encode_row("  " + mnemonic, m_entry))
+        return "\n".join(rows)
+
+    @staticmethod
+    def format_encode_row(name, entry):
+        per_call = entry["seconds"] / entry["calls"] * 1e9 if entry["calls"] else 0
+        return f"{name:<24}{entry['seconds'] * 1e3:>12.2f}{entry['calls']:>13,}{per_call:>12,.0f}"
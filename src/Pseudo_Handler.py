@@ -0,0 +1,316 @@
+from bisect import bisect_left, bisect_right
+from itertools import repeat
+
+from src.Encoder import register_map
+from src.Label_Handler import process_labels
+from src.Line_Parser import Parsed_Line, Operand, format_operands
+
+# Pseudo-instructions. The ISA has no li/la/move/nop/b/blt/bgt/ble/bge, they are expanded here into real
+# instructions after the constants are known and before labels get their addresses:
+#   nop            -> sll r0, r0, 0
+#   move rd, rs    -> addu rd, rs, r0
+#   li rd, value   -> ori rd, r0, value            0 <= value <= 0xFFFF
+#                     addiu rd, r0, value          -0x8000 <= value < 0, also 0xFFFF8000-0xFFFFFFFF
+#                     ori rd, r0, hi / sll rd, rd, 16 [/ ori rd, rd, lo]    anything else, there is no lui
+#   la rd, label   -> ori rd, r0, label            or the three instruction form of li for addresses over 0xFFFF
+#   b label        -> beq r0, r0, label
+#   blt rs, rt, L  -> slt at, rs, rt / bne at, r0, L     (bgt, ble and bge swap the registers or use beq)
+# at (r1) is overwritten by the compare and branch pseudo-instructions.
+#
+# Branches reach +-32K words. After the first layout relax_text turns a branch to a label that is too far into an
+# inverted branch over a j (an unconditional one, beq rX, rX, into a single j) and picks the long form of la where
+# the address needs it. Growing one instruction moves everything after it, which can push other branches out of
+# range, so it runs as a worklist: the addresses come from a Fenwick tree of the growth so far and only the branches
+# that span a grown instruction are checked again. The lines are laid out once more at the end
+
+AT = register_map["at"]
+ZERO = Operand("reg", 0)
+AT_REGISTER = Operand("reg", AT)
+
+# the opposite condition of every branch, for the relaxed form
+inverted_branches = {"beq": "bne", "bne": "beq", "bgez": "bltz", "bltz": "bgez", "bgtz": "blez", "blez": "bgtz"}
+
+# compare and branch pseudo-instructions: (swap the registers for slt, branch taken on at != 0 or at == 0)
+compare_branches = {"blt": (False, "bne"), "bgt": (True, "bne"), "ble": (True, "beq"), "bge": (False, "beq")}
+
+class Pseudo_Error(ValueError):
+    def __init__(self, mnemonic, operands, message):
+        super().__init__(f"{mnemonic} {format_operands(operands)} — {message}")
+
+def check_registers(mnemonic, operands, count, usage):
+    if len(operands) != count or any(operand.kind != "reg" for operand in operands[:count - 1]):
+        raise Pseudo_Error(mnemonic, operands, f"expected {usage}")
+
+# the shortest sequence that loads value into rd, as (mnemonic, operands) pairs. The value is a 32 bit word, so
+# 0xFFFFFFFF is -1 and loads with one addiu like it
+def load_value(rd, value):
+    value &= 0xFFFFFFFF
+    signed = value - (1 << 32) if value & 0x80000000 else value
+    if 0 <= signed <= 0xFFFF:
+        return [("ori", (rd, ZERO, Operand("imm", signed)))]
+    if -0x8000 <= signed < 0:
+        return [("addiu", (rd, ZERO, Operand("imm", signed)))]
+    sequence = [("ori", (rd, ZERO, Operand("imm", value >> 16))), ("sll", (rd, rd, Operand("imm", 16)))]
+    if value & 0xFFFF:
+        sequence.append(("ori", (rd, rd, Operand("imm", value & 0xFFFF))))
+    return sequence
+
+# the real instructions for one pseudo-instruction, as (mnemonic, operands) pairs
+def expand_pseudo(mnemonic, operands, constants):
+    if mnemonic == "nop":
+        if operands:
+            raise Pseudo_Error(mnemonic, operands, "takes no operands")
+        return [("sll", (ZERO, ZERO, Operand("imm", 0)))]
+
+    if mnemonic == "move":
+        check_registers(mnemonic, operands, 2, "rd, rs")
+        if operands[1].kind != "reg":
+            raise Pseudo_Error(mnemonic, operands, "expected rd, rs")
+        return [("addu", (operands[0], operands[1], ZERO))]
+
+    if mnemonic in ("li", "la"):
+        check_registers(mnemonic, operands, 2, "rd, value")
+        rd, source = operands
+        if source.kind == "sym" and source.value in constants:
+            source = Operand("imm", constants[source.value])
+        if source.kind == "imm":
+            if not -0x80000000 <= source.value <= 0xFFFFFFFF:
+                raise Pseudo_Error(mnemonic, operands, "value does not fit in 32 bits")
+            return load_value(rd, source.value)
+        if source.kind == "sym":
+            # a label, its address is only known after layout. The short form stays unless relax_text grows it
+            return [("ori", (rd, ZERO, Operand("addr", source.value)))]
+        raise Pseudo_Error(mnemonic, operands, "expected rd, value")
+
+    if mnemonic == "b":
+        if len(operands) != 1:
+            raise Pseudo_Error(mnemonic, operands, "expected a target")
+        return [("beq", (ZERO, ZERO, operands[0]))]
+
+    # blt/bgt/ble/bge
+    check_registers(mnemonic, operands, 3, "rs, rt, target")
+    swap, branch = compare_branches[mnemonic]
+    rs, rt, target = operands
+    if operands[1].kind != "reg":
+        raise Pseudo_Error(mnemonic, operands, "expected rs, rt, target")
+    if swap:
+        rs, rt = rt, rs
+    return [("slt", (AT_REGISTER, rs, rt)), (branch, (AT_REGISTER, ZERO, target))]
+
+pseudo_mnemonics = frozenset(["nop", "move", "li", "la", "b"]) | frozenset(compare_branches)
+
+# li/la of a constant defined further down. The modes that lay the program out before every constant is known
+# (--single-pass, --stream) expand it like a label, to the one instruction ori rd, r0, name. The value is only known
+# when the word is encoded, so it has to load in one instruction too, and then the word is the regular pipeline's.
+# Other instructions come back unchanged
+def late_constant_load(mnemonic, operands, constants):
+    if mnemonic != "ori" or len(operands) != 3 or operands[2].kind != "addr" or operands[2].value not in constants:
+        return mnemonic, operands
+    rd, _, source = operands
+    value = constants[source.value]
+    if not -0x80000000 <= value <= 0xFFFFFFFF:
+        raise ValueError(f"{source.value} does not fit in 32 bits")
+    sequence = load_value(rd, value)
+    if len(sequence) > 1:
+        raise ValueError(f"{source.value} = {hex(value)} is defined further down and takes {len(sequence)} instructions "
+                         f"to load, only one was laid out. Define it before the li/la")
+    return sequence[0]
+
+# replaces the pseudo-instructions of the parsed lines, the first real instruction keeps the label
+def expand_pseudo_instructions(lines, constant_table):
+    if not any(line.mnemonic in pseudo_mnemonics for line in lines):
+        return lines
+    return list(iter_expand_pseudo_instructions(lines, constant_table))
+
+# generator version, constants defined later than their use in li aren't known yet and are treated as labels
+def iter_expand_pseudo_instructions(lines, constant_table):
+    constants = constant_table.table
+    for line in lines:
+        if line.mnemonic not in pseudo_mnemonics:
+            yield line
+            continue
+        label = line.label
+        for mnemonic, operands in expand_pseudo(line.mnemonic, line.operands, constants):
+            yield Parsed_Line(line.section, label=label, mnemonic=mnemonic, operands=operands, line_no=line.line_no,
+                              origin=line.origin)
+            label = None
+
+# Fenwick tree over the line positions, holds the bytes every grown instruction added
+class Growth_Tree:
+    def __init__(self, size):
+        self.tree = [0] * (size + 1)
+
+    def add(self, position, amount):
+        position += 1
+        while position < len(self.tree):
+            self.tree[position] += amount
+            position += position & -position
+
+    # total growth of the positions before position
+    def before(self, position):
+        total = 0
+        while position > 0:
+            total += self.tree[position]
+            position -= position & -position
+        return total
+
+# an instruction that may need its long form. target is the line position of its text label, or None for a label
+# in .data (those don't move)
+class Relax_Item:
+    __slots__ = ("position", "line", "label", "target", "growth", "long")
+
+    def __init__(self, position, line, label, target, growth):
+        self.position = position
+        self.line = line
+        self.label = label
+        self.target = target
+        self.growth = growth   # bytes the long form adds
+        self.long = False
+
+# the short form is in range, target and address are the byte addresses of the label and the instruction
+def fits(mnemonic, target, address):
+    if mnemonic == "ori":
+        return target <= 0xFFFF
+    return -0x8000 <= (target - (address + 4)) // 4 <= 0x7FFF
+
+branch_relax_mnemonics = frozenset(inverted_branches)
+relax_mnemonics = branch_relax_mnemonics | frozenset(["ori"])
+
+# the label of a branch or la that relax_text handles, None for any other line (a raw address, an .equ, an error)
+def relax_label(line):
+    operands = line.operands
+    if not operands or line.section != ".text":
+        return None
+    if line.mnemonic == "ori":
+        return operands[2].value if len(operands) == 3 and operands[2].kind == "addr" else None
+    return operands[-1].value if operands[-1].kind == "sym" else None
+
+def short_form_fits(line, labels):
+    label = relax_label(line)
+    return label not in labels or fits(line.mnemonic, labels[label], line.address)
+
+def relax_item(position, line, labels):
+    label = relax_label(line)
+    if label not in labels:
+        return None
+    if line.mnemonic == "ori":
+        return Relax_Item(position, line, label, None, 8)
+    # an unconditional branch becomes a single j
+    operands = line.operands
+    unconditional = line.mnemonic == "beq" and len(operands) == 3 and operands[0] == operands[1]
+    return Relax_Item(position, line, label, None, 0 if unconditional else 4)
+
+# Lays out the branches and la instructions of laid out lines, returns (label_table, lines). The lines are only
+# copied and laid out again when something changed.
+# With delay_slots (scheduled code, every branch is followed by its delay slot) the slot has to run on both paths, so
+# the long form is the inverted branch, the slot, then j L and a nop for the slot of the j. The 8 bytes go after the slot.
+# With relocatable (an object file for the linker) la keeps its short form, the address is only known once linked
+def relax_text(lines, label_table, delay_slots=False, relocatable=False):
+    labels = label_table.table
+
+    # usually everything fits in the first layout, that is checked before anything is allocated per line
+    mnemonics = branch_relax_mnemonics if relocatable else relax_mnemonics
+    candidates = [position for position, line in enumerate(lines) if line.mnemonic in mnemonics]
+    if all(short_form_fits(lines[position], labels) for position in candidates):
+        return label_table, lines
+    items = [item for item in map(relax_item, candidates, map(lines.__getitem__, candidates), repeat(labels))
+             if item is not None]
+    if delay_slots:
+        for item in items:
+            if item.growth == 4:
+                item.growth = 8
+
+    # line position of every label, the positions where a text .org starts a new region
+    label_positions = {line.label: position for position, line in enumerate(lines) if line.label is not None}
+    org_positions = [0] + [position for position, line in enumerate(lines)
+                           if line.directive == ".org" and line.section == ".text"]
+    for item in items:
+        item.target = label_positions.get(item.label) if label_table.sections.get(item.label) == ".text" else None
+
+    def region_start(position):
+        return org_positions[bisect_right(org_positions, position) - 1]
+
+    growth = Growth_Tree(len(lines))
+
+    # addresses after the growth so far, only the growth inside the same .org region moves a position
+    def shift(position):
+        return growth.before(position) - growth.before(region_start(position))
+
+    def target_address(item):
+        return labels[item.label] + (shift(item.target) if item.target is not None else 0)
+
+    # some position grown this round lies before position in its .org region, so position moved
+    def moved(position, grown):
+        index = bisect_left(grown, region_start(position))
+        return index < len(grown) and grown[index] < position
+
+    # an item is checked again when its own address or its label's moved relative to the other
+    def affected(item, grown):
+        if item.target is None:
+            # a .data label doesn't move
+            return item.line.mnemonic != "ori" and moved(item.position, grown)
+        if item.line.mnemonic == "ori":
+            return moved(item.target, grown)
+        if region_start(item.position) != region_start(item.target):
+            return moved(item.position, grown) or moved(item.target, grown)
+        low, high = sorted((item.position, item.target))
+        index = bisect_left(grown, low)
+        return index < len(grown) and grown[index] < high
+
+    worklist = items
+    while worklist:
+        grown = []
+        for item in worklist:
+            if not item.long and not fits(item.line.mnemonic, target_address(item), item.line.address + shift(item.position)):
+                item.long = True
+                if item.growth:
+                    grow_position = item.position + 1 if delay_slots else item.position
+                    growth.add(grow_position, item.growth)
+                    grown.append(grow_position)
+        if not grown:
+            break
+        grown.sort()
+        worklist = [item for item in items if not item.long and affected(item, grown)]
+
+    # final addresses for the immediates of the long forms, then one more layout
+    by_position = {item.position: item for item in items if item.long}
+    relaxed = []
+    after_slot = []     # the j and nop that go after the delay slot of the last long branch
+    slot_branch = None  # that branch
+    for position, line in enumerate(lines):
+        item = by_position.get(position)
+        if item is None:
+            relaxed.append(line)
+            if after_slot and line.mnemonic is not None:
+                relaxed.extend(Parsed_Line(line.section, mnemonic=mnemonic, operands=operands, line_no=slot_branch.line_no,
+                                           origin=slot_branch.origin) for mnemonic, operands in after_slot)
+                after_slot = []
+            continue
+        label = line.label
+        form, after_slot = relaxed_form(item, target_address(item), line.address + shift(position), delay_slots)
+        slot_branch = line
+        for mnemonic, operands in form:
+            relaxed.append(Parsed_Line(line.section, label=label, mnemonic=mnemonic, operands=operands, line_no=line.line_no,
+                                       origin=line.origin))
+            label = None
+    return process_labels(relaxed)
+
+# the instructions that replace an item and the ones that go after its delay slot, target is the final byte address
+# of its label and address its own
+def relaxed_form(item, target, address, delay_slots=False):
+    line = item.line
+    mnemonic, operands = line.mnemonic, line.operands
+    if mnemonic == "ori":
+        # la, always all three instructions of the wide load since relax_text counted on their 8 bytes
+        rd = operands[0]
+        return [("ori", (rd, ZERO, Operand("imm", target >> 16))), ("sll", (rd, rd, Operand("imm", 16))),
+                ("ori", (rd, rd, Operand("imm", target & 0xFFFF)))], []
+    jump = ("j", (operands[-1],))
+    if item.growth == 0:
+        return [jump], []
+    # skip over the j when the condition is false, the skip target is a word address
+    if delay_slots:
+        # past the slot, the j and the nop in the slot of the j
+        skip = (inverted_branches[mnemonic], operands[:-1] + (Operand("imm", (address + 16) >> 2),))
+        return [skip], [jump, ("sll", (ZERO, ZERO, Operand("imm", 0)))]
+    return [(inverted_branches[mnemonic], operands[:-1] + (Operand("imm", (address + 8) >> 2),)), jump], []
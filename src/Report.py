@@ -0,0 +1,222 @@
+from bisect import bisect_left, bisect_right
+
+from src.Disassembler import decode_image, reverse_symbols
+from src.Encoder import instruction_map, r_type_shapes
+from src.Line_Parser import format_operands
+from src.Utilities import paused_gc
+
+# Static performance report of an assembled program, for tuning loops by hand on a small instruction memory.
+# It works on the encoded rom (after pseudo-instructions and branch relaxation) and the labels of the program:
+#   - every text label starts a region that runs to the next label, instructions before the first one are "(start)"
+#   - a branch or j to an address at or before itself closes a loop, its body is target..branch
+#   - every instruction costs the latency of its class, lw followed by an instruction that reads the loaded register
+#     is a load-use hazard and costs load_use extra cycles
+# The cycles are a static estimate, every instruction counted once (per iteration for loops), not a simulation.
+# Only the written rom words are looked at, the gaps left by .org are not code
+
+# cycles per instruction class, a simple single issue pipeline. Override any of them with latencies=
+default_latencies = {"alu": 1, "shift": 1, "mult": 5, "hilo": 1, "load": 1, "store": 1, "branch": 1, "jump": 1,
+                     "load_use": 1}
+
+def instruction_class(mnemonic, info):
+    instr_type = info["type"]
+    if instr_type == "R-type":
+        return {"shift": "shift", "rs": "jump", "rd": "hilo", "rs_rt": "mult"}.get(r_type_shapes.get(mnemonic), "alu")
+    if instr_type == "I-type":
+        return "alu"
+    if instr_type == "Branch":
+        return "branch"
+    if instr_type == "Jump":
+        return "jump"
+    return "load" if mnemonic == "lw" else "store"
+
+instruction_classes = {mnemonic: instruction_class(mnemonic, info) for mnemonic, info in instruction_map.items()}
+
+# the instructions that can close a loop, jal and jr are calls and returns
+loop_mnemonics = frozenset(mnemonic for mnemonic, instr_class in instruction_classes.items() if instr_class == "branch") | {"j"}
+
+# the registers an instruction reads, operands are the decoded ones
+def read_registers(mnemonic, operands):
+    if mnemonic == "lw":
+        return (operands[1].base.value,)
+    if mnemonic == "sw":
+        return (operands[0].value, operands[1].base.value)
+    instr_class = instruction_classes[mnemonic]
+    if instr_class == "hilo":
+        return ()
+    if instr_class in ("alu", "shift"):
+        # the first operand is the destination
+        operands = operands[1:]
+    return tuple(operand.value for operand in operands if operand.kind == "reg")
+
+# a label region or a loop body, start and end are byte addresses (end is the last instruction)
+class Region:
+    __slots__ = ("name", "start", "end", "instructions", "cycles", "hazards")
+
+    def __init__(self, name, start, end):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.instructions = 0
+        self.cycles = 0
+        self.hazards = 0
+
+# one load-use hazard, address is the lw
+class Hazard:
+    __slots__ = ("address", "load", "use", "register")
+
+    def __init__(self, address, load, use, register):
+        self.address = address
+        self.load = load        # (mnemonic, operands) of the lw
+        self.use = use          # (mnemonic, operands) of the instruction after it
+        self.register = register
+
+class Static_Report:
+    def __init__(self, regions, loops, hazards, symbols, rom_used, rom_size, ram_used, ram_size, latencies):
+        self.regions = regions    # Region per label, in address order
+        self.loops = loops        # Region per backward branch, in address order
+        self.hazards = hazards    # Hazard per load-use pair, in address order
+        self.symbols = symbols    # text labels, label -> byte address
+        self.rom_used = rom_used
+        self.rom_size = rom_size
+        self.ram_used = ram_used
+        self.ram_size = ram_size
+        self.latencies = latencies
+
+    @property
+    def instructions(self):
+        return sum(region.instructions for region in self.regions)
+
+    @property
+    def cycles(self):
+        return sum(region.cycles for region in self.regions)
+
+    # label+offset of a byte address
+    def locate(self, address):
+        names = sorted(self.symbols.items(), key=lambda item: item[1])
+        index = bisect_right([value for _, value in names], address) - 1
+        if index < 0:
+            return f"{address:#x}"
+        name, start = names[index]
+        return name if address == start else f"{name}+{address - start:#x}"
+
+    # the report as text, regions and loops sorted by their cycles, at most limit rows each
+    def format_table(self, limit=20):
+        rows = [f"{'memory':<24}{'used (bytes)':>14}{'size (bytes)':>14}{'used':>9}",
+                format_usage("ROM", self.rom_used, self.rom_size), format_usage("RAM", self.ram_used, self.ram_size),
+                "", f"{self.instructions:,} instructions, about {self.cycles:,} cycles in one pass over the code, "
+                    f"{len(self.hazards):,} load-use hazards"]
+
+        for title, regions in (("region", self.regions), ("loop", self.loops)):
+            if not regions:
+                continue
+            rows.append("")
+            rows.append(f"{title:<24}{'address':>10}{'instr':>9}{'cycles':>10}{'hazards':>9}")
+            for region in sorted(regions, key=lambda region: (-region.cycles, region.start))[:limit]:
+                rows.append(f"{region.name:<24}{region.start:>10x}{region.instructions:>9,}{region.cycles:>10,}{region.hazards:>9,}")
+            if len(regions) > limit:
+                rows.append(f"... {len(regions) - limit:,} more")
+
+        if self.hazards:
+            rows.append("")
+            rows.append("load-use hazards")
+            for hazard in self.hazards[:limit]:
+                rows.append(f"  {hazard.address:08X} {self.locate(hazard.address):<20} "
+                            f"{format_instruction(*hazard.load)} -> {format_instruction(*hazard.use)}")
+            if len(self.hazards) > limit:
+                rows.append(f"  ... {len(self.hazards) - limit:,} more")
+        return "\n".join(rows)
+
+def format_usage(name, used, size):
+    if size is None:
+        return f"{name:<24}{used:>14,}{'no limit':>14}{'-':>9}"
+    return f"{name:<24}{used:>14,}{size:>14,}{used / size:>8.1%}"
+
+def format_instruction(mnemonic, operands):
+    return f"{mnemonic} {format_operands(operands)}".rstrip()
+
+# Builds the Static_Report of an Assembly_Result. latencies overrides entries of default_latencies
+def build_report(result, latencies=None):
+    costs = dict(default_latencies)
+    for name, cycles in (latencies or {}).items():
+        if name not in costs:
+            raise ValueError(f"Unknown instruction class '{name}', expected one of: {', '.join(costs)}")
+        costs[name] = cycles
+    class_cycles = {mnemonic: costs[instruction_class] for mnemonic, instruction_class in instruction_classes.items()}
+    load_use = costs["load_use"]
+
+    symbols = result.section_symbols(".text")
+    names = reverse_symbols(symbols)
+    starts = sorted(names)
+    regions = [Region(names[start], start, start) for start in starts]
+    if not starts or starts[0] > 0:
+        regions.insert(0, Region("(start)", 0, 0))
+        starts.insert(0, 0)
+
+    # one walk over the written rom words in address order, a word that isn't an instruction costs nothing
+    addresses = []
+    prefix_cycles = [0]     # cycles of the instructions before each one, loop bodies are differences of two
+    loop_ends = []          # (index, address, target) of every backward branch or j
+    hazards = []
+    region_index = 0
+    total = 0
+    with paused_gc():
+        for base, segment in result.rom_image.iter_segments():
+            decoded = decode_image(segment, {}, {}, base)
+            loaded = 0      # the register the previous instruction loaded, 0 when it isn't a lw
+            load = None     # and that lw, (mnemonic, operands)
+            for address, mnemonic, operands in zip(range(base, base + 4 * len(decoded), 4), decoded.mnemonics, decoded.operands):
+                if mnemonic is None:
+                    loaded = 0
+                    load = None
+                    continue
+                cycles = class_cycles[mnemonic]
+                while region_index + 1 < len(starts) and starts[region_index + 1] <= address:
+                    region_index += 1
+                region = regions[region_index]
+                if loaded and loaded in read_registers(mnemonic, operands):
+                    hazards.append(Hazard(address - 4, load, (mnemonic, operands), loaded))
+                    cycles += load_use
+                    region.hazards += 1
+                region.instructions += 1
+                region.cycles += cycles
+                region.end = address
+
+                # a branch to itself is a halt and not a loop
+                if mnemonic in loop_mnemonics and operands[-1].value * 4 < address:
+                    loop_ends.append((len(addresses), address, operands[-1].value * 4))
+                addresses.append(address)
+                total += cycles
+                prefix_cycles.append(total)
+                if mnemonic == "lw":
+                    loaded = operands[0].value
+                    load = (mnemonic, operands)
+                else:
+                    loaded = 0
+                    load = None
+
+    # a hazard belongs where its stall is counted, at the instruction after the lw
+    hazard_addresses = [hazard.address + 4 for hazard in hazards]
+    loops = []
+    for index, address, target in loop_ends:
+        first = bisect_left(addresses, target)
+        loop = Region(names.get(target, f"{target:#x}"), target, address)
+        loop.instructions = index + 1 - first
+        loop.cycles = prefix_cycles[index + 1] - prefix_cycles[first]
+        loop.hazards = bisect_right(hazard_addresses, address) - bisect_left(hazard_addresses, target)
+        loops.append(loop)
+
+    rom, ram = result.rom_image, result.ram_image
+    return Static_Report([region for region in regions if region.instructions], loops, hazards, symbols,
+                         len(rom), rom.size, len(ram), ram.size, costs)
+
+# parses "mult=5,load=2" into a latency table for build_report
+def parse_latencies(text):
+    latencies = {}
+    for entry in filter(None, (entry.strip() for entry in text.split(","))):
+        name, _, cycles = entry.partition("=")
+        try:
+            latencies[name.strip()] = int(cycles, 0)
+        except ValueError:
+            raise ValueError(f"Expected class=cycles in the latency table, found '{entry}'") from None
+    return latencies
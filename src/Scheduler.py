@@ -0,0 +1,202 @@
+from src.Label_Handler import process_labels
+from src.Line_Parser import Parsed_Line, Operand
+from src.Peephole_Optimizer import raw_target
+from src.Report import instruction_classes, read_registers
+
+# Instruction scheduler for the pipelined core (--schedule). The core runs the instruction after every branch and
+# jump before the jump is taken (the delay slot) and stalls a cycle when an instruction uses the register the lw
+# right before it loads. Source is written the way it reads, without delay slots, and this pass turns it into code
+# for the core:
+#   - the text is split into basic blocks at labels, .org and after every beq/bne/bgez.../j/jal/jr
+#   - every block gets a dependency graph from the registers its instructions read and write (hi/lo count as
+#     registers, a sw is ordered against every other load and store)
+#   - an instruction the branch doesn't depend on and nothing after it in the block needs moves into the delay slot,
+#     if there is none a nop goes there
+#   - the rest is list scheduled, the longest chain (a lw to its use counts double) first, and an instruction that
+#     would use the register loaded by the lw right before it waits while some other ready one can go
+# A block is never scheduled into more stalls than it had. Very long blocks are scheduled in chunks of
+# CHUNK instructions to keep the graph small. The nops move every later address, so like -O a jump or branch to a raw
+# address or an .equ constant is an error
+
+CHUNK = 64
+HI, LO = 32, 33
+NOP = ("sll", (Operand("reg", 0), Operand("reg", 0), Operand("imm", 0)))
+control_mnemonics = frozenset(m for m, instr_class in instruction_classes.items() if instr_class in ("branch", "jump"))
+
+# (registers read, registers written, memory access, store) of a text line, r0 is left out
+def effects(line):
+    mnemonic, operands = line.mnemonic, line.operands
+    instr_class = instruction_classes[mnemonic]
+    reads = set(read_registers(mnemonic, operands))
+    writes = set()
+    if instr_class in ("alu", "shift", "hilo", "load"):
+        writes.add(operands[0].value)
+    elif instr_class == "mult":
+        writes.update((HI, LO))
+    if mnemonic == "mfhi":
+        reads.add(HI)
+    elif mnemonic == "mflo":
+        reads.add(LO)
+    elif mnemonic == "jal":
+        writes.add(31)
+    reads.discard(0)
+    writes.discard(0)
+    return reads, writes, instr_class in ("load", "store"), instr_class == "store"
+
+# later has to stay after earlier
+def depends(earlier, later):
+    reads, writes, memory, store = earlier
+    later_reads, later_writes, later_memory, later_store = later
+    return (not writes.isdisjoint(later_reads) or not writes.isdisjoint(later_writes) or not reads.isdisjoint(later_writes)
+            or (memory and later_memory and (store or later_store)))
+
+# cycles lost to load-use stalls in a sequence of (line, effects)
+def count_stalls(sequence):
+    stalls = 0
+    for (line, _), (_, (reads, _, _, _)) in zip(sequence, sequence[1:]):
+        if line.mnemonic == "lw" and line.operands[0].value in reads:
+            stalls += 1
+    return stalls
+
+class Schedule_Stats:
+    def __init__(self):
+        self.slots = 0           # branches and jumps, each has a delay slot
+        self.filled = 0          # delay slots that got an instruction of the block instead of a nop
+        self.stalls_before = 0   # load-use stalls in source order
+        self.stalls_after = 0
+
+    @property
+    def stalls_removed(self):
+        # a filled slot saves the cycle a nop would spend there
+        return self.filled + self.stalls_before - self.stalls_after
+
+    def summary(self):
+        return (f"--schedule filled {self.filled:,} of {self.slots:,} delay slots ({self.slots - self.filled:,} nops added), "
+                f"load-use stalls {self.stalls_before:,} -> {self.stalls_after:,}, {self.stalls_removed:,} stall cycles removed")
+
+# the nop of an empty delay slot, it belongs to the line of its branch
+def nop_after(terminator):
+    return Parsed_Line(terminator.section, mnemonic=NOP[0], operands=NOP[1], line_no=terminator.line_no, origin=terminator.origin)
+
+# the order of one chunk of a block, terminator (a branch or jump, or None) stays last.
+# Returns the lines in their new order, the delay slot after the terminator. Only a chunk with a load-use stall is
+# reordered
+def schedule_block(body, terminator, stats):
+    nodes = [(line, effects(line)) for line in body]
+    branch = effects(terminator) if terminator is not None else None
+    stats.stalls_before += count_stalls(nodes + ([(terminator, branch)] if branch is not None else []))
+    slot = None
+    if terminator is not None:
+        stats.slots += 1
+        # the latest instruction the branch doesn't read and nothing after it depends on
+        for index in range(len(nodes) - 1, -1, -1):
+            line, effect = nodes[index]
+            if not effect[1].isdisjoint(branch[0]) or (terminator.mnemonic == "jal" and 31 in effect[0] | effect[1]):
+                continue
+            # an la can still grow into three instructions when the branches are relaxed, only one fits in the slot
+            if any(operand.kind == "addr" for operand in line.operands):
+                continue
+            if any(depends(effect, later) for _, later in nodes[index + 1:]):
+                continue
+            # taking it out must not put a lw right before a use of what it loads
+            following = nodes[index + 1][1] if index + 1 < len(nodes) else branch
+            if index and nodes[index - 1][0].mnemonic == "lw" and nodes[index - 1][0].operands[0].value in following[0]:
+                continue
+            slot = nodes.pop(index)
+            stats.filled += 1
+            break
+        nodes.append((terminator, branch))
+
+    tail = [slot] if slot is not None else []
+    stalls = count_stalls(nodes + tail)
+    if stalls:
+        nodes, stalls = list_schedule(nodes, terminator is not None, tail, stalls)
+    stats.stalls_after += stalls
+    lines = [line for line, _ in nodes]
+    if terminator is not None:
+        lines.append(slot[0] if slot is not None else nop_after(terminator))
+    return lines
+
+# reorders nodes (a terminator stays last) to move uses away from their lw, returns (nodes, stalls) of the new order
+# or the old one when that isn't better. The priority of a node is the longest path from it to the end of the block,
+# a lw to an instruction that reads what it loads counts 2 so loads start early, ties go in source order
+def list_schedule(nodes, terminator, tail, stalls):
+    count = len(nodes)
+    successors = [[] for _ in range(count)]
+    waiting = [0] * count
+    for later in range(count):
+        for earlier in range(later):
+            # the terminator stays last
+            if later == count - 1 and terminator or depends(nodes[earlier][1], nodes[later][1]):
+                successors[earlier].append(later)
+                waiting[later] += 1
+    height = [0] * count
+    for index in range(count - 1, -1, -1):
+        line = nodes[index][0]
+        loaded = line.operands[0].value if line.mnemonic == "lw" else 0
+        height[index] = max((height[successor] + (2 if loaded and loaded in nodes[successor][1][0] else 1)
+                             for successor in successors[index]), default=0)
+    ready = [index for index in range(count) if not waiting[index]]
+    order = []
+    loaded = 0
+    while ready:
+        # the ready ones that don't stall after the last instruction, or all of them
+        candidates = [index for index in ready if not loaded or loaded not in nodes[index][1][0]] or ready
+        index = min(candidates, key=lambda index: (-height[index], index))
+        ready.remove(index)
+        order.append(nodes[index])
+        line = nodes[index][0]
+        loaded = line.operands[0].value if line.mnemonic == "lw" else 0
+        for successor in successors[index]:
+            waiting[successor] -= 1
+            if not waiting[successor]:
+                ready.append(successor)
+
+    after = count_stalls(order + tail)
+    return (order, after) if after < stalls else (nodes, stalls)
+
+# Schedules laid out lines for the delay slot core, returns (label_table, lines, stats)
+def schedule_text(lines, label_table):
+    raw = raw_target(lines, label_table)
+    if raw is not None:
+        raise ValueError(f"--schedule can't move {raw.mnemonic} to the raw address {raw.operands[-1].value} at {raw.address:#x}, "
+                         f"use a label")
+    stats = Schedule_Stats()
+    output = []
+    block = []
+
+    def flush(terminator=None):
+        # the label of the first instruction stays where the block starts, whatever instruction ends up there
+        if block and block[0].label is not None:
+            first = block[0]
+            output.append(Parsed_Line(first.section, label=first.label, line_no=first.line_no, origin=first.origin))
+            block[0] = Parsed_Line(first.section, mnemonic=first.mnemonic, operands=first.operands, line_no=first.line_no,
+                                   origin=first.origin)
+        chunks = [block[start:start + CHUNK] for start in range(0, len(block), CHUNK)] or [[]]
+        try:
+            for chunk in chunks[:-1]:
+                output.extend(schedule_block(chunk, None, stats))
+            output.extend(schedule_block(chunks[-1], terminator, stats))
+        except (IndexError, AttributeError, KeyError):
+            # a malformed line, the encoder reports it
+            output.extend(block)
+            if terminator is not None:
+                output.extend([terminator, nop_after(terminator)])
+        block.clear()
+
+    for line in lines:
+        if line.section != ".text" or line.mnemonic is None:
+            flush()
+            output.append(line)
+        elif line.mnemonic in control_mnemonics:
+            if line.label is not None:
+                flush()
+            flush(line)
+        else:
+            if line.label is not None:
+                flush()
+            block.append(line)
+    flush()
+
+    label_table, output = process_labels(output)
+    return label_table, output, stats
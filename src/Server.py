@@ -0,0 +1,174 @@
+import base64
+import json
+import os
+import signal
+import socketserver
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.Assembler import assemble
+from src.Memory_Image import DEFAULT_MEMORY_SIZE
+
+# Long running assembler behind --serve. Requests are newline delimited JSON, read from stdin or from the connections
+# of a Unix socket, and every request gets one JSON line back. The process stays up, so the compiled encoder tables,
+# the instruction cache and the parsed included files stay warm between requests.
+#
+# request : {"id": 1, "source": ".text\n...", "path": "prog.asm", "rom_size": 1024, "ram_size": 1024,
+#            "include_dirs": ["lib"], "encoding": "hex"}
+#           source or path is required, path alone reads the file. The sizes default to the server's, 0 means no limit.
+#           encoding is hex (default) or base64 for the rom/ram bytes
+# response: {"id": 1, "ok": true, "rom": "...", "ram": "...", "symbols": {...}, "constants": {...}, "diagnostics": [...]}
+#
+# Requests run on a thread pool and answers are written as they finish, so they can come back out of order.
+# Match them up with the id
+
+# server wide defaults, overridden per request
+class Server_Options:
+    def __init__(self, rom_size=DEFAULT_MEMORY_SIZE, ram_size=DEFAULT_MEMORY_SIZE, include_dirs=(), cache_dir=None):
+        self.rom_size = rom_size
+        self.ram_size = ram_size
+        self.include_dirs = tuple(include_dirs)
+        self.cache_dir = cache_dir
+
+def error_response(request_id, message):
+    diagnostic = {"severity": "error", "message": message, "line": None, "column": None}
+    return {"id": request_id, "ok": False, "diagnostics": [diagnostic]}
+
+# memory size from the request, 0 or null turns the limit off
+def request_size(request, name, default):
+    if name not in request:
+        return default
+    size = request[name]
+    if size is not None and (not isinstance(size, int) or size < 0):
+        raise ValueError(f"{name} must be a positive integer")
+    return size or None
+
+# assembles one decoded request into its response
+def handle_request(request, options):
+    if not isinstance(request, dict):
+        return error_response(None, "Request must be a JSON object")
+    request_id = request.get("id")
+
+    try:
+        source = request.get("source")
+        path = request.get("path")
+        if source is None:
+            if path is None:
+                raise ValueError("Request needs a source or a path")
+            with open(path, "r") as f:
+                source = f.read()
+        encoding = request.get("encoding", "hex")
+        if encoding not in ("hex", "base64"):
+            raise ValueError(f"Unknown encoding: {encoding}")
+        result = assemble(source,
+                          rom_size=request_size(request, "rom_size", options.rom_size),
+                          ram_size=request_size(request, "ram_size", options.ram_size),
+                          raise_errors=False,
+                          source_path=path,
+                          include_dirs=tuple(request.get("include_dirs", ())) + options.include_dirs,
+                          cache_dir=options.cache_dir)
+    except (OSError, ValueError, TypeError) as e:
+        return error_response(request_id, str(e))
+
+    encode = bytes.hex if encoding == "hex" else (lambda data: base64.b64encode(data).decode("ascii"))
+    return {
+        "id": request_id,
+        "ok": result.ok,
+        "rom": encode(result.rom),
+        "ram": encode(result.ram),
+        "symbols": result.symbols,
+        "constants": result.constants,
+        "diagnostics": [d._asdict() for d in result.diagnostics],
+    }
+
+# reads requests from lines until EOF and hands each one to the pool, write(text) sends one response line.
+# Returns once every request of the stream has been answered
+def serve_stream(lines, write, pool, options):
+    write_lock = threading.Lock()
+    pending = []
+
+    def respond(response):
+        text = json.dumps(response, separators=(",", ":")) + "\n"
+        with write_lock:
+            write(text)
+
+    def run(request):
+        try:
+            respond(handle_request(request, options))
+        except Exception as e:
+            # never let one request take the stream down
+            respond(error_response(request.get("id") if isinstance(request, dict) else None, f"{type(e).__name__}: {e}"))
+
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            respond(error_response(None, f"Invalid JSON: {e}"))
+            continue
+        pending.append(pool.submit(run, request))
+        # forget the finished ones so a long session doesn't keep every future
+        if len(pending) > 1024:
+            pending = [future for future in pending if not future.done()]
+
+    for future in pending:
+        future.result()
+
+# JSON lines on stdin, responses on stdout. Ends at EOF
+def serve_stdio(options, jobs=None):
+    stdout = sys.stdout
+
+    def write(text):
+        stdout.write(text)
+        stdout.flush()
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        serve_stream(sys.stdin, write, pool, options)
+
+# JSON lines over a Unix socket, every connection is served on its own thread. Runs until interrupted
+def serve_socket(socket_path, options, jobs=None):
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        raise ValueError("Unix sockets are not available on this platform, use --serve without --socket")
+    # a socket file left behind by an earlier server would make bind fail
+    remove_socket_file(socket_path)
+    pool = ThreadPoolExecutor(max_workers=jobs)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            wfile = self.wfile
+            serve_stream(self.rfile, lambda text: wfile.write(text.encode()), pool, options)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    try:
+        # a plain kill stops the server like Ctrl+C does, so the socket file gets removed
+        signal.signal(signal.SIGTERM, stop_on_sigterm)
+        print(f"✅ Serving on {socket_path}", file=sys.stderr)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+        # anything else put at the path in the meantime is left alone
+        if is_socket(socket_path):
+            os.remove(socket_path)
+
+# removes the socket file at socket_path if there is one. Any other file there is an error, --socket never deletes it
+def remove_socket_file(socket_path):
+    if is_socket(socket_path):
+        os.remove(socket_path)
+    elif os.path.lexists(socket_path):
+        raise ValueError(f"{socket_path} exists and is not a socket")
+
+def is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except OSError:
+        return False
+
+def stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
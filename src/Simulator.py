@@ -0,0 +1,327 @@
+from src.Disassembler import decode_image
+from src.Line_Parser import format_operands
+from src.Encoder import register_map
+
+# Instruction set simulator for the rom/ram images, a quick functional check before the slow RTL runs.
+# The rom is predecoded once into (op, a, b, c) tuples: op picks the handler in the dispatch loop and the operands
+# are already what the handler needs (register numbers, sign/zero extended immediates, branch targets as instruction
+# indexes). Registers hold unsigned 32 bit values, the ram is a list of words.
+# Instructions run as written, there is no branch delay slot unless delay_slots is set. Writes to r0 go to a scratch
+# register so r0 stays 0.
+#
+# With delay_slots the instruction after every branch and jump runs before the jump is taken, like on the pipelined
+# core (see --schedule). The dispatch loop stays the same: every branch gets a trampoline after the end of the program,
+# a copy of its delay slot followed by a GOTO to the real target. A taken branch goes to its trampoline, a branch that
+# isn't taken runs into the slot as usual. jr keeps its target in a spare register while the slot runs
+#
+# A program stops when it returns (jr ra with ra still holding RETURN_ADDRESS), runs off the end of the rom, jumps to
+# itself (end: j end), or after max_steps instructions
+
+MASK = 0xFFFFFFFF
+SIGN = 0x80000000
+RETURN_ADDRESS = 0xFFFFFFFC   # ra at reset, jr ra to it ends the program
+SCRATCH = 32                  # register index that takes the writes to r0
+SAVED = 33                    # register index that holds the jr target while its delay slot runs
+
+# handler numbers, the dispatch loop tests them in this order so the common ones come first
+(ADDIU, ADDU, LW, SW, BEQ, BNE, SLL, J, OR, ORI, AND, ANDI, SUBU, SLT, SLTI, SLTU, SLTIU, XOR, XORI, SRL, SRA,
+ JAL, JR, BGEZ, BLTZ, BGTZ, BLEZ, MULT, MULTU, MFHI, MFLO, GOTO, JR_DELAYED, HALT, END, INVALID) = range(36)
+
+# the handlers that transfer control and get a trampoline with delay_slots
+delayed_ops = frozenset([BEQ, BNE, J, JAL, JR, BGEZ, BLTZ, BGTZ, BLEZ])
+
+handler_numbers = {
+    "addiu": ADDIU, "addu": ADDU, "lw": LW, "sw": SW, "beq": BEQ, "bne": BNE, "sll": SLL, "j": J, "or": OR,
+    "ori": ORI, "and": AND, "andi": ANDI, "subu": SUBU, "slt": SLT, "slti": SLTI, "sltu": SLTU, "sltiu": SLTIU,
+    "xor": XOR, "xori": XORI, "srl": SRL, "sra": SRA, "jal": JAL, "jr": JR, "bgez": BGEZ, "bltz": BLTZ,
+    "bgtz": BGTZ, "blez": BLEZ, "mult": MULT, "multu": MULTU, "mfhi": MFHI, "mflo": MFLO,
+}
+
+# a fault while running, pc is the byte address of the instruction
+class Simulation_Error(ValueError):
+    def __init__(self, message, pc=None):
+        self.pc = pc
+        super().__init__(f"{message} (pc {pc:08X})" if pc is not None else message)
+
+# one rom word as (op, a, b, c). index is the word's position in the rom, count the number of rom words
+def predecode(mnemonic, operands, index, count):
+    if mnemonic is None:
+        return (INVALID, 0, 0, 0)
+    op = handler_numbers[mnemonic]
+    values = [operand.value for operand in operands]
+
+    def dest(register):
+        return register or SCRATCH
+
+    # a target outside the rom ends the program there, the loop reports it
+    def target(word_index):
+        return word_index if 0 <= word_index < count else count
+
+    if op in (ADDU, SUBU, AND, OR, XOR, SLT, SLTU):
+        rd, rs, rt = values
+        return (op, dest(rd), rs, rt)
+    if op in (SLL, SRL, SRA):
+        rd, rt, shamt = values
+        return (op, dest(rd), rt, shamt)
+    if op in (ADDIU, ANDI, ORI, XORI, SLTI, SLTIU):
+        rt, rs, imm = values
+        if op == SLTI:
+            # signed compare done as unsigned with the sign bit flipped
+            imm = (imm & MASK) ^ SIGN
+        elif op == SLTIU:
+            imm &= MASK
+        return (op, dest(rt), rs, imm)
+    if op in (LW, SW):
+        rt, mem = operands
+        rt = dest(rt.value) if op == LW else rt.value
+        return (op, rt, mem.base.value, mem.value.value * 4)
+    if op in (BEQ, BNE):
+        rs, rt, word_index = values
+        # a branch that always goes to itself is the usual way to stop
+        if op == BEQ and rs == rt and word_index == index:
+            return (HALT, 0, 0, 0)
+        return (op, rs, rt, target(word_index))
+    if op in (BGEZ, BLTZ, BGTZ, BLEZ):
+        rs, word_index = values
+        if word_index == index and ((op == BGEZ or op == BLEZ) and rs == 0):
+            return (HALT, 0, 0, 0)
+        return (op, rs, 0, target(word_index))
+    if op in (J, JAL):
+        # the 26 bit field replaces the low bits of the pc, the roms are far smaller than the 256MB region
+        word_index = values[0]
+        if op == J and word_index == index:
+            return (HALT, 0, 0, 0)
+        # a is where jal returns to
+        return (op, index + 1, 0, target(word_index))
+    if op == JR:
+        return (op, values[0], 0, 0)
+    if op in (MULT, MULTU):
+        return (op, values[0], values[1], 0)
+    # mfhi/mflo
+    return (op, dest(values[0]), 0, 0)
+
+class Simulator:
+    def __init__(self, rom, ram=b"", ram_size=None, delay_slots=False):
+        # branch and jump targets come out of the decoder as word addresses of the rom
+        decoded = decode_image(rom, {}, {})
+        count = len(decoded)
+        self.program = [predecode(mnemonic, operands, index, count)
+                        for index, (mnemonic, operands) in enumerate(zip(decoded.mnemonics, decoded.operands))]
+        self.program.append((END, 0, 0, 0))
+        self.rom_words = decoded.words
+        self.count = count
+        self.slot_origins = {}    # trampoline index -> index of the delay slot it copies, for the pc in errors
+        if delay_slots:
+            self.add_trampolines()
+
+        ram = bytes(ram)
+        ram_size = max(ram_size or 0, len(ram))
+        ram += bytes(-len(ram) % 4 + ram_size - len(ram))
+        self.ram = [int.from_bytes(ram[i:i + 4], "big") for i in range(0, len(ram), 4)]
+        self.reset()
+
+    # every branch at k jumps to [copy of k + 1, GOTO target] instead, jal returns past its slot
+    def add_trampolines(self):
+        program = self.program
+        for index in range(self.count):
+            op, a, b, c = program[index]
+            if op not in delayed_ops:
+                continue
+            trampoline = len(program)
+            self.slot_origins[trampoline] = index + 1
+            program.append(program[index + 1])
+            if op == JR:
+                program[index] = (JR_DELAYED, a, 0, trampoline)
+                program.append((JR, SAVED, 0, 0))
+            else:
+                program[index] = (op, index + 2 if op == JAL else a, b, trampoline)
+                program.append((GOTO, 0, 0, c))
+
+    # byte address of a program index, a trampoline stands for the delay slot it copies
+    def pc_of(self, index):
+        return self.slot_origins.get(index, index) * 4
+
+    def reset(self):
+        self.registers = [0] * 34
+        self.registers[register_map["ra"]] = RETURN_ADDRESS
+        self.registers[register_map["sp"]] = len(self.ram) * 4   # stack grows down from the top of the ram
+        self.hi = 0
+        self.lo = 0
+        self.pc = 0
+        self.index = 0
+        self.steps = 0
+        self.status = None
+
+    # runs from self.pc until the program stops or max_steps more instructions ran. Returns the status:
+    # "returned", "halted" (jumped to itself), "end" (ran off the rom) or "limit"
+    def run(self, max_steps=None):
+        if self.pc & 3:
+            raise Simulation_Error("Unaligned pc", self.pc)
+        program = self.program
+        r = self.registers
+        mem = self.ram
+        hi = self.hi
+        lo = self.lo
+        # a run that stopped inside a trampoline goes on from there, as long as nobody moved the pc
+        i = self.index if self.pc_of(self.index) == self.pc else min(self.pc >> 2, self.count)
+        end = self.count
+        extra = 0   # GOTO and JR_DELAYED, which aren't instructions of the program
+        status = "limit"
+        steps = 0
+
+        try:
+            for steps in range(max_steps if max_steps is not None else 1 << 62):
+                op, a, b, c = program[i]
+                if op == ADDIU:
+                    r[a] = (r[b] + c) & MASK
+                elif op == ADDU:
+                    r[a] = (r[b] + r[c]) & MASK
+                elif op == LW:
+                    address = (r[b] + c) & MASK
+                    if address & 3:
+                        raise Simulation_Error(f"Unaligned load from {address:08X}", self.pc_of(i))
+                    r[a] = mem[address >> 2]
+                elif op == SW:
+                    address = (r[b] + c) & MASK
+                    if address & 3:
+                        raise Simulation_Error(f"Unaligned store to {address:08X}", self.pc_of(i))
+                    mem[address >> 2] = r[a]
+                elif op == BEQ:
+                    i = c if r[a] == r[b] else i + 1
+                    continue
+                elif op == BNE:
+                    i = c if r[a] != r[b] else i + 1
+                    continue
+                elif op == SLL:
+                    r[a] = (r[b] << c) & MASK
+                elif op == J:
+                    i = c
+                    continue
+                elif op == OR:
+                    r[a] = r[b] | r[c]
+                elif op == ORI:
+                    r[a] = r[b] | c
+                elif op == AND:
+                    r[a] = r[b] & r[c]
+                elif op == ANDI:
+                    r[a] = r[b] & c
+                elif op == SUBU:
+                    r[a] = (r[b] - r[c]) & MASK
+                elif op == SLT:
+                    r[a] = int(r[b] ^ SIGN < r[c] ^ SIGN)
+                elif op == SLTI:
+                    r[a] = int(r[b] ^ SIGN < c)
+                elif op == SLTU:
+                    r[a] = int(r[b] < r[c])
+                elif op == SLTIU:
+                    r[a] = int(r[b] < c)
+                elif op == XOR:
+                    r[a] = r[b] ^ r[c]
+                elif op == XORI:
+                    r[a] = r[b] ^ c
+                elif op == SRL:
+                    r[a] = r[b] >> c
+                elif op == SRA:
+                    r[a] = (((r[b] ^ SIGN) - SIGN) >> c) & MASK
+                elif op == JAL:
+                    r[31] = a * 4
+                    i = c
+                    continue
+                elif op == JR:
+                    address = r[a]
+                    if address == RETURN_ADDRESS:
+                        status = "returned"
+                        steps += 1
+                        break
+                    if address & 3:
+                        raise Simulation_Error(f"Unaligned jump to {address:08X}", self.pc_of(i))
+                    i = min(address >> 2, end)
+                    continue
+                elif op == BGEZ:
+                    i = c if r[a] < SIGN else i + 1
+                    continue
+                elif op == BLTZ:
+                    i = c if r[a] >= SIGN else i + 1
+                    continue
+                elif op == BGTZ:
+                    i = c if 0 < r[a] < SIGN else i + 1
+                    continue
+                elif op == BLEZ:
+                    i = c if r[a] == 0 or r[a] >= SIGN else i + 1
+                    continue
+                elif op == MULT:
+                    product = ((r[a] ^ SIGN) - SIGN) * ((r[b] ^ SIGN) - SIGN)
+                    hi = (product >> 32) & MASK
+                    lo = product & MASK
+                elif op == MULTU:
+                    product = r[a] * r[b]
+                    hi = product >> 32
+                    lo = product & MASK
+                elif op == MFHI:
+                    r[a] = hi
+                elif op == MFLO:
+                    r[a] = lo
+                elif op == GOTO:
+                    extra += 1
+                    i = c
+                    continue
+                elif op == JR_DELAYED:
+                    extra += 1
+                    r[SAVED] = r[a]
+                    i = c
+                    continue
+                elif op == HALT:
+                    status = "halted"
+                    steps += 1
+                    break
+                elif op == END:
+                    status = "end"
+                    break
+                else:
+                    raise Simulation_Error(f"Invalid instruction {self.rom_words[self.pc_of(i) >> 2]:08X}", self.pc_of(i))
+                i += 1
+            else:
+                steps = max_steps
+            # steps counted the instructions before the one that stopped the loop
+        except IndexError:
+            # only the ram can be indexed out of range, the program list ends with END
+            raise Simulation_Error(f"RAM access at {address:08X} is outside the {len(mem) * 4} byte RAM", self.pc_of(i)) from None
+        finally:
+            r[SCRATCH] = 0
+            self.hi = hi
+            self.lo = lo
+            self.pc = self.pc_of(i)
+            self.index = i
+
+        self.steps += steps - extra
+        self.status = status
+        return status
+
+    # the ram as big-endian bytes
+    def ram_bytes(self):
+        return b"".join(word.to_bytes(4, "big") for word in self.ram)
+
+    # registers, hi/lo and pc, four registers per line
+    def dump_registers(self):
+        rows = []
+        for base in range(0, 32, 4):
+            rows.append("  ".join(f"r{n:<2} {self.registers[n]:08X}" for n in range(base, base + 4)))
+        rows.append(f"hi  {self.hi:08X}  lo  {self.lo:08X}  pc  {self.pc:08X}  steps {self.steps:,}")
+        return "\n".join(rows)
+
+    # words of the ram from start (bytes) for length bytes, zero words are skipped
+    def dump_memory(self, start=0, length=None):
+        first = start >> 2
+        last = len(self.ram) if length is None else min(len(self.ram), (start + length + 3) >> 2)
+        return "\n".join(f"{index * 4:08X}: {self.ram[index]:08X}" for index in range(first, last) if self.ram[index])
+
+    # the instruction at pc as source, for error messages and traces
+    def current_instruction(self):
+        index = self.pc >> 2
+        if index >= len(self.rom_words):
+            return "(end of rom)"
+        word = self.rom_words[index]
+        decoded = decode_image(word.to_bytes(4, "big"), {}, {}, self.pc)
+        if decoded.mnemonics[0] is None:
+            return f".word 0x{word:08X}"
+        return f"{decoded.mnemonics[0]} {format_operands(decoded.operands[0])}".rstrip()
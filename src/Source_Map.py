@@ -0,0 +1,198 @@
+import struct
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from src.Line_Parser import Expansion
+from src.Utilities import pack_column, unpack_column
+
+# Address -> source map of a rom image (--source-map), for traces and debuggers. Every instruction knows the line it
+# came from (see Parsed_Line.line_no/origin). The map has one entry per run of words, a run is one word per line
+# over consecutive lines (consecutive body lines inside a macro), the way straight code is written:
+#   address    first byte address of the run, the run goes on until the next entry
+#   file       index into the file names, 0 is the source itself
+#   line       line of the first word in that file. For a macro expansion the line of the call
+#   macro      index into the macro names, NO_MACRO for lines that weren't expanded from a macro
+#   macro line line of the first word in the body of the macro
+# The word at address + 4 * k of a run is on line + k (macro line + k inside a macro). An entry with file NO_SOURCE
+# ends the run before it where .org left a gap. Entries are sorted by address, so a lookup is one bisect, and a
+# whole trace of addresses is looked up at once with NumPy when it is installed.
+#
+# File layout, big-endian:
+#   magic "MIPSMAP" + version byte
+#   header    entries, file names, macro names, string bytes (4 x u32)
+#   strings   the file names then the macro names, utf-8, each ended by a zero byte
+#   columns   addresses, lines, macro lines (u32 each), then files, macros (u16 each). Column by column like the
+#             relocations of an object file, every column is read as one array
+
+MAGIC = b"MIPSMAP\x01"
+HEADER = struct.Struct(">4I")
+NO_MACRO = 0xFFFF
+NO_SOURCE = 0xFFFF
+
+# what lookup gives back. path is None for the source itself, macro and macro_line are None outside macros
+Source_Location = namedtuple("Source_Location", "path line_no macro macro_line")
+
+class Source_Map:
+    def __init__(self, files, macros, addresses=(), lines=(), macro_lines=(), file_indexes=(), macro_indexes=()):
+        self.files = files          # file names, files[0] is the source itself (None when it has no path)
+        self.macros = macros        # macro names
+        self.addresses = array("I", addresses)
+        self.lines = array("I", lines)
+        self.macro_lines = array("I", macro_lines)
+        self.file_indexes = array("H", file_indexes)
+        self.macro_indexes = array("H", macro_indexes)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    # the map of laid out text lines (their address, line_no and origin set), source_path is the source's own name
+    @classmethod
+    def build(cls, text_lines, source_path=None):
+        files = {None: 0}
+        macros = {}
+        source_map = cls([source_path], [])
+        expected = None    # the fields the next word needs to continue the run
+        end = None
+        # .org can put the lines out of address order
+        for line in sorted((line for line in text_lines if line.mnemonic is not None and line.address is not None),
+                           key=lambda line: line.address):
+            origin = line.origin
+            if isinstance(origin, Expansion):
+                path, line_no = origin.path, origin.line_no
+                macro = macros.setdefault(origin.macro, len(macros))
+                macro_line = line.line_no or 0
+            else:
+                path, line_no = origin, line.line_no
+                macro, macro_line = NO_MACRO, 0
+            file = files.get(path)
+            if file is None:
+                file = files[path] = len(files)
+                source_map.files.append(path)
+            key = (line_no or 0, macro_line, file, macro)
+
+            if end is not None and line.address != end:
+                # a gap, nothing maps there
+                source_map.append(end, (0, 0, NO_SOURCE, NO_MACRO))
+                expected = None
+            if key != expected:
+                source_map.append(line.address, key)
+            line_no, macro_line = key[:2]
+            expected = (line_no + 1, macro_line, file, macro) if macro == NO_MACRO else (line_no, macro_line + 1, file, macro)
+            end = line.address + 4
+        if end is not None:
+            source_map.append(end, (0, 0, NO_SOURCE, NO_MACRO))
+        source_map.macros = list(macros)
+        return source_map
+
+    # adds an entry, fields is (line, macro line, file, macro)
+    def append(self, address, fields):
+        self.addresses.append(address)
+        line, macro_line, file, macro = fields
+        self.lines.append(line)
+        self.macro_lines.append(macro_line)
+        self.file_indexes.append(file)
+        self.macro_indexes.append(macro)
+
+    # the Source_Location of the word at address, which is in the run of entry index. None for the entries that
+    # end a run and before the first one
+    def location(self, index, address):
+        if index < 0:
+            return None
+        file = self.file_indexes[index]
+        if file == NO_SOURCE:
+            return None
+        step = (address - self.addresses[index]) >> 2
+        macro = self.macro_indexes[index]
+        if macro == NO_MACRO:
+            return Source_Location(self.files[file], self.lines[index] + step, None, None)
+        return Source_Location(self.files[file], self.lines[index], self.macros[macro], self.macro_lines[index] + step)
+
+    # where the word at a byte address came from, or None
+    def lookup(self, address):
+        return self.location(bisect_right(self.addresses, address) - 1, address)
+
+    # the entry index of every address, -1 before the first entry. An array with NumPy, a list without
+    def lookup_indexes(self, addresses):
+        if np is not None:
+            return np.searchsorted(np.frombuffer(self.addresses, np.uint32), np.asarray(addresses, np.int64), "right") - 1
+        return [bisect_right(self.addresses, address) - 1 for address in addresses]
+
+    # Source_Location (or None) of every address, for a whole trace. Every address is turned into a location once
+    def lookup_many(self, addresses):
+        addresses = list(addresses)
+        locations = {}
+        result = []
+        for index, address in zip(self.lookup_indexes(addresses), addresses):
+            location = locations.get(address, False)
+            if location is False:
+                location = locations[address] = self.location(int(index), address)
+            result.append(location)
+        return result
+
+    # "main.asm:12", "lib.asm:3" or "main.asm:12 (macro PUSH:2)" for a location, the source itself is called name
+    def format(self, location, name="<source>"):
+        if location is None:
+            return "?"
+        path = location.path or self.files[0] or name
+        text = f"{path}:{location.line_no}"
+        if location.macro is not None:
+            text += f" (macro {location.macro}:{location.macro_line})"
+        return text
+
+    def to_bytes(self):
+        strings = bytearray()
+        for name in self.files + self.macros:
+            strings += (name or "").encode() + b"\0"
+        parts = [MAGIC, HEADER.pack(len(self.addresses), len(self.files), len(self.macros), len(strings)), strings]
+        for column in (self.addresses, self.lines, self.macro_lines, self.file_indexes, self.macro_indexes):
+            parts.append(pack_column(column, column.typecode))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, name="<source map>"):
+        data = memoryview(data)
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{name} is not a source map of this assembler (see --source-map)")
+        try:
+            count, file_count, macro_count, string_size = HEADER.unpack_from(data, len(MAGIC))
+            position = len(MAGIC) + HEADER.size
+            names = bytes(data[position:position + string_size]).split(b"\0")[:-1]
+            position += string_size
+            if len(names) != file_count + macro_count:
+                raise ValueError
+            names = [name.decode() for name in names]
+            files = [name or None for name in names[:file_count]]
+
+            columns = []
+            for typecode in "IIIHH":
+                size = array(typecode).itemsize * count
+                columns.append(unpack_column(data[position:position + size], typecode))
+                position += size
+        except (struct.error, ValueError, UnicodeDecodeError):
+            raise ValueError(f"{name} is a truncated or damaged source map") from None
+        if position != len(data) or any(len(column) != count for column in columns):
+            raise ValueError(f"{name} is a truncated or damaged source map")
+        return cls(files, names[file_count:], *columns)
+
+# reads a map written by --source-map
+def read_source_map(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        raise ValueError(f"Can't read {path}: {e}") from None
+    return Source_Map.from_bytes(data, path)
+
+# The symbol file (--source-map): one "address kind name" line per symbol, sorted by address like nm prints them.
+# kind is T for .text labels, D for .data labels and A for .equ constants (their value, not an address)
+def symbol_lines(symbols, sections, constants):
+    rows = [(address, "D" if sections.get(label) == ".data" else "T", label) for label, address in symbols.items()]
+    rows += [(value & 0xFFFFFFFF, "A", name) for name, value in constants.items()]
+    rows.sort()
+    return [f"{address:08x} {kind} {name}" for address, kind, name in rows]
@@ -1,7 +1,28 @@
+import gc
+import glob
 import os
 import sys
+from array import array
+from contextlib import contextmanager
+from itertools import repeat
+
+from src.Memory_Image import Memory_Image
+
+# Pauses the cycle collector for a stage that builds a lot of records or tuples in one go. None of them form cycles,
+# but every allocation counts towards the next collection, and each collection rescans the growing lists for nothing.
+# Only used where a benchmark showed a gain, nested uses leave the collector as the outer one found it
+@contextmanager
+def paused_gc():
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
 
-def write_output_file(path, lines, label=""):
+# creates the directory of an output path, returns False if that fails
+def make_output_dir(path):
     output_dir = os.path.dirname(path)
 
     # Trying to create the directory if it exists in the path
@@ -10,104 +31,201 @@ def write_output_file(path, lines, label=""):
             os.makedirs(output_dir, exist_ok=True)
         except Exception as e:
             print(f"❌ Could not create output directory '{output_dir}': {e}")
-            return
+            return False
+    return True
+
+# lines can be a generator that is still assembling (--stream). They go to <path>.tmp first, which only replaces
+# path once every line is written, so an error half way leaves no truncated file behind
+def write_output_file(path, lines, label=""):
+    if not make_output_dir(path):
+        return
 
     # Now we try writing to the file
+    temp_path = path + ".tmp"
     try:
-        with open(path, "w") as f:
+        with open(temp_path, "w") as f:
             f.writelines(line + "\n" for line in lines)
+        os.replace(temp_path, path)
         print(f"✅ {label} written to: {path}")
     except FileNotFoundError:
         print(f"❌ Output directory not found or invalid for: {path}")
-    except Exception as e:
+    except OSError as e:
+        remove_file(temp_path)
         print(f"❌ Failed to write {label}: {e}")
+    except BaseException:
+        remove_file(temp_path)
+        raise
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
 
+# writes a whole file in one go, data is text or bytes
+def write_output_data(path, data, label=""):
+    if not make_output_dir(path):
+        return
 
-#converts .data section directives into the bytes needed for the data memory hex file
-def encode_data_directives(lines):
+    try:
+        with open(path, "wb" if isinstance(data, (bytes, bytearray)) else "w") as f:
+            f.write(data)
+        print(f"✅ {label} written to: {path}")
+    except FileNotFoundError:
+        print(f"❌ Output directory not found or invalid for: {path}")
+    except OSError as e:
+        print(f"❌ Failed to write {label}: {e}")
 
-    byte_list = []
+
+# expands directories, glob patterns and @manifest files into a list of .asm paths (duplicates removed, order kept)
+def collect_asm_files(sources):
+    paths = []
+    for source in sources:
+        # a manifest lists one path, directory or glob per line, relative to the manifest
+        if source.startswith("@"):
+            manifest = source[1:]
+            base_dir = os.path.dirname(manifest)
+            with open(manifest, "r") as f:
+                entries = [line.split("#")[0].strip() for line in f]
+            paths.extend(collect_asm_files(os.path.join(base_dir, entry) for entry in entries if entry))
+        elif os.path.isdir(source):
+            paths.extend(sorted(glob.glob(os.path.join(source, "**", "*.asm"), recursive=True)))
+        elif glob.has_magic(source):
+            paths.extend(sorted(glob.glob(source, recursive=True)))
+        else:
+            paths.append(source)
+
+    return list(dict.fromkeys(paths))
+
+
+# packs .word values into big-endian bytes
+def pack_words(values):
+    return b"".join((val & 0xFFFFFFFF).to_bytes(4, "big") for val in values)
+
+# packs .byte values into whole words, a short last group is padded from the left (MSB-first, big-endian)
+def pack_bytes(values):
+    packed = bytearray()
+    for i in range(0, len(values), 4):
+        group = bytes(val & 0xFF for val in values[i:i + 4])
+        packed += bytes(4 - len(group)) + group
+    return packed
+
+# a column of numbers as big-endian bytes (u32 by default, any array typecode), and back. The object files, source
+# maps and MIF writer store or format whole columns at once with these
+def pack_column(values, typecode="I"):
+    column = array(typecode, values)
+    if sys.byteorder == "little":
+        column.byteswap()
+    return column.tobytes()
+
+def unpack_column(data, typecode="I"):
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == "little":
+        column.byteswap()
+    return column
+
+# the bytes of .ascii/.asciiz/.incbin/.fill without the padding to the next word, .fill is built by repeating the
+# value's bytes, strings and .incbin already hold theirs (a memoryview of the mapped file for .incbin)
+def data_bytes(line):
+    if line.directive == ".fill":
+        count, size, value = line.values
+        return (value & ((1 << (8 * size)) - 1)).to_bytes(size, "big") * count
+    return line.values
+
+#converts .data section directives into the sparse ram image used for the data memory hex file
+def encode_data_directives(lines, ram_size=None):
+    ram = Memory_Image("RAM", ram_size)
+    current_addr = 0
+
+    for line in lines:
+        if line.section == ".data":
+            current_addr = encode_data_line(ram, line, current_addr)
+
+    return ram
+
+# writes one .data line into the ram image at current_addr, returns the address after it
+def encode_data_line(ram, line, current_addr):
+    directive = line.directive
+
+    # handling .org, the gap is left unallocated
+    if directive == ".org":
+        new_addr = line.value * 4  # word-aligned
+        if new_addr < current_addr:
+            raise ValueError(f".org address {hex(new_addr)} precedes current address {hex(current_addr)}")
+        ram.reserve(current_addr, new_addr - current_addr)
+        current_addr = new_addr
+
+    # handling .byte
+    elif directive == ".byte":
+        data = pack_bytes(line.values)
+        ram.write(current_addr, data)
+        current_addr += len(data)
+
+    # handling. word
+    elif directive == ".word":
+        data = pack_words(line.values)
+        ram.write(current_addr, data)
+        current_addr += len(data)
+
+    # handling.space
+    elif directive == ".space":
+        byte_count = line.value * 4
+        ram.reserve(current_addr, byte_count)
+        current_addr += byte_count
+
+    # handling .fill of zeros like .space, nothing is allocated
+    elif directive == ".fill" and line.values[2] == 0:
+        byte_count = (line.values[0] * line.values[1] + 3) & ~3
+        ram.reserve(current_addr, byte_count)
+        current_addr += byte_count
+
+    # handling .ascii, .asciiz, .incbin and .fill, the bytes go into the image as one slice and are zero padded
+    # to the next word (at the end, unlike .byte: strings and files are read from their first byte)
+    elif directive in (".ascii", ".asciiz", ".incbin", ".fill"):
+        data = data_bytes(line)
+        ram.write(current_addr, data)
+        current_addr += len(data)
+        if current_addr & 3:
+            ram.write(current_addr, bytes(-current_addr & 3))
+            current_addr += -current_addr & 3
+
+    return current_addr
+
+# streaming version of encode_data_directives, yields the ram bytes in order with the gaps zero filled
+def iter_data_bytes(lines):
     current_addr = 0
-    byte_buffer = []  # holds pending .byte values
-    # we use this function for padding
-    def flush_byte_buffer():
-        nonlocal current_addr
-        while byte_buffer:
-            group = byte_buffer[:4]
-            del byte_buffer[:4]
-
-            # Pad to 4 bytes from the left (MSB-first, big-endian)
-            padding = [0x00] * (4 - len(group))
-            full_word = padding + group
-
-            # Combine into a 32-bit word for clarity
-            word = (
-                (full_word[0] << 24) |
-                (full_word[1] << 16) |
-                (full_word[2] << 8) |
-                full_word[3]
-            )
-
-        # Break into big-endian bytes
-            word_bytes = [
-            (word >> 24) & 0xFF,
-            (word >> 16) & 0xFF,
-            (word >> 8) & 0xFF,
-            word & 0xFF
-            ]
-
-
-            byte_list.extend(word_bytes)
-            current_addr += 4
 
     for line in lines:
-        if line.get("section") != ".data":
+        if line.section != ".data":
             continue
 
-        directive = line.get("directive")
+        directive = line.directive
 
         # handling .org
         if directive == ".org":
-            flush_byte_buffer()
-            new_addr = int(line["value"], 0) * 4  # word-aligned
+            new_addr = line.value * 4  # word-aligned
             padding = new_addr - current_addr
             if padding < 0:
                 raise ValueError(f".org address {hex(new_addr)} precedes current address {hex(current_addr)}")
-            byte_list.extend([0x00] * padding)
+            yield from repeat(0x00, padding)
             current_addr = new_addr
 
-        # handling .byte
-        elif directive == ".byte":
-            for val in line.get("values", []):
-                byte_buffer.append(val & 0xFF)
-            flush_byte_buffer()
-
-        # handling. word
-        elif directive == ".word":
-            flush_byte_buffer()
-            for val in line.get("values", []):
-                word_bytes = [
-                    (val >> 24) & 0xFF,
-                    (val >> 16) & 0xFF,
-                    (val >> 8) & 0xFF,
-                    val & 0xFF
-                ]
-                byte_list.extend(word_bytes)
-                current_addr += 4
+        # handling .byte and .word
+        elif directive in (".byte", ".word"):
+            data = pack_bytes(line.values) if directive == ".byte" else pack_words(line.values)
+            yield from data
+            current_addr += len(data)
 
         # handling.space
         elif directive == ".space":
-            flush_byte_buffer()
-            word_count = int(line["value"], 0)
-            byte_count = word_count * 4
-            byte_list.extend([0x00] * byte_count)
+            byte_count = line.value * 4
+            yield from repeat(0x00, byte_count)
             current_addr += byte_count
 
-        #  skip all other directives
-        else:
-            continue
-
-
-    flush_byte_buffer()  # flush any remaining bytes
-    return byte_list
-
+        # handling .ascii, .asciiz, .incbin and .fill, zero padded at the end
+        elif directive in (".ascii", ".asciiz", ".incbin", ".fill"):
+            data = data_bytes(line)
+            yield from data
+            yield from repeat(0x00, -len(data) & 3)
+            current_addr += (len(data) + 3) & ~3
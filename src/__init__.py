@@ -0,0 +1,5 @@
+# bump this whenever the same source can assemble to different output, it is part of the cache key
+__version__ = "1.2.0"
+
+# library entry point, see src/Assembler.py
+from src.Assembler import assemble, Assembly_Result, Assembly_Error, Diagnostic